@@ -1,5 +1,5 @@
 from django.contrib import admin 
-from .models import UserProfile, Service, Activite, PCOPEntry, Structure, Suivi, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Direction, Division
+from .models import UserProfile, Service, Activite, PCOPEntry, Structure, Suivi, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Direction, Division, Job
 
 admin.site.register(UserProfile) 
 admin.site.register(Service) 
@@ -12,3 +12,4 @@ admin.site.register(Suivi)
 admin.site.register(Direction)
 admin.site.register(Division)
 admin.site.register(Structure)
+admin.site.register(Job)
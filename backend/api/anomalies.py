@@ -0,0 +1,184 @@
+"""
+Détection des anomalies budgétaires des activités.
+
+Deux contrôles, calculés sur tout le PTA en une passe NumPy :
+- coût unitaire atypique : pour chaque compte PCOP, médiane, MAD (écart
+  absolu médian) et percentiles des coûts unitaires saisis ; une activité
+  est signalée quand son score robuste |coût − médiane| / (1,4826 × MAD)
+  dépasse SEUIL_SCORE_ROBUSTE ;
+- montant incohérent : montant ≠ coût unitaire × quantité.
+
+Les statistiques par compte sont obtenues sur des tableaux triés par
+(compte, valeur) : la médiane et les percentiles d'un compte se lisent à
+des positions calculées depuis le début et la taille de son bloc, sans
+boucle Python par compte.
+
+Les anomalies sont enregistrées dans AnomalieBudget, remplacées à chaque
+analyse (tâche 'detecter_anomalies', manage.py detecter_anomalies à
+planifier la nuit).
+
+NumPy est importé à l'exécution : sans lui, l'analyse lève ImportError.
+"""
+import logging
+import time
+
+from django.db import connection, transaction
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from .models import Activite, AnomalieBudget
+
+logger = logging.getLogger(__name__)
+
+# Seuil usuel du score robuste (Iglewicz et Hoaglin)
+SEUIL_SCORE_ROBUSTE = 3.5
+# En dessous, la dispersion d'un compte n'est pas estimée
+MIN_ACTIVITES_PAR_COMPTE = 5
+# Écart toléré entre montant et coût unitaire × quantité (arrondi au centime), et sa part relative
+TOLERANCE_MONTANT = 0.01
+TOLERANCE_MONTANT_RELATIVE = 1e-12
+TAILLE_PAQUET = 50000
+TAILLE_PAQUET_ECRITURE = 2000
+
+
+def charger_budgets():
+    """
+    Tableau (n, 5) des colonnes id, pcop_id, cout_unitaire, quantite, montant
+    de toutes les activités, NaN pour les valeurs absentes.
+    """
+    import numpy as np
+
+    queryset = Activite.objects.order_by().values_list(
+        'id', 'pcop_id', Cast('cout_unitaire', FloatField()), Cast('quantite', FloatField()),
+        Cast('montant', FloatField()),
+    )
+    sql, params = queryset.query.sql_with_params()
+    # Lecture par paquets convertis aussitôt : pas de liste de tuples pour tout le PTA
+    paquets = []
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while lignes := cursor.fetchmany(TAILLE_PAQUET):
+            paquets.append(np.array(lignes, dtype=float))
+    return np.concatenate(paquets) if paquets else np.empty((0, 5))
+
+
+def quantiles_groupes(valeurs, debuts, tailles, q):
+    """
+    Quantile q (interpolation linéaire) de chaque groupe d'un tableau trié par
+    (groupe, valeur), chaque groupe occupant valeurs[debut:debut + taille].
+    """
+    import numpy as np
+
+    position = debuts + q * (tailles - 1)
+    bas = np.floor(position).astype(np.int64)
+    haut = np.ceil(position).astype(np.int64)
+    return valeurs[bas] + (valeurs[haut] - valeurs[bas]) * (position - bas)
+
+
+def statistiques_par_compte(comptes, couts):
+    """
+    Statistiques robustes des coûts par compte. Retourne (codes, tailles,
+    médiane, MAD, p10, p90) par compte, puis l'ordre de tri des coûts, le
+    compte (indice dans codes) et la valeur de chaque coût trié.
+    """
+    import numpy as np
+
+    ordre = np.lexsort((couts, comptes))
+    valeurs = couts[ordre]
+    codes, debuts, tailles = np.unique(comptes[ordre], return_index=True, return_counts=True)
+    groupes = np.repeat(np.arange(len(codes)), tailles)
+
+    mediane = quantiles_groupes(valeurs, debuts, tailles, 0.5)
+    p10 = quantiles_groupes(valeurs, debuts, tailles, 0.1)
+    p90 = quantiles_groupes(valeurs, debuts, tailles, 0.9)
+    ecarts = np.abs(valeurs - mediane[groupes])
+    mad = quantiles_groupes(ecarts[np.lexsort((ecarts, groupes))], debuts, tailles, 0.5)
+    return codes, tailles, mediane, mad, p10, p90, ordre, groupes, valeurs
+
+
+def detecter(budgets):
+    """
+    Anomalies du tableau produit par charger_budgets : liste de dictionnaires
+    (activité, compte, type, valeur, référence, score, et pour les coûts
+    atypiques MAD, p10 et p90 du compte).
+    """
+    import numpy as np
+
+    ids, pcop, couts, quantites, montants = budgets.T
+    anomalies = []
+
+    def anomalie(ligne, **valeurs):
+        compte = pcop[ligne]
+        return {'activite_id': int(ids[ligne]), 'pcop_id': None if np.isnan(compte) else int(compte), **valeurs}
+
+    # Coûts unitaires atypiques, compte par compte
+    lignes = np.flatnonzero(~np.isnan(pcop) & ~np.isnan(couts))
+    codes, tailles, mediane, mad, p10, p90, ordre, groupes, valeurs = statistiques_par_compte(pcop[lignes], couts[lignes])
+    echelle = 1.4826 * mad
+    # MAD nulle (plus de la moitié des coûts identiques) : écart absolu moyen à la médiane
+    moyenne_ecarts = np.bincount(groupes, np.abs(valeurs - mediane[groupes]), len(codes)) / tailles
+    echelle = np.where(echelle > 0, echelle, 1.2533 * moyenne_ecarts)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scores = np.abs(valeurs - mediane[groupes]) / echelle[groupes]
+    atypiques = np.flatnonzero((tailles[groupes] >= MIN_ACTIVITES_PAR_COMPTE) & (scores > SEUIL_SCORE_ROBUSTE))
+    for position, groupe in zip(atypiques.tolist(), groupes[atypiques].tolist()):
+        anomalies.append(anomalie(
+            lignes[ordre[position]], type='cout_atypique', valeur=float(valeurs[position]),
+            reference=float(mediane[groupe]), score=float(scores[position]),
+            mad=float(mad[groupe]), p10=float(p10[groupe]), p90=float(p90[groupe]),
+        ))
+
+    # Montant différent du produit coût unitaire × quantité
+    attendus = couts * quantites
+    with np.errstate(invalid='ignore'):
+        ecarts = np.abs(montants - attendus)
+        incoherents = np.flatnonzero(
+            ecarts > np.maximum(TOLERANCE_MONTANT, TOLERANCE_MONTANT_RELATIVE * np.abs(attendus))
+        )
+    for ligne in incoherents.tolist():
+        anomalies.append(anomalie(
+            ligne, type='montant_incoherent', valeur=float(montants[ligne]), reference=float(attendus[ligne]),
+            score=float(ecarts[ligne] / max(abs(attendus[ligne]), 1.0)),
+        ))
+    return anomalies
+
+
+def analyser_budgets(progression=None):
+    """
+    Recalcule les anomalies budgétaires de tout le PTA et remplace celles
+    enregistrées. `progression(fait, total)` est appelé après chaque paquet écrit.
+    """
+    debut = time.perf_counter()
+    budgets = charger_budgets()
+    chargement = time.perf_counter() - debut
+    anomalies = detecter(budgets)
+    calcul = time.perf_counter() - debut - chargement
+
+    maintenant = timezone.now()
+    # Montants et statistiques arrondis au centime, score à 4 décimales
+    objets = [
+        AnomalieBudget(
+            **{cle: round(v, 4 if cle == 'score' else 2) if isinstance(v, float) else v for cle, v in anomalie.items()},
+            detectee_le=maintenant,
+        )
+        for anomalie in anomalies
+    ]
+    with transaction.atomic(), connection.cursor() as cursor:
+        # DELETE direct : QuerySet.delete() relirait chaque ligne pour le signal post_delete
+        cursor.execute(f"DELETE FROM {AnomalieBudget._meta.db_table}")
+        for depart in range(0, len(objets), TAILLE_PAQUET_ECRITURE):
+            AnomalieBudget.objects.bulk_create(objets[depart:depart + TAILLE_PAQUET_ECRITURE])
+            if progression:
+                progression(min(depart + TAILLE_PAQUET_ECRITURE, len(objets)), len(objets))
+
+    bilan = {
+        'activites': len(budgets),
+        'couts_atypiques': sum(1 for a in anomalies if a['type'] == 'cout_atypique'),
+        'montants_incoherents': sum(1 for a in anomalies if a['type'] == 'montant_incoherent'),
+        'duree_chargement_secondes': round(chargement, 3),
+        'duree_calcul_secondes': round(calcul, 3),
+        'duree_secondes': round(time.perf_counter() - debut, 3),
+    }
+    logger.info(f"Anomalies budgétaires recalculées : {bilan}")
+    return bilan
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        # Branche le journal des requêtes lentes sur les connexions (signal connection_created)
+        from . import requetes_lentes  # noqa: F401
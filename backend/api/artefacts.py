@@ -0,0 +1,143 @@
+"""
+Exports précalculés, versionnés et servis depuis MEDIA_ROOT.
+
+Un artefact est identifié par le type d'export, ses paramètres et la version
+des données (VersionDonnees) : tant que rien ne change en base, le même
+fichier est resservi sans être reconstruit. Les réponses passent par
+FileResponse (compatible sendfile) et gèrent les requêtes Range.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils.http import http_date
+
+from .metriques import observer_cache_export
+from .models import version_donnees
+
+logger = logging.getLogger(__name__)
+
+REPERTOIRE_EXPORTS = 'exports'
+TAILLE_BLOC = 64 * 1024
+
+
+def repertoire_exports():
+    chemin = os.path.join(settings.MEDIA_ROOT, REPERTOIRE_EXPORTS)
+    os.makedirs(chemin, exist_ok=True)
+    return chemin
+
+
+def cle_artefact(type_export, parametres, version):
+    empreinte = hashlib.sha1(json.dumps(parametres, sort_keys=True, default=str).encode()).hexdigest()[:12]
+    return f"{type_export}_v{version}_{empreinte}"
+
+
+def obtenir_artefact(type_export, parametres, construire, extension, forcer=False):
+    """
+    Retourne (chemin, depuis_cache) de l'artefact correspondant à la version
+    courante des données. `construire(fichier)` écrit le contenu dans le
+    fichier binaire ouvert ; l'écriture est atomique (fichier temporaire puis
+    renommage), une construction concurrente ne produit donc jamais de fichier partiel.
+    """
+    cle = cle_artefact(type_export, parametres, version_donnees())
+    chemin = os.path.join(repertoire_exports(), f"{cle}.{extension}")
+    if not forcer and os.path.exists(chemin):
+        observer_cache_export(type_export, True)
+        return chemin, True
+
+    debut = time.perf_counter()
+    descripteur, temporaire = tempfile.mkstemp(dir=repertoire_exports(), suffix='.tmp')
+    try:
+        with os.fdopen(descripteur, 'wb') as fichier:
+            construire(fichier)
+        os.replace(temporaire, chemin)
+    except BaseException:
+        os.unlink(temporaire)
+        raise
+    observer_cache_export(type_export, False, time.perf_counter() - debut)
+    logger.info(f"Artefact d'export généré: {chemin}")
+    return chemin, False
+
+
+def purger_artefacts():
+    """Supprime les artefacts construits pour une version des données périmée."""
+    version = version_donnees()
+    supprimes = 0
+    for nom in os.listdir(repertoire_exports()):
+        correspondance = re.search(r'_v(\d+)_[0-9a-f]{12}\.', nom)
+        if correspondance and int(correspondance.group(1)) < version:
+            os.unlink(os.path.join(repertoire_exports(), nom))
+            supprimes += 1
+    return supprimes
+
+
+def _plage_demandee(entete, taille):
+    """Interprète un en-tête Range à plage unique (bytes=debut-fin, bytes=debut-, bytes=-suffixe)."""
+    correspondance = re.fullmatch(r'bytes=(\d*)-(\d*)', (entete or '').strip())
+    if not correspondance or correspondance.groups() == ('', ''):
+        return None
+    debut, fin = correspondance.groups()
+    if debut == '':
+        debut, fin = max(taille - int(fin), 0), taille - 1
+    else:
+        debut, fin = int(debut), min(int(fin), taille - 1) if fin else taille - 1
+    return debut, fin
+
+
+def _lire_plage(fichier, debut, longueur):
+    with fichier:
+        fichier.seek(debut)
+        while longueur > 0:
+            bloc = fichier.read(min(TAILLE_BLOC, longueur))
+            if not bloc:
+                break
+            longueur -= len(bloc)
+            yield bloc
+
+
+def reponse_fichier(request, chemin, nom_telechargement, content_type):
+    """Sert un artefact avec ETag, Last-Modified et prise en charge des requêtes Range."""
+    infos = os.stat(chemin)
+    etag = f'"{os.path.splitext(os.path.basename(chemin))[0]}"'
+
+    if request.headers.get('If-None-Match') == etag:
+        response = HttpResponse(status=304)
+        response['ETag'] = etag
+        return response
+
+    plage = None
+    if_range = request.headers.get('If-Range')
+    if 'Range' in request.headers and (if_range is None or if_range == etag):
+        plage = _plage_demandee(request.headers['Range'], infos.st_size)
+        if plage is None or plage[0] >= infos.st_size or plage[0] > plage[1]:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f"bytes */{infos.st_size}"
+            return response
+
+    if plage is None:
+        response = FileResponse(open(chemin, 'rb'), content_type=content_type)
+    else:
+        debut, fin = plage
+        response = StreamingHttpResponse(
+            _lire_plage(open(chemin, 'rb'), debut, fin - debut + 1),
+            status=206, content_type=content_type,
+        )
+        response['Content-Length'] = fin - debut + 1
+        response['Content-Range'] = f"bytes {debut}-{fin}/{infos.st_size}"
+
+    response['Content-Disposition'] = f'attachment; filename="{nom_telechargement}"'
+    response['Accept-Ranges'] = 'bytes'
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(infos.st_mtime)
+    return response
+
+
+def horodatage_artefact(chemin):
+    return datetime.fromtimestamp(os.path.getmtime(chemin)).strftime("%Y%m%d_%H%M%S")
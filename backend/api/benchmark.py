@@ -0,0 +1,204 @@
+"""
+Banc d'essai des points d'accès de l'API (manage.py benchmark_pta).
+
+Les requêtes traversent la vraie configuration d'URL, les middlewares et les
+permissions via le client de test DRF (construit sur RequestFactory), sans
+réseau. Pour chaque volume de données généré par api.generation, chaque
+scénario est mesuré : durée (médiane des répétitions), nombre de requêtes
+SQL, pic mémoire Python (tracemalloc, sur un appel séparé pour ne pas
+fausser la durée) et taille de la réponse.
+
+Les résultats sont comparés à une référence JSON versionnée
+(benchmarks/reference.json) : le nombre de requêtes SQL ne doit jamais
+augmenter, la durée, la mémoire et la taille restent dans une tolérance.
+"""
+import json
+import platform
+import statistics
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import django
+from django.contrib.auth.models import User
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext, override_settings, setup_test_environment, teardown_test_environment
+from rest_framework.test import APIClient
+
+from .generation import generer_pta, vider_pta
+from .models import Activite, incrementer_version_donnees
+
+VOLUMES_BENCHMARK = (100, 1000, 5000)
+REPETITIONS = 5
+ANNEE_BENCHMARK = 2025
+
+TOLERANCES = {
+    'duree_ms': 0.5,
+    'pic_memoire_octets': 0.25,
+    'octets': 0.1,
+}
+# En dessous de cet écart absolu, une variation de durée est du bruit de mesure
+MARGE_DUREE_MS = 5
+
+SCENARIOS = [
+    {'nom': 'activites_liste', 'url': lambda ctx: '/api/activites/'},
+    {'nom': 'activite_detail', 'url': lambda ctx: f"/api/activites/{ctx['activite_id']}/"},
+    {'nom': 'tableau_de_bord', 'url': lambda ctx: '/api/dashboard-stats/'},
+    {'nom': 'arbre_structures', 'url': lambda ctx: '/api/structures/'},
+    {'nom': 'arbre_objectifs', 'url': lambda ctx: '/api/objectifs-generaux/'},
+    {
+        'nom': 'creation_suivi', 'methode': 'post', 'url': lambda ctx: '/api/suivis/',
+        'donnees': lambda ctx: {
+            'activite': ctx['activite_id'], 'date_suivi': f"{ANNEE_BENCHMARK}-06-30",
+            'avancement': 50, 'observation': "Suivi de benchmark",
+        },
+    },
+    # Les données changent avant chaque appel : le classeur est reconstruit, pas servi depuis le cache
+    {'nom': 'export_excel', 'url': lambda ctx: '/api/export-excel/', 'preparer': incrementer_version_donnees},
+]
+
+
+@contextmanager
+def base_ephemere():
+    """
+    Base de test créée pour la durée du benchmark (la base réelle n'est pas
+    touchée), DEBUG désactivé comme en production et journalisation des
+    requêtes coûteuses coupée.
+    """
+    setup_test_environment(debug=False)
+    ancien_nom = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+    try:
+        with tempfile.TemporaryDirectory() as media, override_settings(
+            MEDIA_ROOT=media, SEUIL_REQUETES_SQL=None, SEUIL_DUREE_REQUETE_MS=None,
+        ):
+            yield
+    finally:
+        connection.creation.destroy_test_db(ancien_nom, verbosity=0)
+        teardown_test_environment()
+
+
+def _appeler(client, scenario, contexte):
+    methode = scenario.get('methode', 'get')
+    url = scenario['url'](contexte)
+    if methode == 'get':
+        response = client.get(url)
+    else:
+        response = getattr(client, methode)(url, scenario['donnees'](contexte), format='json')
+    # Une réponse en flux n'est produite qu'à la lecture de son contenu
+    octets = sum(len(bloc) for bloc in response.streaming_content) if response.streaming else len(response.content)
+    return response.status_code, octets
+
+
+def mesurer_scenario(client, scenario, contexte, repetitions=REPETITIONS):
+    preparer = scenario.get('preparer')
+    durees = []
+    for i in range(repetitions + 1):
+        if preparer:
+            preparer()
+        reset_queries()
+        with CaptureQueriesContext(connection) as requetes:
+            debut = time.perf_counter()
+            statut, octets = _appeler(client, scenario, contexte)
+            duree = time.perf_counter() - debut
+        # captured_queries relit le journal de la connexion, vidé au début de chaque requête HTTP
+        nb_requetes = len(requetes)
+        # Le premier appel (amorçage des caches) n'est pas compté
+        if i:
+            durees.append(duree * 1000)
+
+    if preparer:
+        preparer()
+    tracemalloc.start()
+    try:
+        _appeler(client, scenario, contexte)
+        pic = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'statut': statut,
+        'duree_ms': round(statistics.median(durees), 2),
+        'duree_ms_min': round(min(durees), 2),
+        'requetes': nb_requetes,
+        'pic_memoire_octets': pic,
+        'octets': octets,
+    }
+
+
+def executer_benchmark(volumes=VOLUMES_BENCHMARK, repetitions=REPETITIONS, graine=42, scenarios=None, progression=None):
+    """
+    Mesure les scénarios pour chaque volume d'activités. Doit être appelé
+    dans une base jetable (voir base_ephemere) : les tables du PTA sont vidées.
+    """
+    scenarios = [s for s in SCENARIOS if scenarios is None or s['nom'] in scenarios]
+    utilisateur = User.objects.create_superuser('benchmark', 'benchmark@example.com', None)
+    client = APIClient()
+    client.force_authenticate(utilisateur)
+
+    resultats = {}
+    for volume in volumes:
+        vider_pta()
+        generer_pta(graine=graine, annee=ANNEE_BENCHMARK, activites=volume)
+        contexte = {'activite_id': Activite.objects.order_by('id').values_list('id', flat=True).first()}
+        resultats[str(volume)] = {}
+        for scenario in scenarios:
+            mesure = mesurer_scenario(client, scenario, contexte, repetitions)
+            resultats[str(volume)][scenario['nom']] = mesure
+            if progression:
+                progression(volume, scenario['nom'], mesure)
+
+    return {
+        'informations': {
+            'date': datetime.now().isoformat(timespec='seconds'),
+            'base': connection.vendor,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'machine': platform.machine(),
+            'graine': graine,
+            'repetitions': repetitions,
+        },
+        'resultats': resultats,
+    }
+
+
+def comparer(resultats, reference, tolerances=None):
+    """
+    Régressions de `resultats` par rapport à `reference` (dictionnaires produits
+    par executer_benchmark), sous forme de messages. Seuls les volumes et
+    scénarios présents dans les deux sont comparés.
+    """
+    tolerances = {**TOLERANCES, **(tolerances or {})}
+    regressions = []
+    for volume, scenarios in resultats['resultats'].items():
+        for nom, mesure in scenarios.items():
+            attendu = reference['resultats'].get(volume, {}).get(nom)
+            if attendu is None:
+                continue
+            libelle = f"{nom} ({volume} activités)"
+            if mesure['statut'] != attendu['statut']:
+                regressions.append(f"{libelle} : statut HTTP {mesure['statut']} au lieu de {attendu['statut']}")
+            if mesure['requetes'] > attendu['requetes']:
+                regressions.append(f"{libelle} : {mesure['requetes']} requêtes SQL au lieu de {attendu['requetes']}")
+            for cle, tolerance in tolerances.items():
+                limite = attendu[cle] * (1 + tolerance)
+                if cle == 'duree_ms':
+                    limite = max(limite, attendu[cle] + MARGE_DUREE_MS)
+                if mesure[cle] > limite:
+                    regressions.append(
+                        f"{libelle} : {cle} = {mesure[cle]} pour une référence de {attendu[cle]} "
+                        f"(tolérance {tolerance:.0%})"
+                    )
+    return regressions
+
+
+def lire_resultats(chemin):
+    with open(chemin, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def ecrire_resultats(resultats, chemin):
+    with open(chemin, 'w', encoding='utf-8') as f:
+        json.dump(resultats, f, indent=2, ensure_ascii=False)
+        f.write('\n')
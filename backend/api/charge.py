@@ -0,0 +1,181 @@
+"""
+Générateur de charge rejouant les rafales de requêtes du frontend
+(manage.py charge_pta).
+
+À son montage, une page React envoie toutes ses requêtes GET en parallèle
+avec le jeton Bearer de l'utilisateur (Activities.jsx : 10 listes,
+Dashboard.jsx : 6). Chaque utilisateur simulé rejoue ces rafales contre un
+serveur en marche, avec au plus CONNEXIONS_PAR_NAVIGATEUR connexions
+simultanées comme un navigateur en HTTP/1.1, puis marque un temps de
+réflexion avant la page suivante.
+
+Client HTTP minimal en asyncio (bibliothèque standard uniquement) : une
+connexion par requête, corps lu jusqu'à la fermeture.
+"""
+import asyncio
+import json
+import random
+import ssl
+import time
+from collections import Counter, defaultdict
+from urllib.parse import urlsplit
+from urllib.request import Request, urlopen
+
+PARCOURS = {
+    # Activities.jsx
+    'activites': [
+        '/api/activites/', '/api/structures/', '/api/directions/', '/api/services/', '/api/divisions/',
+        '/api/objectifs-generaux/', '/api/objectifs-specifiques/', '/api/resultats-attendus/',
+        '/api/pcop/', '/api/suivis/',
+    ],
+    # Dashboard.jsx
+    'tableau_de_bord': [
+        '/api/services/', '/api/activites/', '/api/structures/', '/api/directions/',
+        '/api/objectifs-generaux/', '/api/pcop/',
+    ],
+}
+
+CONNEXIONS_PAR_NAVIGATEUR = 6
+DELAI_REQUETE = 30
+CENTILES = (50, 95, 99)
+
+
+class Cible:
+    """Serveur visé : hôte, port et contexte TLS déduits de l'URL de base."""
+
+    def __init__(self, url, jeton, delai=DELAI_REQUETE):
+        morceaux = urlsplit(url)
+        if morceaux.scheme not in ('http', 'https') or not morceaux.hostname:
+            raise ValueError(f"URL invalide : {url}")
+        self.hote = morceaux.hostname
+        self.tls = ssl.create_default_context() if morceaux.scheme == 'https' else None
+        self.port = morceaux.port or (443 if self.tls else 80)
+        self.entete_hote = morceaux.netloc
+        self.prefixe = morceaux.path.rstrip('/')
+        self.jeton = jeton
+        self.delai = delai
+
+
+def obtenir_jeton(url, utilisateur, mot_de_passe):
+    """Jeton d'accès JWT obtenu comme le frontend, par POST /api/token/."""
+    corps = json.dumps({'username': utilisateur, 'password': mot_de_passe}).encode()
+    requete = Request(f"{url.rstrip('/')}/api/token/", data=corps, headers={'Content-Type': 'application/json'})
+    with urlopen(requete, timeout=DELAI_REQUETE) as reponse:
+        return json.load(reponse)['access']
+
+
+async def _get(cible, chemin):
+    reader, writer = await asyncio.open_connection(cible.hote, cible.port, ssl=cible.tls)
+    try:
+        writer.write((
+            f"GET {cible.prefixe}{chemin} HTTP/1.1\r\n"
+            f"Host: {cible.entete_hote}\r\n"
+            f"Authorization: Bearer {cible.jeton}\r\n"
+            "Accept: application/json\r\n"
+            "Connection: close\r\n\r\n"
+        ).encode())
+        await writer.drain()
+        statut = int((await reader.readline()).split()[1])
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        return statut, len(await reader.read())
+    finally:
+        writer.close()
+
+
+async def requete(cible, chemin):
+    """Exécute un GET ; retourne (statut, octets, erreur), statut None si la requête n'a pas abouti."""
+    try:
+        statut, octets = await asyncio.wait_for(_get(cible, chemin), cible.delai)
+    except asyncio.TimeoutError:
+        return None, 0, 'delai depasse'
+    except (OSError, ValueError, IndexError) as e:
+        return None, 0, type(e).__name__
+    return statut, octets, None
+
+
+async def utilisateur_simule(cible, parcours, iterations, reflexion, alea, mesures, depart=0.0):
+    await asyncio.sleep(depart)
+    navigateur = asyncio.Semaphore(CONNEXIONS_PAR_NAVIGATEUR)
+
+    async def appel(nom_parcours, chemin):
+        async with navigateur:
+            debut = time.perf_counter()
+            statut, octets, erreur = await requete(cible, chemin)
+            mesures['requetes'].append((nom_parcours, chemin, time.perf_counter() - debut, statut, octets, erreur))
+
+    for _ in range(iterations):
+        nom_parcours = alea.choice(parcours)
+        debut = time.perf_counter()
+        await asyncio.gather(*(appel(nom_parcours, chemin) for chemin in PARCOURS[nom_parcours]))
+        # Temps d'affichage de la page : jusqu'à la dernière réponse de la rafale
+        mesures['pages'].append((nom_parcours, time.perf_counter() - debut))
+        if reflexion:
+            await asyncio.sleep(reflexion * alea.uniform(0.5, 1.5))
+
+
+async def executer_charge(cible, utilisateurs, iterations, parcours=None, reflexion=1.0, montee=0.0, graine=42):
+    """
+    Lance `utilisateurs` utilisateurs simulés, démarrés régulièrement sur
+    `montee` secondes, qui chargent chacun `iterations` pages tirées parmi
+    `parcours`. Retourne le rapport (voir rapport_charge).
+    """
+    parcours = list(parcours or PARCOURS)
+    mesures = {'requetes': [], 'pages': []}
+    debut = time.perf_counter()
+    await asyncio.gather(*(
+        utilisateur_simule(
+            cible, parcours, iterations, reflexion, random.Random(graine + n), mesures,
+            depart=montee * n / utilisateurs,
+        )
+        for n in range(utilisateurs)
+    ))
+    return rapport_charge(mesures, time.perf_counter() - debut)
+
+
+def centile(valeurs_triees, rang):
+    """Centile par la méthode du rang le plus proche (valeurs déjà triées)."""
+    if not valeurs_triees:
+        return None
+    indice = max(0, min(len(valeurs_triees) - 1, -(-rang * len(valeurs_triees) // 100) - 1))
+    return valeurs_triees[indice]
+
+
+def _resume(durees, erreurs=0):
+    durees = sorted(durees)
+    resume = {'nombre': len(durees), 'erreurs': erreurs, 'taux_erreur': round(erreurs / len(durees), 4) if durees else 0}
+    for rang in CENTILES:
+        valeur = centile(durees, rang)
+        resume[f'p{rang}_ms'] = round(valeur * 1000, 1) if valeur is not None else None
+    resume['max_ms'] = round(durees[-1] * 1000, 1) if durees else None
+    return resume
+
+
+def rapport_charge(mesures, duree):
+    """Centiles de latence, débit et erreurs : global, par point d'accès et par page."""
+    par_chemin = defaultdict(list)
+    erreurs_par_chemin = Counter()
+    statuts = Counter()
+    octets = 0
+    for _, chemin, duree_requete, statut, taille, erreur in mesures['requetes']:
+        par_chemin[chemin].append(duree_requete)
+        octets += taille
+        statuts[str(statut) if statut is not None else erreur] += 1
+        if statut is None or statut >= 400:
+            erreurs_par_chemin[chemin] += 1
+
+    par_page = defaultdict(list)
+    for nom_parcours, duree_page in mesures['pages']:
+        par_page[nom_parcours].append(duree_page)
+
+    nombre = len(mesures['requetes'])
+    return {
+        'duree_secondes': round(duree, 2),
+        'debit_requetes_s': round(nombre / duree, 1) if duree else None,
+        'debit_pages_s': round(len(mesures['pages']) / duree, 2) if duree else None,
+        'octets_recus': octets,
+        'statuts': dict(statuts),
+        'global': _resume([m[2] for m in mesures['requetes']], sum(erreurs_par_chemin.values())),
+        'points_acces': {chemin: _resume(durees, erreurs_par_chemin[chemin]) for chemin, durees in sorted(par_chemin.items())},
+        'pages': {nom: _resume(durees) for nom, durees in sorted(par_page.items())},
+    }
@@ -0,0 +1,121 @@
+"""
+Sources de financement et cibles normalisées.
+
+Activite.sources_financement et Activite.cibles restent des champs texte
+libres (saisis tels quels par le frontend et repris dans les exports). Leur
+contenu est découpé (virgule, point-virgule, barre oblique, « + », retour à
+la ligne) et chaque élément est rattaché à une entrée de SourceFinancement
+ou de Cible, retrouvée par sa clé canonique : sans accents, en minuscules,
+ponctuation et espaces normalisés. « Banque Mondiale », « banque mondiale »
+et « BANQUE  MONDIALE » désignent ainsi la même source.
+
+Les liens (tables Activite.sources et Activite.groupes_cibles) sont tenus à
+jour à chaque enregistrement d'une activité (signal post_save) ; les
+chargements en masse appellent synchroniser_dimensions par paquets.
+
+Les rapports par source ou par cible (budget_par_dimension) sont alors des
+GROUP BY sur les tables de liens indexées, sans relire les champs texte.
+"""
+import re
+import unicodedata
+
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
+
+from .filtres import filtrer_activites
+from .models import Activite, Cible, SourceFinancement
+
+SEPARATEURS = re.compile(r'[,;/+\n]')
+LONGUEUR_NOM = 255
+
+# champ texte d'Activite -> (champ ManyToMany d'Activite, modèle de la dimension)
+DIMENSIONS = {
+    'sources_financement': ('sources', SourceFinancement),
+    'cibles': ('groupes_cibles', Cible),
+}
+
+
+def cle_dimension(nom):
+    """Clé canonique d'un nom : « Banque  Mondiale » et « banque mondiale » ont la même clé."""
+    sans_accents = ''.join(
+        c for c in unicodedata.normalize('NFKD', nom) if not unicodedata.combining(c)
+    ).lower()
+    # Les points disparaissent (« B.A.D. » = « BAD »), les autres signes séparent les mots
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', sans_accents.replace('.', '')).split())
+
+
+def decouper(texte):
+    """{clé: nom} des éléments d'un champ texte, dans l'ordre de saisie, sans doublon."""
+    elements = {}
+    for morceau in SEPARATEURS.split(texte or ''):
+        nom = ' '.join(morceau.split())[:LONGUEUR_NOM]
+        cle = cle_dimension(nom)
+        if cle and cle not in elements:
+            elements[cle] = nom
+    return elements
+
+
+def synchroniser_dimensions(lignes):
+    """
+    Rattache des activités à leurs sources et cibles. `lignes` est une liste
+    de tuples (id, sources_financement, cibles). Les entrées manquantes sont
+    créées, les liens ajoutés ou retirés : quelques requêtes par paquet,
+    quel que soit le nombre d'activités.
+    """
+    ids = [ligne[0] for ligne in lignes]
+    bilan = {}
+    for position, (champ, (champ_lien, modele)) in enumerate(DIMENSIONS.items(), 1):
+        elements = {ligne[0]: decouper(ligne[position]) for ligne in lignes}
+        noms = {}
+        for decoupage in elements.values():
+            for cle, nom in decoupage.items():
+                noms.setdefault(cle, nom)
+
+        existantes = dict(modele.objects.filter(cle__in=noms).values_list('cle', 'id'))
+        nouvelles = [modele(cle=cle, nom=nom) for cle, nom in noms.items() if cle not in existantes]
+        if nouvelles:
+            # Une autre écriture concurrente a pu créer la même clé : elle est relue plutôt que dupliquée
+            modele.objects.bulk_create(nouvelles, ignore_conflicts=True)
+            existantes.update(modele.objects.filter(cle__in=[o.cle for o in nouvelles]).values_list('cle', 'id'))
+
+        lien = getattr(Activite, champ_lien).through
+        colonne = f'{modele._meta.model_name}_id'
+        voulus = {(pk, existantes[cle]) for pk, decoupage in elements.items() for cle in decoupage}
+        actuels = {
+            (activite_id, valeur): pk
+            for pk, activite_id, valeur in lien.objects.filter(activite_id__in=ids).values_list('id', 'activite_id', colonne)
+        }
+        retires = [pk for couple, pk in actuels.items() if couple not in voulus]
+        if retires:
+            lien.objects.filter(id__in=retires).delete()
+        ajoutes = [lien(activite_id=a, **{colonne: v}) for a, v in voulus - actuels.keys()]
+        lien.objects.bulk_create(ajoutes)
+        bilan[champ] = {'creees': len(nouvelles), 'liens_ajoutes': len(ajoutes), 'liens_retires': len(retires)}
+    return bilan
+
+
+def budget_par_dimension(modele, champ_lien, filtres=None):
+    """
+    Nombre d'activités et montant total par entrée de `modele` (SourceFinancement
+    ou Cible), pour les activités retenues par `filtres`, du montant le plus
+    élevé au plus faible, puis les activités sans entrée. Une activité
+    cofinancée compte en entier pour chacune de ses sources. Avec des filtres,
+    les entrées sans activité retenue ne sont pas listées.
+    """
+    filtres = filtres or {}
+    # Filtre puis agrégat sur la même jointure : seules les activités retenues sont comptées
+    lignes = filtrer_activites(modele.objects.all(), filtres, prefixe='activites__').values('id', 'nom').annotate(
+        nb_activites=Count('activites'),
+        total=Coalesce(Sum('activites__montant'), Value(0), output_field=DecimalField()),
+    )
+    resultats = [
+        {'id': ligne['id'], 'nom': ligne['nom'], 'activites': ligne['nb_activites'], 'montant': round(float(ligne['total']), 2)}
+        for ligne in lignes.order_by('-total', 'nom')
+    ]
+    sans = filtrer_activites(Activite.objects.filter(**{f'{champ_lien}__isnull': True}), filtres).aggregate(
+        activites=Count('id'), montant=Sum('montant'),
+    )
+    if sans['activites']:
+        resultats.append({'id': None, 'nom': "Non renseigné", 'activites': sans['activites'],
+                          'montant': round(float(sans['montant'] or 0), 2)})
+    return resultats
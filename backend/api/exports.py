@@ -0,0 +1,380 @@
+"""
+Construction du classeur Excel du PTA et des exports bruts (CSV, Parquet).
+
+Partagé par la vue d'export, les tâches d'arrière-plan (api.jobs) et le
+précalcul des exports versionnés (api.artefacts).
+"""
+import csv
+import io
+import os
+from datetime import datetime
+from itertools import chain
+
+import openpyxl
+from openpyxl.utils import get_column_letter
+from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+
+from .artefacts import obtenir_artefact, purger_artefacts
+from .models import ObjectifGeneral, Structure
+from .sources import TAILLE_PAQUET, comptes_par, lignes_pta, lignes_pta_groupees, sous_totaux_pta, totaux_pta
+
+CONTENT_TYPE_XLSX = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+CONTENT_TYPE_CSV = 'text/csv; charset=utf-8'
+CONTENT_TYPE_PARQUET = 'application/vnd.apache.parquet'
+
+HEADERS_PTA = [
+    "OBJECTIFS GENERAUX", "OBJECTIFS SPECIFIQUES", "RESULTATS ATTENDUS",
+    "STRUCTURE", "DIRECTION", "SERVICE", "DIVISION", "ACTIVITES",
+    "SOUS-ACTIVITES", "PRODUITS", "CIBLES", "SOURCES DE FINANCEMENT",
+    "CODE PCOP", "LIBELLE PCOP", "COUT UNITAIRE (Ar)", "QUANTITE", "MONTANT TOTAL (Ar)", "OBSERVATIONS", "ETAT"
+]
+
+# Styles réutilisables
+header_font = Font(bold=True, color="FFFFFF", size=12)
+header_fill = PatternFill(start_color="2E86AB", end_color="2E86AB", fill_type="solid")
+border_style = Side(border_style="thin", color="000000")
+border = Border(left=border_style, right=border_style, top=border_style, bottom=border_style)
+center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
+left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
+sous_total_fill = PatternFill(start_color="D6EAF8", end_color="D6EAF8", fill_type="solid")
+
+
+def _ajuster_largeurs(ws):
+    for column in ws.columns:
+        max_length = 0
+        column_letter = get_column_letter(column[0].column)
+
+        for cell in column:
+            try:
+                if cell.value:
+                    max_length = max(max_length, len(str(cell.value)))
+            except:
+                pass
+
+        adjusted_width = min(max_length + 2, 50)
+        ws.column_dimensions[column_letter].width = adjusted_width
+
+
+def construire_classeur_pta(auteur=None, progression=None, filtres=None, sous_totaux=False):
+    """
+    Construit le classeur du PTA (feuilles PTA_PRINCIPAL, STRUCTURE_LOGIQUE
+    et STRUCTURE_ORGANISATIONNELLE). Sans auteur, le classeur est partageable
+    entre utilisateurs (exports précalculés).
+
+    `filtres` (voir api.filtres) restreint les activités exportées dans la
+    requête SQL ; les feuilles de synthèse ne listent alors que les
+    résultats attendus et divisions concernés.
+
+    Avec `sous_totaux`, PTA_PRINCIPAL est trié par structure, direction puis
+    service, avec une ligne de sous-total à la fin de chaque groupe.
+
+    `progression(fait, total)` est appelé périodiquement pendant le parcours
+    des activités. Retourne (classeur, nombre d'activités exportées).
+    """
+    wb = openpyxl.Workbook()
+
+    # ---------- FEUILLE PRINCIPALE PTA ----------
+    ws_pta = wb.active
+    ws_pta.title = "PTA_PRINCIPAL"
+
+    ws_pta.merge_cells('A1:S1')
+    title_cell = ws_pta.cell(row=1, column=1)
+    title_cell.value = f"PLAN DE TRAVAIL ANNUEL (PTA) - EXPORT {'FILTRÉ' if filtres else 'COMPLET'}"
+    title_cell.font = Font(bold=True, size=16, color="2E86AB")
+    title_cell.alignment = center_align
+
+    ws_pta.merge_cells('A2:S2')
+    meta_cell = ws_pta.cell(row=2, column=1)
+    meta_cell.value = f"Export généré le {datetime.now().strftime('%d/%m/%Y à %H:%M')}"
+    if auteur:
+        meta_cell.value += f" par {auteur}"
+    meta_cell.font = Font(italic=True, size=10, color="666666")
+    meta_cell.alignment = center_align
+
+    headers = HEADERS_PTA
+
+    ws_pta.append([])
+    ws_pta.append(headers)
+
+    for col_num, header in enumerate(headers, 1):
+        cell = ws_pta.cell(row=4, column=col_num)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = center_align
+        cell.border = border
+
+    # ✅ LIGNES LUES PAR PAQUETS (values_list + iterator), MONTANTS EN DECIMAL EXACTS
+    if sous_totaux:
+        # Sous-totaux de tous les niveaux en une requête (ROLLUP), fusionnés au flux trié
+        totaux_niveaux = sous_totaux_pta(filtres)
+        total_activites = totaux_niveaux.get(('total', (None, None, None)), (0,))[0]
+        flux = lignes_pta_groupees(filtres, sous_totaux=totaux_niveaux)
+    else:
+        totaux = totaux_pta(filtres)
+        total_activites = totaux['nb']
+        flux = chain(
+            (('activite', ligne) for ligne in lignes_pta(filtres)),
+            [('total', "TOTAL GÉNÉRAL", totaux['nb'], totaux['montant'])],
+        )
+
+    row_count = 0
+    row_num = 4
+
+    for element in flux:
+        if element[0] == 'activite':
+            ws_pta.append(element[1])
+            row_count += 1
+            row_num += 1
+
+            for col_num in range(1, len(headers) + 1):
+                cell = ws_pta.cell(row=row_num, column=col_num)
+                cell.border = border
+                cell.alignment = left_align
+
+                if col_num in [15, 16, 17]:
+                    cell.number_format = '#,##0.00'
+                    cell.alignment = Alignment(horizontal="right", vertical="center")
+
+            if progression and row_count % 500 == 0:
+                progression(row_count, total_activites)
+
+        elif element[0] == 'total':
+            if row_count > 0:
+                row_num += 1
+                ws_pta.merge_cells(f'A{row_num}:P{row_num}')
+                total_label = ws_pta.cell(row=row_num, column=1)
+                total_label.value = f"TOTAL GÉNÉRAL ({row_count} activités)"
+                total_label.font = Font(bold=True, size=12, color="2E86AB")
+                total_label.alignment = Alignment(horizontal="right", vertical="center")
+
+                # Total calculé par la base (SUM) plutôt que cumulé en Python
+                total_cell = ws_pta.cell(row=row_num, column=17)
+                total_cell.value = element[3]
+                total_cell.font = Font(bold=True, size=12, color="2E86AB")
+                total_cell.number_format = '#,##0.00'
+                total_cell.border = border
+
+        else:
+            niveau, libelle, nb, montant = element
+            row_num += 1
+            ws_pta.merge_cells(f'A{row_num}:P{row_num}')
+            sous_total_label = ws_pta.cell(row=row_num, column=1)
+            sous_total_label.value = f"SOUS-TOTAL {niveau.upper()} {libelle} ({nb} activités)"
+            sous_total_label.font = Font(bold=True, color="2E86AB")
+            sous_total_label.fill = sous_total_fill
+            sous_total_label.alignment = Alignment(horizontal="right", vertical="center")
+
+            sous_total_cell = ws_pta.cell(row=row_num, column=17)
+            sous_total_cell.value = montant
+            sous_total_cell.font = Font(bold=True, color="2E86AB")
+            sous_total_cell.fill = sous_total_fill
+            sous_total_cell.number_format = '#,##0.00'
+            sous_total_cell.border = border
+
+    _ajuster_largeurs(ws_pta)
+
+    # ---------- FEUILLE STRUCTURE LOGIQUE ----------
+    ws_structure = wb.create_sheet("STRUCTURE_LOGIQUE")
+
+    ws_structure.merge_cells('A1:D1')
+    title_cell = ws_structure.cell(row=1, column=1)
+    title_cell.value = "STRUCTURE LOGIQUE - OBJECTIFS ET RÉSULTATS"
+    title_cell.font = Font(bold=True, size=14, color="2E86AB")
+    title_cell.alignment = center_align
+
+    structure_headers = ["Objectif Général", "Objectif Spécifique", "Résultat Attendu", "Nombre d'Activités"]
+    ws_structure.append(structure_headers)
+
+    for col_num, header in enumerate(structure_headers, 1):
+        cell = ws_structure.cell(row=2, column=col_num)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = center_align
+        cell.border = border
+
+    # Nombre d'activités par résultat attendu en une seule requête groupée
+    activites_par_ra = comptes_par(filtres, 'resultat_attendu')
+
+    row_num = 3
+    objectifs_generaux = ObjectifGeneral.objects.prefetch_related(
+        'objectifs_specifiques__resultats_attendus'
+    ).all()
+
+    for og in objectifs_generaux:
+        for os in og.objectifs_specifiques.all():
+            for ra in os.resultats_attendus.all():
+                activites_count = activites_par_ra.get(ra.id, 0)
+                if filtres and not activites_count:
+                    continue
+                ws_structure.append([
+                    f"{og.numero} - {og.titre}",
+                    f"{os.numero} - {os.titre}",
+                    f"{ra.numero} - {ra.description}",
+                    activites_count
+                ])
+
+                for col_num in range(1, 5):
+                    cell = ws_structure.cell(row=row_num, column=col_num)
+                    cell.border = border
+                    cell.alignment = left_align
+
+                row_num += 1
+
+    # Ajustement des colonnes
+    _ajuster_largeurs(ws_structure)
+
+    # ---------- FEUILLE STRUCTURE ORGANISATIONNELLE ----------
+    ws_org = wb.create_sheet("STRUCTURE_ORGANISATIONNELLE")
+
+    ws_org.merge_cells('A1:E1')
+    title_cell = ws_org.cell(row=1, column=1)
+    title_cell.value = "STRUCTURE ORGANISATIONNELLE - STRUCTURES, DIRECTIONS, SERVICES ET DIVISIONS"
+    title_cell.font = Font(bold=True, size=14, color="2E86AB")
+    title_cell.alignment = center_align
+
+    org_headers = ["Structure", "Direction", "Service", "Division", "Nombre d'Activités"]
+    ws_org.append(org_headers)
+
+    for col_num, header in enumerate(org_headers, 1):
+        cell = ws_org.cell(row=2, column=col_num)
+        cell.font = header_font
+        cell.fill = header_fill
+        cell.alignment = center_align
+        cell.border = border
+
+    activites_par_division = comptes_par(filtres, 'division')
+
+    row_num = 3
+    structures = Structure.objects.prefetch_related('directions__services__divisions').all()
+
+    for structure in structures:
+        for direction in structure.directions.all():
+            for service in direction.services.all():
+                for division in service.divisions.all():
+                    activites_count = activites_par_division.get(division.id, 0)
+                    if filtres and not activites_count:
+                        continue
+                    ws_org.append([
+                        f"{structure.numero} - {structure.nom}",
+                        f"{direction.numero} - {direction.nom}",
+                        f"{service.numero} - {service.nom_service}",
+                        f"{division.numero} - {division.nom}",
+                        activites_count
+                    ])
+
+                    for col_num in range(1, 6):
+                        cell = ws_org.cell(row=row_num, column=col_num)
+                        cell.border = border
+                        cell.alignment = left_align
+
+                    row_num += 1
+
+    # Ajustement des colonnes
+    _ajuster_largeurs(ws_org)
+
+    return wb, row_count
+
+
+def classeur_en_octets(wb):
+    file_buffer = io.BytesIO()
+    wb.save(file_buffer)
+    return file_buffer.getvalue()
+
+
+def nom_fichier_export(prefixe="PTA_Export_Complet", extension="xlsx", timestamp=None):
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
+    return f"{prefixe}_{timestamp}.{extension}"
+
+
+def nom_fichier_pta(filtres, timestamp=None, sous_totaux=False):
+    prefixe = "PTA_Export_Filtre" if filtres else "PTA_Export_Complet"
+    if sous_totaux:
+        prefixe += "_Sous_Totaux"
+    return nom_fichier_export(prefixe, timestamp=timestamp)
+
+
+# ---------- EXPORTS BRUTS (CSV, PARQUET) ----------
+def flux_csv_pta(filtres=None, chunk_size=TAILLE_PAQUET, lignes=None):
+    """
+    Générateur de blocs CSV (en-tête PTA_PRINCIPAL puis une ligne par activité).
+    `lignes` remplace la lecture des tables courantes (ex. lignes d'un instantané figé).
+    """
+    tampon = io.StringIO()
+    writer = csv.writer(tampon)
+    writer.writerow(HEADERS_PTA)
+    lignes = lignes_pta(filtres, chunk_size) if lignes is None else lignes
+    for numero, ligne in enumerate(lignes, 1):
+        writer.writerow(ligne)
+        if numero % chunk_size == 0:
+            yield tampon.getvalue()
+            tampon.seek(0)
+            tampon.truncate()
+    yield tampon.getvalue()
+
+
+def schema_arrow_pta():
+    import pyarrow as pa
+
+    # Même précision que les DecimalField du modèle Activite
+    decimaux = {
+        "COUT UNITAIRE (Ar)": pa.decimal128(14, 2),
+        "QUANTITE": pa.decimal128(12, 2),
+        "MONTANT TOTAL (Ar)": pa.decimal128(16, 2),
+    }
+    return pa.schema([(nom, decimaux.get(nom, pa.string())) for nom in HEADERS_PTA])
+
+
+def ecrire_parquet_pta(fichier, filtres=None, chunk_size=TAILLE_PAQUET, lignes=None):
+    """
+    Écrit les lignes de PTA_PRINCIPAL en Parquet, un groupe de lignes par paquet
+    d'activités. `lignes` remplace la lecture des tables courantes, comme pour flux_csv_pta.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    schema = schema_arrow_pta()
+
+    def groupe(lignes):
+        return pa.RecordBatch.from_arrays(
+            [pa.array(colonne, type=champ.type) for colonne, champ in zip(zip(*lignes), schema)],
+            schema=schema,
+        )
+
+    with pq.ParquetWriter(fichier, schema, compression='snappy') as writer:
+        paquet = []
+        for ligne in lignes_pta(filtres, chunk_size) if lignes is None else lignes:
+            paquet.append(ligne)
+            if len(paquet) == chunk_size:
+                writer.write_batch(groupe(paquet))
+                paquet = []
+        if paquet:
+            writer.write_batch(groupe(paquet))
+
+
+# ---------- EXPORTS PRÉCALCULÉS ----------
+def artefact_pta(filtres=None, progression=None, forcer=False, sous_totaux=False):
+    """Chemin du classeur pour la version courante des données et ces filtres (construit si absent)."""
+    parametres = {'filtres': filtres or {}}
+    if sous_totaux:
+        parametres['sous_totaux'] = True
+    return obtenir_artefact(
+        'pta', parametres,
+        lambda fichier: construire_classeur_pta(
+            progression=progression, filtres=filtres, sous_totaux=sous_totaux,
+        )[0].save(fichier),
+        'xlsx', forcer=forcer,
+    )
+
+
+def artefact_parquet_pta(filtres=None, forcer=False):
+    return obtenir_artefact(
+        'pta_parquet', {'filtres': filtres or {}},
+        lambda fichier: ecrire_parquet_pta(fichier, filtres),
+        'parquet', forcer=forcer,
+    )
+
+
+def precalculer_exports(forcer=False):
+    """Régénération planifiée (nocturne) : construit les exports courants et purge les versions périmées."""
+    chemin, depuis_cache = artefact_pta(forcer=forcer)
+    return {'pta_complet': os.path.basename(chemin), 'regenere': not depuis_cache, 'purges': purger_artefacts()}
@@ -0,0 +1,132 @@
+"""
+Filtres communs aux activités : liste (/api/activites/) et exports.
+Les suivis (/api/suivis/) ont leurs propres filtres, voir filtrer_suivis ;
+les anomalies budgétaires (/api/anomalies/) combinent les deux, voir
+filtrer_anomalies.
+
+Les paramètres acceptés sont :
+- structure, direction, service, division, objectif_general,
+  objectif_specifique, resultat_attendu, pcop : identifiant(s), séparés par des virgules ;
+- etat : un ou plusieurs états séparés par des virgules ;
+- du, au : période (AAAA-MM-JJ) ; seules les activités dont [date_debut, date_fin]
+  chevauche la période sont retenues.
+"""
+from django.db.models import Q
+from django.utils.dateparse import parse_date
+from rest_framework.exceptions import ValidationError
+
+from .models import TYPES_ANOMALIE
+
+CHAMPS_FILTRE_ACTIVITE = (
+    'structure', 'direction', 'service', 'division',
+    'objectif_general', 'objectif_specifique', 'resultat_attendu', 'pcop',
+)
+
+
+def lire_filtres_activites(query_params):
+    """Valide les paramètres de filtre et retourne un dict normalisé (sérialisable en JSON)."""
+    filtres = {}
+    for champ in CHAMPS_FILTRE_ACTIVITE:
+        valeur = query_params.get(champ)
+        if valeur in (None, ''):
+            continue
+        try:
+            filtres[champ] = sorted({int(v) for v in valeur.split(',')})
+        except ValueError:
+            raise ValidationError({champ: "Identifiant invalide"})
+
+    etat = query_params.get('etat')
+    if etat:
+        filtres['etat'] = sorted({e.strip() for e in etat.split(',') if e.strip()})
+
+    for borne in ('du', 'au'):
+        date = _lire_date(query_params, borne)
+        if date:
+            filtres[borne] = date.isoformat()
+
+    if 'du' in filtres and 'au' in filtres and filtres['du'] > filtres['au']:
+        raise ValidationError({'au': "La fin de période précède son début"})
+    return filtres
+
+
+def lire_filtres_json(filtres):
+    """Comme lire_filtres_activites, pour un objet JSON (scénarios, paramètres de job) : listes acceptées."""
+    return lire_filtres_activites({
+        cle: ','.join(map(str, valeur)) if isinstance(valeur, list) else str(valeur)
+        for cle, valeur in filtres.items()
+    })
+
+
+def filtrer_activites(queryset, filtres, prefixe=''):
+    """
+    Applique les filtres normalisés à un queryset d'activités, ou d'un modèle
+    lié en passant le chemin vers l'activité dans `prefixe` (ex. 'activite__').
+    Un identifiant None dans une liste retient aussi les activités non rattachées.
+    """
+    conditions = Q()
+    for champ in CHAMPS_FILTRE_ACTIVITE:
+        if champ in filtres:
+            ids = [i for i in filtres[champ] if i is not None]
+            condition = Q(**{f'{prefixe}{champ}_id__in': ids})
+            if len(ids) != len(filtres[champ]):
+                condition |= Q(**{f'{prefixe}{champ}__isnull': True})
+            conditions &= condition
+    if 'etat' in filtres:
+        conditions &= Q(**{f'{prefixe}etat__in': filtres['etat']})
+    if 'du' in filtres:
+        conditions &= Q(**{f'{prefixe}date_fin__gte': filtres['du']})
+    if 'au' in filtres:
+        conditions &= Q(**{f'{prefixe}date_debut__lte': filtres['au']})
+    return queryset.filter(conditions) if conditions else queryset
+
+
+def _lire_date(query_params, nom):
+    valeur = query_params.get(nom)
+    if valeur in (None, ''):
+        return None
+    try:
+        date = parse_date(valeur)
+    except ValueError:
+        date = None
+    if date is None:
+        raise ValidationError({nom: "Date invalide (format attendu : AAAA-MM-JJ)"})
+    return date
+
+
+def filtrer_suivis(queryset, query_params):
+    """
+    Filtres de /api/suivis/ : activite_id, date_suivi (date exacte) et
+    période du / au (bornes incluses) sur la date du suivi.
+    """
+    activite_id = query_params.get('activite_id')
+    if activite_id:
+        try:
+            queryset = queryset.filter(activite_id=int(activite_id))
+        except ValueError:
+            raise ValidationError({'activite_id': "Identifiant invalide"})
+
+    date_suivi = _lire_date(query_params, 'date_suivi')
+    if date_suivi:
+        queryset = queryset.filter(date_suivi=date_suivi)
+    du, au = _lire_date(query_params, 'du'), _lire_date(query_params, 'au')
+    if du and au and du > au:
+        raise ValidationError({'au': "La fin de période précède son début"})
+    if du:
+        queryset = queryset.filter(date_suivi__gte=du)
+    if au:
+        queryset = queryset.filter(date_suivi__lte=au)
+    return queryset
+
+
+def filtrer_anomalies(queryset, query_params):
+    """
+    Filtres de /api/anomalies/ : type (un ou plusieurs, séparés par des
+    virgules) et filtres des activités concernées.
+    """
+    type_anomalie = query_params.get('type')
+    if type_anomalie:
+        types = {t.strip() for t in type_anomalie.split(',') if t.strip()}
+        if types - {code for code, _ in TYPES_ANOMALIE}:
+            raise ValidationError({'type': f"Type inconnu (types possibles : {', '.join(c for c, _ in TYPES_ANOMALIE)})"})
+        queryset = queryset.filter(type__in=sorted(types))
+    return filtrer_activites(queryset, lire_filtres_activites(query_params), prefixe='activite__')
@@ -0,0 +1,235 @@
+"""
+Génération de données PTA synthétiques pour les tests de charge et les benchmarks.
+
+Les données sont déterministes pour une graine donnée et insérées par lots
+avec bulk_create : un million d'activités se chargent en quelques minutes.
+Les répartitions imitent un PTA réel : quelques structures et comptes PCOP
+concentrent l'essentiel des activités (loi de type Zipf), les coûts suivent
+une loi log-normale, l'état et les suivis dépendent des dates de l'activité.
+"""
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.core.management.color import no_style
+from django.db import connection, transaction
+
+from .dimensions import synchroniser_dimensions
+from .models import (
+    Activite, Cible, Direction, Division, ObjectifGeneral, ObjectifSpecifique, PCOPEntry,
+    ResultatAttendu, Service, SourceFinancement, Structure, Suivi, incrementer_version_donnees,
+)
+
+TAILLE_LOT = 5000
+
+VOLUMES_DEFAUT = {
+    'structures': 6,
+    'directions': 4,      # par structure
+    'services': 3,        # par direction
+    'divisions': 2,       # par service
+    'objectifs': 6,       # objectifs généraux
+    'specifiques': 4,     # par objectif général
+    'resultats': 3,       # par objectif spécifique
+    'pcop': 400,
+    'activites': 10000,
+    'suivis_max': 6,      # par activité
+}
+
+DOMAINES = [
+    "Budget", "Trésor", "Santé publique", "Éducation", "Agriculture", "Travaux publics",
+    "Énergie", "Eau et assainissement", "Transports", "Commerce", "Environnement",
+    "Pêche", "Tourisme", "Communication", "Justice", "Sécurité", "Emploi", "Habitat",
+]
+ACTIONS = [
+    "Renforcement des capacités", "Acquisition de matériel", "Réhabilitation", "Formation",
+    "Suivi et évaluation", "Sensibilisation", "Étude de faisabilité", "Construction",
+    "Appui technique", "Mission de contrôle", "Atelier de validation", "Campagne",
+]
+CIBLES = ["Agents de l'État", "Communes", "Régions", "Ménages vulnérables", "Écoles", "Centres de santé", "Producteurs"]
+SOURCES = ["RPI", "Fonds propres", "Banque mondiale", "BAD", "Union européenne", "AFD", "PNUD"]
+LIBELLES_PCOP = {
+    '2': ["Terrains", "Bâtiments", "Matériel de transport", "Matériel informatique", "Mobilier de bureau", "Logiciels"],
+    '6': ["Fournitures de bureau", "Carburant", "Indemnités de mission", "Entretien des véhicules",
+          "Frais de formation", "Locations", "Honoraires", "Frais de communication", "Électricité", "Eau"],
+}
+
+
+def poids_zipf(nombre, exposant=0.9):
+    """Poids cumulés d'une loi de type Zipf : les premiers éléments sont nettement plus fréquents."""
+    return list(accumulate(1 / (rang ** exposant) for rang in range(1, nombre + 1)))
+
+
+def _montant(valeur):
+    return Decimal(str(round(valeur, 2)))
+
+
+def vider_pta():
+    """Vide les tables du PTA (TRUNCATE / DELETE direct, sans charger les objets ni envoyer de signaux)."""
+    modeles = [Suivi, Activite.sources.through, Activite.groupes_cibles.through, Activite,
+               ResultatAttendu, ObjectifSpecifique, ObjectifGeneral,
+               Division, Service, Direction, Structure, PCOPEntry, SourceFinancement, Cible]
+    tables = [modele._meta.db_table for modele in modeles]
+    sql = connection.ops.sql_flush(no_style(), tables, reset_sequences=True, allow_cascade=True)
+    connection.ops.execute_sql_flush(sql)
+
+
+def _creer_organisation(alea, volumes):
+    structures = Structure.objects.bulk_create([
+        Structure(numero=f"ST{i}", nom=f"Ministère {DOMAINES[(i - 1) % len(DOMAINES)]}"
+                  + (f" {(i - 1) // len(DOMAINES) + 1}" if i > len(DOMAINES) else ""))
+        for i in range(1, volumes['structures'] + 1)
+    ])
+    directions = Direction.objects.bulk_create([
+        Direction(structure=structure, numero=f"D{j}", nom=f"Direction {alea.choice(DOMAINES)} {structure.numero}.{j}")
+        for structure in structures for j in range(1, volumes['directions'] + 1)
+    ])
+    services = Service.objects.bulk_create([
+        Service(direction=direction, numero=f"S{k}", nom_service=f"Service {alea.choice(ACTIONS).lower()} {k}")
+        for direction in directions for k in range(1, volumes['services'] + 1)
+    ])
+    divisions = Division.objects.bulk_create([
+        Division(service=service, numero=f"DV{m}", nom=f"Division {m} - {service.nom_service}")
+        for service in services for m in range(1, volumes['divisions'] + 1)
+    ])
+    # Divisions regroupées par structure pour tirer d'abord la structure (répartition inégale)
+    par_structure = {structure.id: [] for structure in structures}
+    directions_par_id = {direction.id: direction for direction in directions}
+    services_par_id = {service.id: service for service in services}
+    for division in divisions:
+        service = services_par_id[division.service_id]
+        direction = directions_par_id[service.direction_id]
+        par_structure[direction.structure_id].append((direction.structure_id, direction.id, service.id, division.id))
+    return [par_structure[structure.id] for structure in structures]
+
+
+def _creer_cadre_logique(alea, volumes):
+    objectifs = ObjectifGeneral.objects.bulk_create([
+        ObjectifGeneral(numero=f"OG{i}", titre=f"Améliorer {DOMAINES[(i - 1) % len(DOMAINES)].lower()}")
+        for i in range(1, volumes['objectifs'] + 1)
+    ])
+    specifiques = ObjectifSpecifique.objects.bulk_create([
+        ObjectifSpecifique(objectif_general=og, numero=f"OS{i}.{j}", titre=f"{alea.choice(ACTIONS)} ({og.numero})")
+        for i, og in enumerate(objectifs, 1) for j in range(1, volumes['specifiques'] + 1)
+    ])
+    resultats = ResultatAttendu.objects.bulk_create([
+        ResultatAttendu(objectif_specifique=os_, numero=f"RA{os_.numero[2:]}.{k}",
+                        description=f"Résultat {k} de l'objectif {os_.numero}")
+        for os_ in specifiques for k in range(1, volumes['resultats'] + 1)
+    ])
+    objectif_general_de = {os_.id: os_.objectif_general_id for os_ in specifiques}
+    return [(objectif_general_de[ra.objectif_specifique_id], ra.objectif_specifique_id, ra.id) for ra in resultats]
+
+
+def _creer_pcop(alea, volumes):
+    entrees = []
+    for n in range(volumes['pcop']):
+        classe = '2' if n % 5 == 0 else '6'
+        entrees.append(PCOPEntry(
+            code=f"{classe}{n:04d}",
+            libelle=alea.choice(LIBELLES_PCOP[classe]),
+            cout_unitaire=_montant(alea.lognormvariate(11 if classe == '2' else 9, 1.0)),
+        ))
+    return [(entree.id, entree.cout_unitaire) for entree in PCOPEntry.objects.bulk_create(entrees)]
+
+
+def _etat(alea, debut, fin, reference):
+    tirage = alea.random()
+    if fin < reference:
+        return 'Terminé' if tirage < 0.85 else 'En cours' if tirage < 0.95 else 'Annulé'
+    if debut <= reference:
+        return 'En cours' if tirage < 0.8 else 'En attente' if tirage < 0.9 else 'Terminé'
+    return 'En attente' if tirage < 0.9 else 'Annulé'
+
+
+def _suivis(alea, activite, reference, suivis_max):
+    """Un suivi par mois écoulé depuis le début de l'activité, avec un avancement croissant."""
+    if activite.date_debut > reference or activite.etat == 'Annulé':
+        return []
+    fin = min(activite.date_fin, reference)
+    duree = max((activite.date_fin - activite.date_debut).days, 1)
+    suivis = []
+    jour = activite.date_debut + timedelta(days=alea.randint(7, 30))
+    while jour <= fin and len(suivis) < suivis_max:
+        avancement = min(100, int(100 * (jour - activite.date_debut).days / duree * alea.uniform(0.6, 1.1)))
+        suivis.append(Suivi(activite_id=activite.id, date_suivi=jour, avancement=avancement,
+                            observation="RAS" if alea.random() < 0.7 else "Retard de décaissement"))
+        jour += timedelta(days=alea.randint(25, 35))
+    if activite.etat == 'Terminé' and suivis:
+        suivis[-1].avancement = 100
+    return suivis
+
+
+def generer_pta(graine=42, annee=None, taille_lot=TAILLE_LOT, progression=None, **volumes):
+    """
+    Crée une organisation, un cadre logique, une nomenclature PCOP, des
+    activités et leurs suivis. Les tables doivent être vides (voir vider_pta).
+    `progression(activites_creees, total)` est appelé après chaque lot.
+    Retourne le nombre d'objets créés par type et la durée.
+    """
+    volumes = {**VOLUMES_DEFAUT, **{cle: valeur for cle, valeur in volumes.items() if valeur is not None}}
+    if Activite.objects.exists() or Structure.objects.exists() or ObjectifGeneral.objects.exists():
+        raise ValueError("La base contient déjà des données PTA : videz-la d'abord")
+    alea = random.Random(graine)
+    annee = annee or date.today().year
+    reference = date(annee, 7, 1)  # date « du jour » des données générées : mi-exercice
+    debut = time.monotonic()
+
+    with transaction.atomic():
+        organisation = _creer_organisation(alea, volumes)
+        cadre = _creer_cadre_logique(alea, volumes)
+        pcop = _creer_pcop(alea, volumes)
+    poids_structures = poids_zipf(len(organisation))
+    poids_cadre = poids_zipf(len(cadre), 0.6)
+    poids_pcop = poids_zipf(len(pcop), 1.1)
+
+    total = volumes['activites']
+    nb_suivis = 0
+    for depart in range(0, total, taille_lot):
+        activites = []
+        for n in range(depart, min(depart + taille_lot, total)):
+            structure, direction, service, division = (None,) * 4
+            if alea.random() > 0.03:
+                divisions = alea.choices(organisation, cum_weights=poids_structures)[0]
+                structure, direction, service, division = alea.choice(divisions)
+            og, os_, ra = alea.choices(cadre, cum_weights=poids_cadre)[0] if alea.random() > 0.05 else (None,) * 3
+            pcop_id, cout_reference = alea.choices(pcop, cum_weights=poids_pcop)[0]
+            cout_unitaire = _montant(float(cout_reference) * alea.lognormvariate(0, 0.3))
+            quantite = Decimal(min(int(alea.paretovariate(1.5)), 500))
+            date_debut = date(annee, 1, 1) + timedelta(days=alea.randint(0, 300))
+            date_fin = date_debut + timedelta(days=alea.randint(15, 270))
+            activites.append(Activite(
+                structure_id=structure, direction_id=direction, service_id=service, division_id=division,
+                objectif_general_id=og, objectif_specifique_id=os_, resultat_attendu_id=ra,
+                activite=f"{alea.choice(ACTIONS)} n°{n + 1}",
+                sous_activite=alea.choice(["", "Préparation", "Mise en œuvre", "Restitution"]),
+                produits=alea.choice(["Rapport", "Équipements livrés", "Agents formés", "Ouvrage réceptionné"]),
+                cibles=alea.choice(CIBLES), sources_financement=alea.choice(SOURCES),
+                pcop_id=pcop_id, cout_unitaire=cout_unitaire, quantite=quantite,
+                montant=(cout_unitaire * quantite).quantize(Decimal('0.01')),
+                date_debut=date_debut, date_fin=date_fin,
+                etat=_etat(alea, date_debut, date_fin, reference),
+            ))
+        with transaction.atomic():
+            Activite.objects.bulk_create(activites)
+            # bulk_create n'envoie pas post_save : rattachement aux sources et cibles normalisées par lot
+            synchroniser_dimensions([(a.pk, a.sources_financement, a.cibles) for a in activites])
+            suivis = [suivi for activite in activites for suivi in _suivis(alea, activite, reference, volumes['suivis_max'])]
+            Suivi.objects.bulk_create(suivis, batch_size=taille_lot)
+        nb_suivis += len(suivis)
+        if progression:
+            progression(depart + len(activites), total)
+
+    # bulk_create n'envoie pas post_save : les exports et les courbes en cache sont invalidés ici
+    incrementer_version_donnees()
+    incrementer_version_donnees('suivis')
+    return {
+        'structures': volumes['structures'],
+        'divisions': sum(len(divisions) for divisions in organisation),
+        'resultats_attendus': len(cadre),
+        'pcop': len(pcop),
+        'activites': total,
+        'suivis': nb_suivis,
+        'duree_secondes': round(time.monotonic() - debut, 1),
+    }
@@ -0,0 +1,494 @@
+"""
+Import en masse des référentiels du PTA (nomenclature PCOP, cadre logique).
+
+Les fichiers CSV (UTF-8 ou Windows-1252) ou XLSX sont lus ligne à ligne. La nomenclature PCOP est
+chargée dans une table de transit (COPY sous PostgreSQL, bulk_create par lots
+ailleurs) puis fusionnée dans la table cible en une seule requête d'upsert ;
+le cadre logique est écrit niveau par niveau avec bulk_create(update_conflicts=True).
+"""
+import codecs
+import csv
+import io
+import logging
+import re
+import time
+import unicodedata
+import uuid
+import zipfile
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+
+from django.db import connection, transaction
+
+from .models import PCOPEntry, PCOPImportLigne, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, incrementer_version_donnees
+
+logger = logging.getLogger(__name__)
+
+TAILLE_LOT = 5000
+TAILLE_BLOC_LECTURE = 1024 * 1024
+MAX_ERREURS_RAPPORTEES = 20
+
+# Noms de colonnes acceptés (après normalisation) pour chaque champ PCOP
+COLONNES_PCOP = {
+    'code': ('code', 'code_pcop', 'compte'),
+    'libelle': ('libelle', 'libelle_pcop', 'intitule'),
+    'cout_unitaire': ('cout_unitaire', 'cout', 'prix_unitaire'),
+}
+
+COLONNES_CADRE_LOGIQUE = {
+    'niveau': ('niveau', 'type'),
+    'numero': ('numero', 'code'),
+    'titre': ('titre', 'intitule', 'libelle'),
+    'description': ('description',),
+}
+
+
+class ErreurImport(ValueError):
+    """Fichier d'import illisible ou incomplet."""
+
+
+# ---------- LECTURE DES FICHIERS ----------
+def normaliser_entete(valeur):
+    texte = unicodedata.normalize('NFKD', str(valeur or '')).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', texte.lower()).strip('_')
+
+
+def convertir_texte(valeur):
+    if valeur is None:
+        return ''
+    if isinstance(valeur, float) and valeur.is_integer():
+        # Les codes numériques saisis dans Excel reviennent en float (6011.0)
+        return str(int(valeur))
+    return str(valeur).strip()
+
+
+def convertir_decimal(valeur, max_chiffres=14):
+    """Convertit un montant saisi (1 234,50 / 1.234,50 / 1234.5) en Decimal à 2 décimales."""
+    if valeur is None or valeur == '':
+        return Decimal('0.00')
+    if isinstance(valeur, float):
+        valeur = repr(valeur)
+    texte = re.sub(r'\s', '', str(valeur))
+    if ',' in texte and '.' in texte:
+        # Le dernier séparateur rencontré est le séparateur décimal
+        if texte.rfind(',') > texte.rfind('.'):
+            texte = texte.replace('.', '').replace(',', '.')
+        else:
+            texte = texte.replace(',', '')
+    else:
+        texte = texte.replace(',', '.')
+    try:
+        montant = Decimal(texte).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+    except InvalidOperation:
+        raise ValueError(f"montant invalide : {valeur!r}")
+    if not montant.is_finite() or abs(montant) >= Decimal(10) ** (max_chiffres - 2):
+        raise ValueError(f"montant hors limites : {valeur!r}")
+    return montant
+
+
+def _encodage_csv(fichier):
+    """UTF-8 si tout le fichier se décode ainsi, sinon Windows-1252 (CSV enregistrés par Excel en français)."""
+    decodeur = codecs.getincrementaldecoder('utf-8')()
+    try:
+        while bloc := fichier.read(TAILLE_BLOC_LECTURE):
+            decodeur.decode(bloc)
+        decodeur.decode(b'', final=True)
+        return 'utf-8-sig'
+    except UnicodeDecodeError:
+        return 'cp1252'
+    finally:
+        fichier.seek(0)
+
+
+def _lire_csv(fichier):
+    if isinstance(fichier, io.TextIOBase):
+        texte = fichier
+    else:
+        texte = io.TextIOWrapper(fichier, encoding=_encodage_csv(fichier), newline='')
+    try:
+        echantillon = texte.read(4096)
+        texte.seek(0)
+        try:
+            dialecte = csv.Sniffer().sniff(echantillon, delimiters=',;\t')
+        except csv.Error:
+            dialecte = csv.excel
+        yield from csv.reader(texte, dialecte)
+    except (UnicodeDecodeError, csv.Error) as e:
+        raise ErreurImport(f"Fichier CSV illisible (encodage attendu : UTF-8 ou Windows-1252) : {e}")
+
+
+def _lire_xlsx(fichier):
+    import openpyxl
+    from openpyxl.utils.exceptions import InvalidFileException
+
+    try:
+        classeur = openpyxl.load_workbook(fichier, read_only=True, data_only=True)
+    except (zipfile.BadZipFile, InvalidFileException, KeyError) as e:
+        raise ErreurImport(f"Fichier XLSX illisible ou corrompu : {e}")
+    try:
+        for ligne in classeur.worksheets[0].iter_rows(values_only=True):
+            yield ligne
+    finally:
+        classeur.close()
+
+
+def lire_lignes(fichier, nom_fichier):
+    """
+    Parcourt un fichier CSV ou XLSX et produit (numéro de ligne, dict) où les
+    clés sont les en-têtes normalisés. Les lignes vides sont ignorées.
+    """
+    if nom_fichier.lower().endswith(('.xlsx', '.xlsm')):
+        lignes = _lire_xlsx(fichier)
+    else:
+        lignes = _lire_csv(fichier)
+
+    entetes = None
+    for numero, ligne in enumerate(lignes, 1):
+        if not any(v not in (None, '') for v in ligne):
+            continue
+        if entetes is None:
+            entetes = [normaliser_entete(v) for v in ligne]
+            continue
+        yield numero, dict(zip(entetes, ligne))
+
+
+def associer_colonnes(entetes, colonnes):
+    """Retourne {champ: entête du fichier} pour les champs reconnus."""
+    trouvees = {}
+    for champ, alias in colonnes.items():
+        for nom in alias:
+            if nom in entetes:
+                trouvees[champ] = nom
+                break
+    return trouvees
+
+
+# ---------- IMPORT DE LA NOMENCLATURE PCOP ----------
+def _lignes_pcop(fichier, nom_fichier, bilan):
+    colonnes = None
+    for numero, valeurs in lire_lignes(fichier, nom_fichier):
+        if colonnes is None:
+            colonnes = associer_colonnes(valeurs.keys(), COLONNES_PCOP)
+            if 'code' not in colonnes:
+                raise ErreurImport("Colonne 'code' introuvable dans le fichier PCOP")
+            bilan['colonnes'] = [c for c in ('libelle', 'cout_unitaire') if c in colonnes]
+
+        bilan['lignes_lues'] += 1
+        try:
+            code = convertir_texte(valeurs.get(colonnes['code']))
+            if not code:
+                raise ValueError("code vide")
+            if len(code) > 50:
+                raise ValueError(f"code trop long : {code!r}")
+            libelle = convertir_texte(valeurs.get(colonnes.get('libelle')))[:255]
+            cout_unitaire = convertir_decimal(valeurs.get(colonnes.get('cout_unitaire')))
+        except ValueError as e:
+            bilan['rejetees'] += 1
+            if len(bilan['erreurs']) < MAX_ERREURS_RAPPORTEES:
+                bilan['erreurs'].append(f"Ligne {numero} : {e}")
+            continue
+        yield code, libelle, cout_unitaire
+
+
+class _FluxCSV:
+    """Objet fichier en lecture seule alimenté par un générateur (COPY psycopg2)."""
+
+    def __init__(self, lot, lignes):
+        self._lignes = lignes
+        self._lot = str(lot)
+        self._tampon = io.StringIO()
+        self._ecrivain = csv.writer(self._tampon)
+        self._reste = b''
+
+    def read(self, taille=-1):
+        while taille < 0 or len(self._reste) < taille:
+            ligne = next(self._lignes, None)
+            if ligne is None:
+                break
+            self._ecrivain.writerow((self._lot, *ligne))
+            self._reste += self._tampon.getvalue().encode()
+            self._tampon.seek(0)
+            self._tampon.truncate()
+        if taille < 0:
+            taille = len(self._reste)
+        morceau, self._reste = self._reste[:taille], self._reste[taille:]
+        return morceau
+
+
+def _charger_transit(lot, lignes, taille_lot):
+    if connection.vendor == 'postgresql':
+        table = connection.ops.quote_name(PCOPImportLigne._meta.db_table)
+        sql = f"COPY {table} (lot, code, libelle, cout_unitaire) FROM STDIN"
+        with connection.cursor() as cursor:
+            brut = cursor.cursor
+            if hasattr(brut, 'copy'):  # psycopg 3
+                with brut.copy(sql) as copie:
+                    for ligne in lignes:
+                        copie.write_row((lot, *ligne))
+            else:  # psycopg2
+                brut.copy_expert(f"{sql} WITH (FORMAT csv)", _FluxCSV(lot, lignes))
+        return
+
+    tampon = []
+    for code, libelle, cout_unitaire in lignes:
+        tampon.append(PCOPImportLigne(lot=lot, code=code, libelle=libelle, cout_unitaire=cout_unitaire))
+        if len(tampon) >= taille_lot:
+            PCOPImportLigne.objects.bulk_create(tampon)
+            tampon = []
+    if tampon:
+        PCOPImportLigne.objects.bulk_create(tampon)
+
+
+def _fusionner_transit(lot, colonnes):
+    qn = connection.ops.quote_name
+    pcop = qn(PCOPEntry._meta.db_table)
+    transit = qn(PCOPImportLigne._meta.db_table)
+    param_lot = PCOPImportLigne._meta.get_field('lot').get_db_prep_value(lot, connection)
+
+    # Une seule ligne par code : la dernière rencontrée dans le fichier
+    derniere_ligne = f"t.id IN (SELECT MAX(id) FROM {transit} WHERE lot = %s GROUP BY code)"
+    difference = ' OR '.join(f"p.{c} <> t.{c}" for c in colonnes) or 'FALSE'
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            SELECT
+                COUNT(*),
+                COALESCE(SUM(CASE WHEN p.id IS NULL THEN 1 ELSE 0 END), 0),
+                COALESCE(SUM(CASE WHEN p.id IS NOT NULL AND ({difference}) THEN 1 ELSE 0 END), 0)
+            FROM {transit} t LEFT JOIN {pcop} p ON p.code = t.code
+            WHERE {derniere_ligne}
+            """,
+            [param_lot],
+        )
+        distinctes, inserees, mises_a_jour = cursor.fetchone()
+
+        if colonnes:
+            action = "DO UPDATE SET {} WHERE {}".format(
+                ', '.join(f"{c} = excluded.{c}" for c in colonnes),
+                ' OR '.join(f"{pcop}.{c} <> excluded.{c}" for c in colonnes),
+            )
+        else:
+            action = "DO NOTHING"
+        cursor.execute(
+            f"""
+            INSERT INTO {pcop} (code, libelle, cout_unitaire)
+            SELECT t.code, t.libelle, t.cout_unitaire FROM {transit} t
+            WHERE {derniere_ligne}
+            ON CONFLICT (code) WHERE NOT (code = '') {action}
+            """,
+            [param_lot],
+        )
+        cursor.execute(f"DELETE FROM {transit} WHERE lot = %s", [param_lot])
+
+    return distinctes, inserees, mises_a_jour
+
+
+def importer_pcop(fichier, nom_fichier, taille_lot=TAILLE_LOT):
+    """
+    Importe une nomenclature PCOP (colonnes code, libelle, cout_unitaire) et
+    fusionne par code. Retourne le bilan de l'import.
+    """
+    debut = time.perf_counter()
+    lot = uuid.uuid4()
+    bilan = {
+        'lignes_lues': 0,
+        'rejetees': 0,
+        'doublons': 0,
+        'inserees': 0,
+        'mises_a_jour': 0,
+        'inchangees': 0,
+        'erreurs': [],
+        'colonnes': [],
+    }
+
+    with transaction.atomic():
+        _charger_transit(lot, _lignes_pcop(fichier, nom_fichier, bilan), taille_lot)
+        if bilan['lignes_lues'] == 0:
+            raise ErreurImport("Le fichier ne contient aucune ligne de données")
+        duree_chargement = time.perf_counter() - debut
+        distinctes, inserees, mises_a_jour = _fusionner_transit(lot, bilan['colonnes'])
+        if inserees or mises_a_jour:
+            incrementer_version_donnees()
+
+    bilan.update({
+        'doublons': bilan['lignes_lues'] - bilan['rejetees'] - distinctes,
+        'inserees': inserees,
+        'mises_a_jour': mises_a_jour,
+        'inchangees': distinctes - inserees - mises_a_jour,
+        'duree_chargement_secondes': round(duree_chargement, 3),
+        'duree_secondes': round(time.perf_counter() - debut, 3),
+    })
+    logger.info(
+        f"Import PCOP {nom_fichier}: {inserees} insérées, {mises_a_jour} mises à jour, "
+        f"{bilan['inchangees']} inchangées, {bilan['rejetees']} rejetées en {bilan['duree_secondes']}s"
+    )
+    return bilan
+
+
+# ---------- IMPORT DU CADRE LOGIQUE (OG / OS / RA) ----------
+NIVEAUX_CADRE_LOGIQUE = ('objectifs_generaux', 'objectifs_specifiques', 'resultats_attendus')
+ALIAS_NIVEAUX = {
+    'og': 0, 'objectif_general': 0, 'objectifs_generaux': 0,
+    'os': 1, 'objectif_specifique': 1, 'objectifs_specifiques': 1,
+    'ra': 2, 'resultat_attendu': 2, 'resultats_attendus': 2,
+}
+
+
+def cle_numero(numero):
+    """Partie numérique d'un numéro : 'OS1.2' -> '1.2', 'RA1.2.3' -> '1.2.3'."""
+    correspondance = re.search(r'(\d+(?:\.\d+)*)\s*$', numero or '')
+    return correspondance.group(1) if correspondance else None
+
+
+def _niveau_numero(numero, niveau=None):
+    """Niveau (0 = OG, 1 = OS, 2 = RA) d'après la colonne niveau, le préfixe ou la profondeur du numéro."""
+    if niveau:
+        return ALIAS_NIVEAUX.get(normaliser_entete(niveau))
+    prefixe = numero[:2].lower()
+    if prefixe in ALIAS_NIVEAUX:
+        return ALIAS_NIVEAUX[prefixe]
+    cle = cle_numero(numero)
+    return cle.count('.') if cle and cle.count('.') < 3 else None
+
+
+def aplatir_arbre(arbre):
+    """
+    Transforme l'arbre JSON (format de ObjectifGeneralSerializer) en liste de
+    noeuds {niveau, numero, titre, description}.
+    """
+    if isinstance(arbre, dict):
+        arbre = arbre.get('objectifs_generaux', [arbre])
+    if not isinstance(arbre, list):
+        raise ErreurImport("L'arbre doit être une liste d'objectifs généraux")
+
+    noeuds = []
+
+    def parcourir(elements, niveau):
+        for element in elements or []:
+            if not isinstance(element, dict):
+                raise ErreurImport(f"Noeud invalide : {element!r}")
+            noeuds.append({
+                'niveau': niveau,
+                'numero': convertir_texte(element.get('numero')),
+                'titre': convertir_texte(element.get('titre')),
+                'description': convertir_texte(element.get('description')),
+            })
+            if niveau < 2:
+                parcourir(element.get(NIVEAUX_CADRE_LOGIQUE[niveau + 1]), niveau + 1)
+
+    parcourir(arbre, 0)
+    return noeuds
+
+
+def lire_noeuds_fichier(fichier, nom_fichier):
+    """Lit un tableur à une ligne par noeud (colonnes numero, titre, description, niveau optionnel)."""
+    noeuds = []
+    colonnes = None
+    for numero, valeurs in lire_lignes(fichier, nom_fichier):
+        if colonnes is None:
+            colonnes = associer_colonnes(valeurs.keys(), COLONNES_CADRE_LOGIQUE)
+            if 'numero' not in colonnes:
+                raise ErreurImport("Colonne 'numero' introuvable dans le fichier du cadre logique")
+        noeud = {champ: convertir_texte(valeurs.get(colonne)) for champ, colonne in colonnes.items()}
+        noeud['ligne'] = numero
+        noeuds.append(noeud)
+    return noeuds
+
+
+def _ecrire_niveau(modele, lignes, champs, bilan):
+    """Écrit en un seul bulk_create les noeuds nouveaux ou modifiés d'un niveau."""
+    existants = {
+        valeurs[0]: valeurs[1:]
+        for valeurs in modele.objects.filter(numero__in=lignes.keys()).values_list('numero', *champs)
+    }
+    a_ecrire = []
+    for numero, valeurs in lignes.items():
+        actuel = existants.get(numero)
+        if actuel is None:
+            bilan['inseres'] += 1
+        elif tuple(actuel) != tuple(valeurs[c] for c in champs):
+            bilan['mis_a_jour'] += 1
+        else:
+            bilan['inchanges'] += 1
+            continue
+        a_ecrire.append(modele(numero=numero, **valeurs))
+
+    if a_ecrire:
+        modele.objects.bulk_create(
+            a_ecrire, batch_size=TAILLE_LOT,
+            update_conflicts=True, unique_fields=['numero'], update_fields=list(champs),
+        )
+        # bulk_create n'émet pas post_save : invalider explicitement les exports
+        incrementer_version_donnees()
+
+
+def importer_cadre_logique(noeuds):
+    """
+    Fusionne par numéro les objectifs généraux, spécifiques et résultats
+    attendus. Les parents sont retrouvés d'après le préfixe du numéro
+    (RA1.2.3 -> OS1.2 -> OG1), dans le fichier ou en base.
+    """
+    debut = time.perf_counter()
+    bilan = {niveau: {'inseres': 0, 'mis_a_jour': 0, 'inchanges': 0} for niveau in NIVEAUX_CADRE_LOGIQUE}
+    bilan['rejetes'] = 0
+    bilan['erreurs'] = []
+
+    def rejeter(noeud, message):
+        bilan['rejetes'] += 1
+        if len(bilan['erreurs']) < MAX_ERREURS_RAPPORTEES:
+            origine = f"Ligne {noeud['ligne']}" if noeud.get('ligne') else (noeud.get('numero') or 'Noeud sans numéro')
+            bilan['erreurs'].append(f"{origine} : {message}")
+
+    # Répartition par niveau ; en cas de doublon, le dernier noeud l'emporte
+    niveaux = ({}, {}, {})
+    for noeud in noeuds:
+        numero = noeud.get('numero') or ''
+        niveau = noeud['niveau'] if isinstance(noeud.get('niveau'), int) else _niveau_numero(numero, noeud.get('niveau'))
+        if not numero or cle_numero(numero) is None:
+            rejeter(noeud, "numéro absent ou sans partie numérique")
+        elif len(numero) > 10:
+            rejeter(noeud, "numéro trop long (10 caractères maximum)")
+        elif niveau is None or cle_numero(numero).count('.') != niveau:
+            rejeter(noeud, f"niveau incohérent avec le numéro {numero}")
+        elif niveau < 2 and not noeud.get('titre'):
+            rejeter(noeud, "titre obligatoire")
+        elif niveau == 2 and not (noeud.get('description') or noeud.get('titre')):
+            rejeter(noeud, "description obligatoire")
+        else:
+            niveaux[niveau][numero] = noeud
+
+    with transaction.atomic():
+        _ecrire_niveau(ObjectifGeneral, {
+            numero: {'titre': n['titre'][:255], 'description': n.get('description', '')}
+            for numero, n in niveaux[0].items()
+        }, ('titre', 'description'), bilan['objectifs_generaux'])
+
+        parents = {cle_numero(numero): pk for pk, numero in ObjectifGeneral.objects.values_list('id', 'numero')}
+        specifiques = {}
+        for numero, n in niveaux[1].items():
+            parent = parents.get(cle_numero(numero).rsplit('.', 1)[0])
+            if parent is None:
+                rejeter(n, f"objectif général parent introuvable pour {numero}")
+                continue
+            specifiques[numero] = {
+                'objectif_general_id': parent, 'titre': n['titre'][:255], 'description': n.get('description', ''),
+            }
+        _ecrire_niveau(ObjectifSpecifique, specifiques,
+                       ('objectif_general_id', 'titre', 'description'), bilan['objectifs_specifiques'])
+
+        parents = {cle_numero(numero): pk for pk, numero in ObjectifSpecifique.objects.values_list('id', 'numero')}
+        resultats = {}
+        for numero, n in niveaux[2].items():
+            parent = parents.get(cle_numero(numero).rsplit('.', 1)[0])
+            if parent is None:
+                rejeter(n, f"objectif spécifique parent introuvable pour {numero}")
+                continue
+            resultats[numero] = {
+                'objectif_specifique_id': parent, 'description': n.get('description') or n.get('titre'),
+            }
+        _ecrire_niveau(ResultatAttendu, resultats,
+                       ('objectif_specifique_id', 'description'), bilan['resultats_attendus'])
+
+    bilan['duree_secondes'] = round(time.perf_counter() - debut, 3)
+    logger.info(f"Import du cadre logique: {bilan}")
+    return bilan
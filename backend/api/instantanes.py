@@ -0,0 +1,461 @@
+"""
+Instantanés figés du PTA : l'état exact du plan à un moment donné (plan
+validé, fin d'exercice...), relu sans toucher aux tables courantes.
+
+Le figement lit toutes les activités en une requête (hiérarchies des
+structures et des objectifs jointes et mises à plat, comme les lignes de
+PTA_PRINCIPAL) et les range en colonnes :
+- identifiants et dates (ordinaux) : entiers 64 bits ;
+- coût unitaire, quantité, montant : centimes en entiers 64 bits (exacts) ;
+- textes : dictionnaire des valeurs distinctes + code 32 bits par activité
+  (les libellés de structure, d'objectif, de compte... se répètent).
+
+Chaque colonne est compressée séparément (zlib) dans un seul blob,
+enregistré avec son empreinte SHA-256 dans InstantanePTA. Une lecture ne
+décompresse que les colonnes utiles ; les statistiques du tableau de bord
+sont calculées une fois, au figement.
+
+Les exports historiques (CSV, Parquet) relisent les lignes du blob. La
+comparaison de deux instantanés (ou d'un instantané et du PTA courant)
+aligne les activités par identifiant et compare les colonnes en NumPy ;
+les écarts par structure, objectif, compte... sont regroupés par libellé,
+ce qui permet aussi de comparer deux exercices dont les activités diffèrent.
+
+Les colonnes n'utilisent que la bibliothèque standard (array, zlib) :
+seule la comparaison nécessite NumPy (ImportError sinon).
+"""
+import hashlib
+import json
+import logging
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import date
+from decimal import Decimal
+from itertools import islice
+
+from django.utils import timezone
+
+from .filtres import CHAMPS_FILTRE_ACTIVITE
+from .models import Activite, InstantanePTA, version_donnees
+from .sources import CHAMPS_LIGNE_PTA, TAILLE_PAQUET, ligne_pta
+
+logger = logging.getLogger(__name__)
+
+FORMAT = b'PTA\x01'
+# Valeur des entiers absents (activité non rattachée, date inconnue)
+NUL = -2 ** 63
+# zlib niveau 1 : 5 fois plus rapide que le niveau 6 pour 15 % d'octets en plus sur ces colonnes
+NIVEAU_COMPRESSION = 1
+# Contenus décompressés gardés en mémoire du processus (les instantanés ne changent pas)
+MAX_CONTENUS_EN_MEMOIRE = 4
+# Activités détaillées au plus dans une comparaison
+LIMITE_DETAILS = 100
+
+# Colonnes d'une ligne de PTA_PRINCIPAL, dans l'ordre de HEADERS_PTA
+COLONNES_LIGNE = (
+    'objectif_general', 'objectif_specifique', 'resultat_attendu',
+    'structure', 'direction', 'service', 'division',
+    'activite', 'sous_activite', 'produits', 'cibles', 'sources_financement',
+    'pcop_code', 'pcop_libelle', 'cout_unitaire', 'quantite', 'montant', 'observation', 'etat',
+)
+COLONNES_CENTIMES = ('cout_unitaire', 'quantite', 'montant')
+COLONNES_ENTIERES = ('id', *(f'{champ}_id' for champ in CHAMPS_FILTRE_ACTIVITE))
+COLONNES_DATES = ('date_debut', 'date_fin')
+TYPES_COLONNES = {
+    **{nom: 'entier' for nom in COLONNES_ENTIERES},
+    **{nom: 'date' for nom in COLONNES_DATES},
+    **{nom: 'centimes' if nom in COLONNES_CENTIMES else 'texte' for nom in COLONNES_LIGNE},
+}
+
+# Regroupements de la comparaison : colonnes de libellés
+NIVEAUX_COMPARAISON = (
+    'structure', 'direction', 'service', 'division',
+    'objectif_general', 'objectif_specifique', 'resultat_attendu',
+    'pcop_code', 'sources_financement', 'etat',
+)
+NIVEAUX_DEFAUT = ('structure', 'objectif_general', 'pcop_code')
+
+_verrou = threading.Lock()
+_contenus = OrderedDict()
+
+
+def _octets(tableau):
+    # Stockage petit-boutiste, quelle que soit la machine
+    if sys.byteorder == 'big':
+        tableau = array(tableau.typecode, tableau)
+        tableau.byteswap()
+    return tableau.tobytes()
+
+
+def _tableau(typecode, octets):
+    tableau = array(typecode)
+    tableau.frombytes(octets)
+    if sys.byteorder == 'big':
+        tableau.byteswap()
+    return tableau
+
+
+def construire_blob(activites=None):
+    """
+    Lit les activités (toutes par défaut) en une requête et retourne le blob
+    de colonnes compressées.
+    """
+    activites = Activite.objects.all() if activites is None else activites
+    valeurs = activites.order_by('id').values_list('id', *CHAMPS_LIGNE_PTA, *COLONNES_DATES)
+    # Position des identifiants de rattachement et des dates dans une ligne lue
+    positions = {
+        **{f'{champ}_id': 1 + CHAMPS_LIGNE_PTA.index(champ) for champ in CHAMPS_FILTRE_ACTIVITE},
+        'date_debut': len(CHAMPS_LIGNE_PTA) + 1, 'date_fin': len(CHAMPS_LIGNE_PTA) + 2,
+    }
+    entiers = {nom: array('q') for nom in (*COLONNES_ENTIERES, *COLONNES_DATES, *COLONNES_CENTIMES)}
+    dictionnaires = {nom: {} for nom in COLONNES_LIGNE if TYPES_COLONNES[nom] == 'texte'}
+    codes = {nom: array('i') for nom in dictionnaires}
+
+    # Traitement colonne par colonne de chaque paquet : extend plutôt qu'un append par valeur
+    lecture = valeurs.iterator(chunk_size=TAILLE_PAQUET)
+    while paquet := list(islice(lecture, TAILLE_PAQUET)):
+        colonnes = list(zip(*paquet))
+        pta = list(zip(*(ligne_pta(ligne[1:-2]) for ligne in paquet)))
+        entiers['id'].extend(colonnes[0])
+        for nom in COLONNES_ENTIERES[1:]:
+            entiers[nom].extend([NUL if v is None else v for v in colonnes[positions[nom]]])
+        for nom in COLONNES_DATES:
+            entiers[nom].extend([jour.toordinal() if jour else NUL for jour in colonnes[positions[nom]]])
+        for i, nom in enumerate(COLONNES_LIGNE):
+            if nom in dictionnaires:
+                dictionnaire = dictionnaires[nom]
+                codes[nom].extend([dictionnaire.setdefault(v, len(dictionnaire)) for v in pta[i]])
+            else:
+                entiers[nom].extend([int(v.scaleb(2)) for v in pta[i]])
+
+    segments, colonnes, position = [], [], 0
+
+    def ajouter(octets):
+        nonlocal position
+        compresse = zlib.compress(octets, NIVEAU_COMPRESSION)
+        segments.append(compresse)
+        position += len(compresse)
+        return [position - len(compresse), len(compresse)]
+
+    for nom, type_colonne in TYPES_COLONNES.items():
+        if type_colonne == 'texte':
+            parties = [ajouter(json.dumps(list(dictionnaires[nom]), ensure_ascii=False).encode()), ajouter(_octets(codes[nom]))]
+        else:
+            parties = [ajouter(_octets(entiers[nom]))]
+        colonnes.append({'nom': nom, 'type': type_colonne, 'segments': parties})
+    entete = json.dumps({'lignes': len(entiers['id']), 'colonnes': colonnes}).encode()
+    return b''.join([FORMAT, struct.pack('<I', len(entete)), entete, *segments])
+
+
+class ContenuInstantane:
+    """Lecture colonne par colonne d'un blob produit par construire_blob."""
+
+    def __init__(self, blob):
+        blob = bytes(blob)
+        if blob[:len(FORMAT)] != FORMAT:
+            raise ValueError("Format d'instantané inconnu")
+        taille_entete, = struct.unpack_from('<I', blob, len(FORMAT))
+        debut = len(FORMAT) + 4
+        entete = json.loads(blob[debut:debut + taille_entete])
+        self._donnees = memoryview(blob)[debut + taille_entete:]
+        self._colonnes = {colonne['nom']: colonne for colonne in entete['colonnes']}
+        self.lignes = entete['lignes']
+        self._decodees = {}
+
+    def __len__(self):
+        return self.lignes
+
+    def _segment(self, nom, partie=0):
+        debut, taille = self._colonnes[nom]['segments'][partie]
+        return zlib.decompress(self._donnees[debut:debut + taille])
+
+    def type(self, nom):
+        return self._colonnes[nom]['type']
+
+    def entiers(self, nom):
+        """Entiers bruts d'une colonne numérique (NUL pour les valeurs absentes)."""
+        return _tableau('q', self._segment(nom))
+
+    def dictionnaire(self, nom):
+        return json.loads(self._segment(nom, 0))
+
+    def codes(self, nom):
+        """Code de chaque activité dans le dictionnaire d'une colonne texte."""
+        return _tableau('i', self._segment(nom, 1))
+
+    def valeurs(self, nom):
+        """Valeurs Python d'une colonne (Decimal pour les montants, date pour les dates), décodées une fois."""
+        if nom not in self._decodees:
+            type_colonne = self.type(nom)
+            if type_colonne == 'texte':
+                dictionnaire = self.dictionnaire(nom)
+                valeurs = [dictionnaire[code] for code in self.codes(nom)]
+            elif type_colonne == 'centimes':
+                valeurs = [Decimal(v).scaleb(-2) for v in self.entiers(nom)]
+            elif type_colonne == 'date':
+                valeurs = [None if v == NUL else date.fromordinal(v) for v in self.entiers(nom)]
+            else:
+                valeurs = [None if v == NUL else v for v in self.entiers(nom)]
+            self._decodees[nom] = valeurs
+        return self._decodees[nom]
+
+    def tableau(self, nom):
+        """Colonne en tableau NumPy, sans copie : entiers pour les colonnes numériques, codes pour les textes."""
+        import numpy as np
+
+        if self.type(nom) == 'texte':
+            return np.frombuffer(self._segment(nom, 1), dtype='<i4')
+        return np.frombuffer(self._segment(nom), dtype='<i8')
+
+
+# ---------- FIGEMENT ----------
+def _par_libelle(contenu, nom, montants):
+    """{libellé: [nombre d'activités, montant en centimes]} d'une colonne texte."""
+    dictionnaire = contenu.dictionnaire(nom)
+    nombres = [0] * len(dictionnaire)
+    centimes = [0] * len(dictionnaire)
+    for code, montant in zip(contenu.codes(nom), montants):
+        nombres[code] += 1
+        centimes[code] += montant
+    return {libelle: [n, c] for libelle, n, c in zip(dictionnaire, nombres, centimes)}
+
+
+def statistiques_instantane(contenu):
+    """Statistiques du tableau de bord calculées sur le contenu de l'instantané."""
+    montants = contenu.entiers('montant')
+    total = sum(montants)
+    etats = _par_libelle(contenu, 'etat', montants)
+
+    def distincts(champ):
+        return len(set(contenu.entiers(f'{champ}_id')) - {NUL})
+
+    def repartition(nom):
+        return {
+            libelle: {'activites': n, 'montant': c / 100}
+            for libelle, (n, c) in sorted(_par_libelle(contenu, nom, montants).items(), key=lambda e: -e[1][1])
+        }
+
+    return {
+        'total_activites': len(contenu),
+        'budget_total': total / 100,
+        'montant_total_activites': total / 100,
+        # Rattachements utilisés par les activités du plan
+        'total_structures': distincts('structure'),
+        'total_directions': distincts('direction'),
+        'total_services': distincts('service'),
+        'total_divisions': distincts('division'),
+        'objectifs_generaux_count': distincts('objectif_general'),
+        'objectifs_specifiques_count': distincts('objectif_specifique'),
+        'resultats_attendus_count': distincts('resultat_attendu'),
+        'activites_by_etat': {
+            'en_cours': etats.get('En cours', [0])[0],
+            'termine': etats.get('Terminé', [0])[0],
+            'en_attente': etats.get('En attente', [0])[0],
+            'annule': etats.get('Annulé', [0])[0],
+        },
+        'activites_by_structure': {libelle: n for libelle, (n, _) in _par_libelle(contenu, 'structure', montants).items()},
+        'budget_par_structure': repartition('structure'),
+        'budget_par_objectif_general': repartition('objectif_general'),
+        'budget_par_pcop': repartition('pcop_code'),
+    }
+
+
+def figer_pta(nom, annee=None, description='', utilisateur=None):
+    """Fige le PTA courant dans un nouvel InstantanePTA."""
+    debut = time.perf_counter()
+    version = version_donnees()
+    blob = construire_blob()
+    contenu = ContenuInstantane(blob)
+    statistiques = statistiques_instantane(contenu)
+    instantane = InstantanePTA.objects.create(
+        nom=nom,
+        annee=annee or timezone.now().year,
+        description=description,
+        cree_par=utilisateur if utilisateur is not None and utilisateur.is_authenticated else None,
+        version_donnees=version,
+        nb_activites=len(contenu),
+        montant_total=Decimal(sum(contenu.entiers('montant'))).scaleb(-2),
+        statistiques=statistiques,
+        donnees=blob,
+        taille=len(blob),
+        empreinte=hashlib.sha256(blob).hexdigest(),
+    )
+    logger.info(
+        f"PTA figé dans l'instantané {instantane.pk} : {len(contenu)} activités, "
+        f"{len(blob)} octets, {time.perf_counter() - debut:.3f} s"
+    )
+    return instantane
+
+
+# ---------- LECTURE ----------
+def contenu_instantane(instantane):
+    """Contenu d'un instantané, vérifié par son empreinte ; gardé en mémoire pour les lectures suivantes."""
+    cle = (instantane.pk, instantane.empreinte)
+    with _verrou:
+        if cle in _contenus:
+            _contenus.move_to_end(cle)
+            return _contenus[cle]
+    blob = bytes(InstantanePTA.objects.filter(pk=instantane.pk).values_list('donnees', flat=True).get())
+    if hashlib.sha256(blob).hexdigest() != instantane.empreinte:
+        raise ValueError(f"Instantané {instantane.pk} corrompu : empreinte SHA-256 différente")
+    contenu = ContenuInstantane(blob)
+    with _verrou:
+        _contenus[cle] = contenu
+        while len(_contenus) > MAX_CONTENUS_EN_MEMOIRE:
+            _contenus.popitem(last=False)
+    return contenu
+
+
+def contenu_courant():
+    """Contenu construit depuis les tables courantes, sans enregistrement (comparaison avec le PTA actuel)."""
+    return ContenuInstantane(construire_blob())
+
+
+def indices_filtres(contenu, filtres=None):
+    """Positions des activités retenues par des filtres normalisés (voir lire_filtres_activites)."""
+    filtres = filtres or {}
+    retenues = range(len(contenu))
+    for champ in CHAMPS_FILTRE_ACTIVITE:
+        if champ in filtres:
+            ids = set(filtres[champ])
+            colonne = contenu.valeurs(f'{champ}_id')
+            retenues = [i for i in retenues if colonne[i] in ids]
+    if 'etat' in filtres:
+        etats = set(filtres['etat'])
+        colonne = contenu.valeurs('etat')
+        retenues = [i for i in retenues if colonne[i] in etats]
+    # Même chevauchement de période que filtrer_activites : fin après le début, début avant la fin
+    if 'du' in filtres:
+        du = date.fromisoformat(filtres['du']).toordinal()
+        colonne = contenu.entiers('date_fin')
+        retenues = [i for i in retenues if colonne[i] != NUL and colonne[i] >= du]
+    if 'au' in filtres:
+        au = date.fromisoformat(filtres['au']).toordinal()
+        colonne = contenu.entiers('date_debut')
+        retenues = [i for i in retenues if colonne[i] != NUL and colonne[i] <= au]
+    return retenues
+
+
+def lignes_instantane(contenu, filtres=None):
+    """Itère sur les lignes de PTA_PRINCIPAL de l'instantané, dans l'ordre des activités."""
+    colonnes = [contenu.valeurs(nom) for nom in COLONNES_LIGNE]
+    for i in indices_filtres(contenu, filtres):
+        yield [colonne[i] for colonne in colonnes]
+
+
+# ---------- COMPARAISON ----------
+def _codes_communs(avant, apres, nom):
+    """Codes d'une colonne texte des deux contenus, ramenés à un même dictionnaire."""
+    import numpy as np
+
+    dictionnaire = apres.dictionnaire(nom)
+    positions = {valeur: i for i, valeur in enumerate(dictionnaire)}
+    for valeur in avant.dictionnaire(nom):
+        positions.setdefault(valeur, len(positions))
+    correspondance = np.array([positions[valeur] for valeur in avant.dictionnaire(nom)], dtype=np.int64)
+    libelles = list(positions)
+    return correspondance[avant.tableau(nom)], apres.tableau(nom).astype(np.int64), libelles
+
+
+def _json(valeur):
+    if isinstance(valeur, Decimal):
+        return float(valeur)
+    if isinstance(valeur, date):
+        return valeur.isoformat()
+    return valeur
+
+
+def _bilan(n_avant, n_apres, avant, apres):
+    avant, apres = avant / 100, apres / 100
+    return {
+        'activites_avant': int(n_avant),
+        'activites_apres': int(n_apres),
+        'montant_avant': round(float(avant), 2),
+        'montant_apres': round(float(apres), 2),
+        'ecart': round(float(apres - avant), 2),
+        'ecart_pct': round(float((apres - avant) / avant * 100), 2) if avant else None,
+    }
+
+
+def comparer(avant, apres, niveaux=NIVEAUX_DEFAUT, limite=LIMITE_DETAILS):
+    """
+    Écarts entre deux contenus : activités ajoutées, supprimées ou modifiées
+    (alignées par identifiant), nombre de modifications par colonne, écarts
+    de montant au total et par niveau (regroupés par libellé), et le détail
+    des `limite` premières activités de chaque catégorie.
+    """
+    import numpy as np
+
+    ids_avant, ids_apres = avant.tableau('id'), apres.tableau('id')
+    communs, i_avant, i_apres = np.intersect1d(ids_avant, ids_apres, assume_unique=True, return_indices=True)
+    supprimees = np.setdiff1d(ids_avant, communs, assume_unique=True)
+    ajoutees = np.setdiff1d(ids_apres, communs, assume_unique=True)
+
+    modifiees = np.zeros(len(communs), dtype=bool)
+    differences = {}
+    champs_modifies = {}
+    for nom in TYPES_COLONNES:
+        if nom == 'id':
+            continue
+        if avant.type(nom) == 'texte':
+            colonne_avant, colonne_apres, _ = _codes_communs(avant, apres, nom)
+        else:
+            colonne_avant, colonne_apres = avant.tableau(nom), apres.tableau(nom)
+        difference = colonne_avant[i_avant] != colonne_apres[i_apres]
+        if difference.any():
+            champs_modifies[nom] = int(difference.sum())
+            differences[nom] = difference
+            modifiees |= difference
+
+    montants_avant, montants_apres = avant.tableau('montant'), apres.tableau('montant')
+    resultats_niveaux = {}
+    for niveau in niveaux:
+        codes_avant, codes_apres, libelles = _codes_communs(avant, apres, niveau)
+        n = len(libelles)
+        nombres_avant = np.bincount(codes_avant, minlength=n)
+        nombres_apres = np.bincount(codes_apres, minlength=n)
+        # Sommes en centimes : exactes en flottant tant qu'elles restent sous 2**53
+        sommes_avant = np.bincount(codes_avant, montants_avant, n)
+        sommes_apres = np.bincount(codes_apres, montants_apres, n)
+        ecarts = sommes_apres - sommes_avant
+        changes = np.flatnonzero((ecarts != 0) | (nombres_avant != nombres_apres))
+        changes = changes[np.argsort(-np.abs(ecarts[changes]), kind='stable')]
+        resultats_niveaux[niveau] = [
+            {'libelle': libelles[i], **_bilan(nombres_avant[i], nombres_apres[i], sommes_avant[i], sommes_apres[i])}
+            for i in changes.tolist()
+        ]
+
+    positions = np.flatnonzero(modifiees)[:limite].tolist()
+    details_modifiees = []
+    for position in positions:
+        a, b = int(i_avant[position]), int(i_apres[position])
+        details_modifiees.append({
+            'id': int(communs[position]),
+            'activite': apres.valeurs('activite')[b],
+            'changements': {
+                nom: [_json(avant.valeurs(nom)[a]), _json(apres.valeurs(nom)[b])]
+                for nom, difference in differences.items() if difference[position]
+            },
+        })
+
+    return {
+        'activites': {
+            'ajoutees': len(ajoutees),
+            'supprimees': len(supprimees),
+            'modifiees': int(modifiees.sum()),
+            'inchangees': int(len(communs) - modifiees.sum()),
+        },
+        'champs_modifies': champs_modifies,
+        'total': _bilan(len(avant), len(apres), montants_avant.sum(), montants_apres.sum()),
+        'niveaux': resultats_niveaux,
+        'details': {
+            'ajoutees': ajoutees[:limite].tolist(),
+            'supprimees': supprimees[:limite].tolist(),
+            'modifiees': details_modifiees,
+        },
+    }
@@ -0,0 +1,151 @@
+"""
+Mesures par requête HTTP : nombre de requêtes SQL, temps passé en base, en
+sérialisation et en rendu.
+
+Elles sont renvoyées dans l'en-tête Server-Timing (visible dans l'onglet
+Réseau du navigateur) et journalisées lorsque la requête dépasse les seuils
+SEUIL_REQUETES_SQL ou SEUIL_DUREE_REQUETE_MS. Le temps de sérialisation
+inclut les requêtes SQL déclenchées pendant la sérialisation (N+1).
+"""
+import logging
+import time
+from contextlib import ExitStack
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db import connections
+
+from .metriques import observer_requete
+
+logger = logging.getLogger(__name__)
+
+_mesure_courante = ContextVar('mesure_requete', default=None)
+
+
+class MesureRequete:
+    """Compteurs d'une requête HTTP ; sert aussi de execute_wrapper sur les connexions."""
+
+    def __init__(self):
+        self.requetes = 0
+        self.duree_sql = 0.0
+        self.duree_serialisation = 0.0
+        self.duree_rendu = 0.0
+        self.profondeur_serialisation = 0
+        self.vue = None
+
+    def __call__(self, execute, sql, params, many, context):
+        debut = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.requetes += 1
+            self.duree_sql += time.perf_counter() - debut
+
+
+def mesure_courante():
+    """Mesure de la requête HTTP en cours, ou None hors d'une requête."""
+    return _mesure_courante.get()
+
+
+class SerialisationMesuree:
+    """
+    Mixin de serializer : cumule la durée de to_representation dans la mesure
+    de la requête. Seul le serializer le plus externe est chronométré, les
+    serializers imbriqués ne sont donc pas comptés deux fois.
+    """
+
+    def to_representation(self, instance):
+        mesure = _mesure_courante.get()
+        if mesure is None or mesure.profondeur_serialisation:
+            return super().to_representation(instance)
+        mesure.profondeur_serialisation += 1
+        debut = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            mesure.duree_serialisation += time.perf_counter() - debut
+            mesure.profondeur_serialisation -= 1
+
+
+def nom_vue(view_func, methode):
+    """Nom lisible de la vue : 'ActiviteViewSet.list', 'export_pta_excel'..."""
+    classe = getattr(view_func, 'cls', None)
+    if classe is None:
+        return getattr(view_func, '__name__', repr(view_func))
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return f"{classe.__name__}.{actions.get(methode.lower(), methode.lower())}"
+    # Les vues @api_view portent le nom de la fonction décorée
+    return classe.__name__
+
+
+def taille_reponse(response):
+    if not response.streaming:
+        return len(response.content)
+    longueur = response.get('Content-Length')
+    return int(longueur) if longueur else None
+
+
+def _millisecondes(secondes):
+    return round(secondes * 1000, 1)
+
+
+class ServerTimingMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        mesure = MesureRequete()
+        request.mesure_requete = mesure
+        jeton = _mesure_courante.set(mesure)
+        debut = time.perf_counter()
+        try:
+            with ExitStack() as pile:
+                for alias in connections:
+                    pile.enter_context(connections[alias].execute_wrapper(mesure))
+                response = self.get_response(request)
+        finally:
+            _mesure_courante.reset(jeton)
+        duree = time.perf_counter() - debut
+
+        # Pour une réponse en flux, seule la préparation est mesurée (pas l'envoi du contenu)
+        response['Server-Timing'] = ", ".join([
+            f'sql;dur={_millisecondes(mesure.duree_sql)};desc="{mesure.requetes} requetes"',
+            f'serialisation;dur={_millisecondes(mesure.duree_serialisation)}',
+            f'rendu;dur={_millisecondes(mesure.duree_rendu)}',
+            f'total;dur={_millisecondes(duree)}',
+        ])
+        self.journaliser(request, response, mesure, duree)
+        observer_requete(
+            mesure.vue, request.method, response.status_code, duree, mesure.requetes, taille_reponse(response),
+        )
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        mesure = _mesure_courante.get()
+        if mesure is not None:
+            mesure.vue = nom_vue(view_func, request.method)
+
+    def process_template_response(self, request, response):
+        # Les réponses DRF sont rendues (JSON...) après la vue : on chronomètre ce rendu
+        mesure = _mesure_courante.get()
+        if mesure is not None:
+            debut = time.perf_counter()
+
+            def fin_rendu(response):
+                mesure.duree_rendu += time.perf_counter() - debut
+
+            response.add_post_render_callback(fin_rendu)
+        return response
+
+    def journaliser(self, request, response, mesure, duree):
+        seuil_requetes = getattr(settings, 'SEUIL_REQUETES_SQL', None)
+        seuil_duree = getattr(settings, 'SEUIL_DUREE_REQUETE_MS', None)
+        trop_de_requetes = seuil_requetes is not None and mesure.requetes > seuil_requetes
+        trop_long = seuil_duree is not None and duree * 1000 > seuil_duree
+        if trop_de_requetes or trop_long:
+            logger.warning(
+                f"Requête coûteuse: {request.method} {request.get_full_path()} ({response.status_code}) "
+                f"{_millisecondes(duree)} ms, {mesure.requetes} requêtes SQL ({_millisecondes(mesure.duree_sql)} ms), "
+                f"sérialisation {_millisecondes(mesure.duree_serialisation)} ms, rendu {_millisecondes(mesure.duree_rendu)} ms"
+            )
@@ -0,0 +1,328 @@
+"""
+File de tâches d'arrière-plan adossée à la base de données.
+
+Les vues créent des Job ; `manage.py runworker` les réserve avec
+SELECT ... FOR UPDATE SKIP LOCKED et exécute la fonction enregistrée pour
+leur type, hors des workers HTTP. Aucun broker externe n'est nécessaire.
+"""
+import json
+import logging
+import os
+import socket
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connection, connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .anomalies import analyser_budgets
+from .artefacts import horodatage_artefact
+from .exports import artefact_pta, nom_fichier_pta, precalculer_exports
+from .filtres import lire_filtres_json
+from .imports import ErreurImport, aplatir_arbre, importer_cadre_logique, importer_pcop, lire_noeuds_fichier
+from .instantanes import figer_pta
+from .metriques import observer_job
+from .models import Activite, Job, Suivi
+from .paquets import DECOUPAGES, artefact_paquet, nom_fichier_paquet
+from .previsions import calculer_previsions
+from .requetes_lentes import origine_sql
+
+logger = logging.getLogger(__name__)
+
+# type de job -> {'fonction': callable(job) -> dict, 'roles': rôles autorisés (None = tous),
+#                  'parametres': callable(dict) -> dict normalisé, lève ValueError (None = aucun paramètre lu)}
+TACHES = {}
+
+
+def tache(nom, roles=None, parametres=None):
+    """Enregistre la fonction décorée comme exécutant des jobs de type `nom`."""
+    def enregistrer(fonction):
+        TACHES[nom] = {'fonction': fonction, 'roles': roles, 'parametres': parametres}
+        return fonction
+    return enregistrer
+
+
+def _booleen(parametres, nom):
+    valeur = parametres.get(nom, False)
+    if not isinstance(valeur, bool):
+        raise ValueError(f"Le paramètre {nom} doit être un booléen")
+    return valeur
+
+
+def role_utilisateur(user):
+    if user.is_superuser:
+        return 'admin'
+    try:
+        return user.userprofile.role
+    except AttributeError:
+        return None
+
+
+def peut_soumettre(user, type_job):
+    definition = TACHES.get(type_job)
+    if definition is None:
+        return False
+    return definition['roles'] is None or role_utilisateur(user) in definition['roles']
+
+
+def soumettre_job(type_job, utilisateur=None, parametres=None, fichier=None):
+    job = Job(type=type_job, parametres=parametres or {})
+    if utilisateur is not None and utilisateur.is_authenticated:
+        job.cree_par = utilisateur
+    if fichier is not None:
+        job.fichier_entree.save(os.path.basename(fichier.name), fichier, save=False)
+    job.save()
+    logger.info(f"Job {job.pk} ({type_job}) soumis")
+    return job
+
+
+# ---------- EXÉCUTION ----------
+def nom_worker():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def recuperer_jobs_abandonnes(delai=None):
+    """Passe en échec les jobs en cours dont le worker ne donne plus signe de vie (OOM, SIGKILL, déploiement)."""
+    delai = getattr(settings, 'JOB_DELAI_ABANDON', 300) if delai is None else delai
+    maintenant = timezone.now()
+    limite = maintenant - timedelta(seconds=delai)
+    abandonnes = Job.objects.filter(statut='en_cours').filter(
+        Q(battement_le__lt=limite) | Q(battement_le__isnull=True, demarre_le__lt=limite)
+    )
+    nombre = abandonnes.update(
+        statut='echec',
+        erreur=f"Worker arrêté pendant l'exécution (aucun signe de vie depuis plus de {delai} s)",
+        termine_le=maintenant,
+    )
+    if nombre:
+        logger.warning(f"{nombre} job(s) abandonné(s) passé(s) en échec")
+    return nombre
+
+
+@contextmanager
+def battement(job):
+    """Rafraîchit `battement_le` du job à intervalle régulier depuis un thread, le temps de l'exécution."""
+    intervalle = getattr(settings, 'JOB_INTERVALLE_BATTEMENT', 30)
+    fin = threading.Event()
+
+    def battre():
+        try:
+            while not fin.wait(intervalle):
+                Job.objects.filter(pk=job.pk, statut='en_cours').update(battement_le=timezone.now())
+        except Exception as e:
+            logger.error(f"Battement du job {job.pk} interrompu : {str(e)}")
+        finally:
+            # Connexion propre au thread : à fermer explicitement
+            connections.close_all()
+
+    fil = threading.Thread(target=battre, name=f"battement-job-{job.pk}", daemon=True)
+    fil.start()
+    try:
+        yield
+    finally:
+        fin.set()
+        fil.join()
+
+
+def reserver_job(worker):
+    """Réserve le plus ancien job en attente, ou retourne None si la file est vide."""
+    # ✅ Chaque réservation (donc aussi le démarrage du worker) libère d'abord les jobs abandonnés
+    recuperer_jobs_abandonnes()
+    en_attente = Job.objects.filter(statut='en_attente').order_by('cree_le', 'id')
+    while True:
+        if connection.features.has_select_for_update_skip_locked:
+            with transaction.atomic():
+                job = en_attente.select_for_update(skip_locked=True).first()
+                if job is None:
+                    return None
+                maintenant = timezone.now()
+                reserve = Job.objects.filter(pk=job.pk).update(
+                    statut='en_cours', worker=worker, demarre_le=maintenant, battement_le=maintenant,
+                )
+        else:
+            # Sans FOR UPDATE (SQLite), la mise à jour conditionnelle départage les workers concurrents
+            job = en_attente.first()
+            if job is None:
+                return None
+            maintenant = timezone.now()
+            reserve = Job.objects.filter(pk=job.pk, statut='en_attente').update(
+                statut='en_cours', worker=worker, demarre_le=maintenant, battement_le=maintenant,
+            )
+        if reserve:
+            job.statut, job.worker, job.demarre_le, job.battement_le = 'en_cours', worker, maintenant, maintenant
+            return job
+
+
+def executer_job(job):
+    definition = TACHES.get(job.type)
+    try:
+        if definition is None:
+            raise ValueError(f"Type de tâche inconnu : {job.type}")
+        with origine_sql(f"job:{job.type}"):
+            resultat = definition['fonction'](job)
+    except Exception as e:
+        logger.error(f"Échec du job {job.pk} ({job.type}): {str(e)}", exc_info=True)
+        job.statut = 'echec'
+        job.erreur = str(e) or e.__class__.__name__
+    else:
+        job.statut = 'termine'
+        job.progression = 100
+        job.resultat = resultat
+        logger.info(f"Job {job.pk} ({job.type}) terminé")
+    job.termine_le = timezone.now()
+    job.save(update_fields=['statut', 'progression', 'resultat', 'erreur', 'fichier_resultat', 'termine_le'])
+    observer_job(job.type, job.statut, (job.termine_le - job.demarre_le).total_seconds() if job.demarre_le else 0)
+    return job
+
+
+def boucle_worker(arret, intervalle=2.0, une_fois=False):
+    """Exécute les jobs en attente jusqu'à ce que `arret` soit positionné (ou la file vide si `une_fois`)."""
+    worker = nom_worker()
+    logger.info(f"Worker {worker} démarré")
+    while not arret.is_set():
+        job = reserver_job(worker)
+        if job is None:
+            if une_fois:
+                break
+            arret.wait(intervalle)
+            continue
+        with battement(job):
+            executer_job(job)
+    logger.info(f"Worker {worker} arrêté")
+
+
+# ---------- TÂCHES ----------
+def parametres_export_pta(parametres):
+    filtres = parametres.get('filtres') or {}
+    if not isinstance(filtres, dict):
+        raise ValueError("Le paramètre filtres doit être un objet")
+    decoupage = parametres.get('decoupage') or None
+    if decoupage is not None and decoupage not in DECOUPAGES:
+        raise ValueError(f"Découpage invalide (valeurs possibles : {', '.join(DECOUPAGES)})")
+    # Filtres normalisés : deux demandes équivalentes partagent le même artefact
+    return {
+        'filtres': lire_filtres_json(filtres), 'decoupage': decoupage,
+        'sous_totaux': _booleen(parametres, 'sous_totaux'),
+    }
+
+
+@tache('export_pta', parametres=parametres_export_pta)
+def executer_export_pta(job):
+    def progression(fait, total):
+        job.signaler_progression(90 * fait / max(total, 1), f"{fait}/{total} activités")
+
+    filtres = job.parametres.get('filtres') or {}
+    decoupage = job.parametres.get('decoupage')
+    if decoupage:
+        chemin, depuis_cache = artefact_paquet(decoupage, filtres)
+        nom = nom_fichier_paquet(decoupage, timestamp=horodatage_artefact(chemin))
+    else:
+        sous_totaux = job.parametres.get('sous_totaux', False)
+        chemin, depuis_cache = artefact_pta(filtres, progression=progression, sous_totaux=sous_totaux)
+        nom = nom_fichier_pta(filtres, timestamp=horodatage_artefact(chemin), sous_totaux=sous_totaux)
+    with open(chemin, 'rb') as fichier:
+        job.fichier_resultat.save(nom, File(fichier), save=False)
+    return {'depuis_cache': depuis_cache}
+
+
+def parametres_regeneration_exports(parametres):
+    return {'forcer': _booleen(parametres, 'forcer')}
+
+
+@tache('regenerer_exports', roles=('admin',), parametres=parametres_regeneration_exports)
+def executer_regeneration_exports(job):
+    return precalculer_exports(forcer=job.parametres.get('forcer', False))
+
+
+@tache('import_pcop', roles=('admin',))
+def executer_import_pcop(job):
+    if not job.fichier_entree:
+        raise ErreurImport("Aucun fichier fourni")
+    with job.fichier_entree.open('rb') as fichier:
+        return importer_pcop(fichier, job.fichier_entree.name)
+
+
+def parametres_import_cadre_logique(parametres):
+    if not isinstance(parametres.get('arbre', []), (list, dict)):
+        raise ValueError("Le paramètre arbre doit être une liste d'objectifs généraux")
+    return parametres
+
+
+@tache('import_cadre_logique', roles=('admin', 'superviseur'), parametres=parametres_import_cadre_logique)
+def executer_import_cadre_logique(job):
+    if job.fichier_entree:
+        with job.fichier_entree.open('rb') as fichier:
+            if job.fichier_entree.name.lower().endswith('.json'):
+                noeuds = aplatir_arbre(json.load(fichier))
+            else:
+                noeuds = lire_noeuds_fichier(fichier, job.fichier_entree.name)
+    else:
+        noeuds = aplatir_arbre(job.parametres.get('arbre', []))
+    return importer_cadre_logique(noeuds)
+
+
+@tache('verifier_retards', roles=('admin', 'superviseur'))
+def executer_verification_retards(job):
+    """Positionne la notification de retard sur les suivis des activités en retard."""
+    en_retard = (
+        Activite.objects.filter(date_fin__lt=timezone.now().date(), suivis__notification_retard=False)
+        .exclude(etat='Terminé')
+        .values_list('id', 'activite', 'date_fin')
+        .distinct()
+    )
+    total = en_retard.count()
+    suivis_notifies = 0
+    for fait, (activite_id, activite, date_fin) in enumerate(en_retard.iterator(), 1):
+        suivis_notifies += Suivi.objects.filter(activite_id=activite_id, notification_retard=False).update(
+            notification_retard=True,
+            message_notification=f"ATTENTION : L'activité '{activite[:50]}...' est en retard. Date de fin prévue : {date_fin}",
+        )
+        if fait % 100 == 0:
+            job.signaler_progression(100 * fait / total, f"{fait}/{total} activités")
+    return {'activites_en_retard': total, 'suivis_notifies': suivis_notifies}
+
+
+@tache('prevoir_achevements', roles=('admin', 'superviseur'))
+def executer_prevision_achevements(job):
+    """Recalcule la date d'achèvement prévue et le risque de retard de toutes les activités."""
+    def progression(fait, total):
+        job.signaler_progression(100 * fait / max(total, 1), f"{fait}/{total} activités")
+
+    return calculer_previsions(progression=progression)
+
+
+@tache('detecter_anomalies', roles=('admin', 'superviseur'))
+def executer_detection_anomalies(job):
+    """Recalcule les anomalies budgétaires (coûts atypiques par compte PCOP, montants incohérents)."""
+    def progression(fait, total):
+        job.signaler_progression(100 * fait / max(total, 1), f"{fait}/{total} anomalies enregistrées")
+
+    return analyser_budgets(progression=progression)
+
+
+def parametres_figement_pta(parametres):
+    nom, annee, description = parametres.get('nom'), parametres.get('annee'), parametres.get('description', '')
+    if not isinstance(nom, str) or not nom.strip() or len(nom) > 100:
+        raise ValueError("Le paramètre nom est requis (100 caractères au plus)")
+    if annee is not None and (not isinstance(annee, int) or isinstance(annee, bool) or not 1 <= annee <= 9999):
+        raise ValueError("Le paramètre annee doit être une année")
+    if not isinstance(description, str):
+        raise ValueError("Le paramètre description doit être un texte")
+    return {'nom': nom.strip(), 'annee': annee, 'description': description}
+
+
+@tache('figer_pta', roles=('admin', 'superviseur'), parametres=parametres_figement_pta)
+def executer_figement_pta(job):
+    """Fige le PTA courant dans un instantané non modifiable (plan validé, fin d'exercice...)."""
+    nom = job.parametres.get('nom')
+    if not nom:
+        raise ValueError("Le paramètre nom est requis")
+    instantane = figer_pta(
+        nom, annee=job.parametres.get('annee'), description=job.parametres.get('description', ''),
+        utilisateur=job.cree_par,
+    )
+    return {'instantane': instantane.pk, 'activites': instantane.nb_activites, 'taille': instantane.taille}
@@ -0,0 +1,81 @@
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api.benchmark import (
+    REPETITIONS, SCENARIOS, TOLERANCES, VOLUMES_BENCHMARK, base_ephemere, comparer, ecrire_resultats,
+    executer_benchmark, lire_resultats,
+)
+
+REFERENCE_DEFAUT = os.path.join(settings.BASE_DIR, 'benchmarks', 'reference.json')
+
+
+def _liste(valeur, conversion=str):
+    return [conversion(element) for element in valeur.split(',') if element.strip()]
+
+
+class Command(BaseCommand):
+    help = ("Mesure les principaux points d'accès (durée, requêtes SQL, mémoire, taille) sur une base "
+            "jetable et compare les résultats à la référence")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--volumes', default=','.join(map(str, VOLUMES_BENCHMARK)),
+                            help="Nombres d'activités générées, séparés par des virgules")
+        parser.add_argument('--scenarios', help=f"Scénarios à exécuter ({', '.join(s['nom'] for s in SCENARIOS)})")
+        parser.add_argument('--repetitions', type=int, default=REPETITIONS)
+        parser.add_argument('--graine', type=int, default=42)
+        parser.add_argument('--sortie', help="Fichier JSON où écrire les résultats")
+        parser.add_argument('--reference', default=REFERENCE_DEFAUT, help="Référence à laquelle comparer")
+        parser.add_argument('--enregistrer-reference', action='store_true',
+                            help="Remplace la référence par les résultats de cette exécution")
+        for cle, tolerance in TOLERANCES.items():
+            parser.add_argument(f"--tolerance-{cle.replace('_', '-')}", type=float, default=tolerance, dest=cle,
+                                help=f"Dépassement toléré (défaut : {tolerance:.0%})")
+
+    def handle(self, *args, **options):
+        try:
+            volumes = _liste(options['volumes'], int)
+        except ValueError:
+            raise CommandError("--volumes attend des entiers séparés par des virgules")
+        scenarios = _liste(options['scenarios']) if options['scenarios'] else None
+        inconnus = set(scenarios or []) - {s['nom'] for s in SCENARIOS}
+        if inconnus:
+            raise CommandError(f"Scénario(s) inconnu(s) : {', '.join(sorted(inconnus))}")
+
+        def progression(volume, nom, mesure):
+            self.stdout.write(
+                f"{volume:>8} {nom:<18} {mesure['statut']:>4} {mesure['duree_ms']:>10.1f} ms "
+                f"{mesure['requetes']:>5} req. {mesure['pic_memoire_octets'] / 1024:>10.0f} Kio "
+                f"{mesure['octets'] / 1024:>10.0f} Kio"
+            )
+
+        with base_ephemere():
+            resultats = executer_benchmark(
+                volumes=volumes, repetitions=options['repetitions'], graine=options['graine'],
+                scenarios=scenarios, progression=progression,
+            )
+
+        if options['sortie']:
+            ecrire_resultats(resultats, options['sortie'])
+        if options['enregistrer_reference']:
+            os.makedirs(os.path.dirname(options['reference']), exist_ok=True)
+            ecrire_resultats(resultats, options['reference'])
+            self.stdout.write(self.style.SUCCESS(f"Référence enregistrée : {options['reference']}"))
+            return
+        if not os.path.exists(options['reference']):
+            self.stdout.write(self.style.WARNING(f"Pas de référence ({options['reference']}) : aucune comparaison"))
+            return
+
+        reference = lire_resultats(options['reference'])
+        if reference['informations']['base'] != resultats['informations']['base']:
+            self.stdout.write(self.style.WARNING(
+                f"Référence mesurée sur {reference['informations']['base']}, "
+                f"exécution sur {resultats['informations']['base']} : durées peu comparables"
+            ))
+        regressions = comparer(resultats, reference, {cle: options[cle] for cle in TOLERANCES})
+        if regressions:
+            for regression in regressions:
+                self.stderr.write(regression)
+            raise CommandError(f"{len(regressions)} régression(s) par rapport à la référence")
+        self.stdout.write(self.style.SUCCESS("Aucune régression par rapport à la référence"))
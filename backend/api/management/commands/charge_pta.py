@@ -0,0 +1,80 @@
+import asyncio
+import json
+from urllib.error import URLError
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.charge import CENTILES, DELAI_REQUETE, PARCOURS, Cible, executer_charge, obtenir_jeton
+
+
+class Command(BaseCommand):
+    help = ("Rejoue les rafales de requêtes des pages Activités et Tableau de bord pour N utilisateurs "
+            "simulés contre un serveur en marche, et rapporte latences, débit et erreurs")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="URL de base du serveur")
+        parser.add_argument('--jeton', help="Jeton d'accès JWT (sinon obtenu avec --utilisateur)")
+        parser.add_argument('--utilisateur', help="Identifiant utilisé pour obtenir un jeton")
+        parser.add_argument('--mot-de-passe', help="Mot de passe de --utilisateur")
+        parser.add_argument('--utilisateurs', type=int, default=10, help="Utilisateurs simulés simultanés")
+        parser.add_argument('--iterations', type=int, default=5, help="Pages chargées par utilisateur")
+        parser.add_argument('--parcours', default=','.join(PARCOURS),
+                            help=f"Pages rejouées, tirées au hasard ({', '.join(PARCOURS)})")
+        parser.add_argument('--reflexion', type=float, default=1.0,
+                            help="Temps de réflexion moyen entre deux pages (secondes)")
+        parser.add_argument('--montee', type=float, default=0.0,
+                            help="Durée de démarrage progressif des utilisateurs (secondes)")
+        parser.add_argument('--delai', type=float, default=DELAI_REQUETE, help="Délai maximal par requête (secondes)")
+        parser.add_argument('--graine', type=int, default=42)
+        parser.add_argument('--sortie', help="Fichier JSON où écrire le rapport")
+
+    def handle(self, *args, **options):
+        parcours = [nom for nom in options['parcours'].split(',') if nom]
+        inconnus = set(parcours) - set(PARCOURS)
+        if inconnus or not parcours:
+            raise CommandError(f"Parcours inconnu(s) : {', '.join(sorted(inconnus))}")
+        if options['utilisateurs'] < 1 or options['iterations'] < 1:
+            raise CommandError("--utilisateurs et --iterations doivent être positifs")
+
+        jeton = options['jeton']
+        if not jeton:
+            if not options['utilisateur'] or not options['mot_de_passe']:
+                raise CommandError("Indiquez --jeton, ou --utilisateur et --mot-de-passe")
+            try:
+                jeton = obtenir_jeton(options['url'], options['utilisateur'], options['mot_de_passe'])
+            except (URLError, KeyError, ValueError) as e:
+                raise CommandError(f"Impossible d'obtenir un jeton : {e}")
+        try:
+            cible = Cible(options['url'], jeton, options['delai'])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        rapport = asyncio.run(executer_charge(
+            cible, options['utilisateurs'], options['iterations'], parcours=parcours,
+            reflexion=options['reflexion'], montee=options['montee'], graine=options['graine'],
+        ))
+        self.afficher(rapport)
+        if options['sortie']:
+            with open(options['sortie'], 'w', encoding='utf-8') as f:
+                json.dump(rapport, f, indent=2, ensure_ascii=False)
+
+    def afficher(self, rapport):
+        colonnes = ''.join(f"{f'p{rang}':>9}" for rang in CENTILES)
+        self.stdout.write(f"{'':<32}{'requêtes':>9}{'erreurs':>9}{colonnes}{'max':>9}   (ms)")
+
+        def ligne(libelle, resume):
+            valeurs = ''.join(f"{resume[f'p{rang}_ms']:>9}" for rang in CENTILES)
+            self.stdout.write(f"{libelle:<32}{resume['nombre']:>9}{resume['erreurs']:>9}{valeurs}{resume['max_ms']:>9}")
+
+        for chemin, resume in rapport['points_acces'].items():
+            ligne(chemin, resume)
+        for nom, resume in rapport['pages'].items():
+            ligne(f"page {nom}", resume)
+        ligne("TOTAL", rapport['global'])
+        self.stdout.write(
+            f"{rapport['duree_secondes']} s, {rapport['debit_requetes_s']} requêtes/s, "
+            f"{rapport['debit_pages_s']} pages/s, {rapport['octets_recus'] / 1024 / 1024:.1f} Mio reçus, "
+            f"statuts {rapport['statuts']}"
+        )
+        style = self.style.ERROR if rapport['global']['erreurs'] else self.style.SUCCESS
+        self.stdout.write(style(f"Taux d'erreur : {rapport['global']['taux_erreur']:.2%}"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.anomalies import analyser_budgets
+
+
+class Command(BaseCommand):
+    help = ("Recherche les coûts unitaires atypiques par compte PCOP et les montants différents du "
+            "coût unitaire × quantité, et remplace les anomalies enregistrées (à planifier la nuit)")
+
+    def handle(self, *args, **options):
+        try:
+            bilan = analyser_budgets()
+        except ImportError:
+            raise CommandError("La détection des anomalies nécessite le paquet numpy")
+        self.stdout.write(self.style.SUCCESS(
+            f"{bilan['activites']} activité(s) analysées en {bilan['duree_secondes']} s "
+            f"(lecture {bilan['duree_chargement_secondes']} s, calcul {bilan['duree_calcul_secondes']} s) : "
+            f"{bilan['couts_atypiques']} coût(s) atypique(s), {bilan['montants_incoherents']} montant(s) incohérent(s)"
+        ))
@@ -0,0 +1,37 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import ErreurImport, aplatir_arbre, importer_cadre_logique, lire_noeuds_fichier
+
+
+class Command(BaseCommand):
+    help = "Importe l'arbre des objectifs (OG / OS / RA) depuis un fichier JSON, CSV ou XLSX (fusion par numéro)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier', help="Chemin du fichier JSON imbriqué, CSV ou XLSX")
+
+    def handle(self, *args, **options):
+        chemin = options['fichier']
+        try:
+            if chemin.lower().endswith('.json'):
+                with open(chemin, encoding='utf-8') as fichier:
+                    noeuds = aplatir_arbre(json.load(fichier))
+            else:
+                with open(chemin, 'rb') as fichier:
+                    noeuds = lire_noeuds_fichier(fichier, chemin)
+            bilan = importer_cadre_logique(noeuds)
+        except (OSError, json.JSONDecodeError) as e:
+            raise CommandError(f"Impossible de lire {chemin}: {e}")
+        except ErreurImport as e:
+            raise CommandError(str(e))
+
+        for erreur in bilan['erreurs']:
+            self.stderr.write(erreur)
+        for niveau in ('objectifs_generaux', 'objectifs_specifiques', 'resultats_attendus'):
+            compteurs = bilan[niveau]
+            self.stdout.write(
+                f"{niveau}: {compteurs['inseres']} insérés, {compteurs['mis_a_jour']} mis à jour, "
+                f"{compteurs['inchanges']} inchangés"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Import terminé en {bilan['duree_secondes']}s ({bilan['rejetes']} rejetés)"))
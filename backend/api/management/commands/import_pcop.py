@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.imports import TAILLE_LOT, ErreurImport, importer_pcop
+
+
+class Command(BaseCommand):
+    help = "Importe la nomenclature PCOP depuis un fichier CSV ou XLSX (fusion par code)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('fichier', help="Chemin du fichier CSV ou XLSX")
+        parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT,
+                            help="Nombre de lignes par lot de chargement (hors PostgreSQL)")
+
+    def handle(self, *args, **options):
+        chemin = options['fichier']
+        try:
+            with open(chemin, 'rb') as fichier:
+                bilan = importer_pcop(fichier, chemin, taille_lot=options['taille_lot'])
+        except OSError as e:
+            raise CommandError(f"Impossible de lire {chemin}: {e}")
+        except ErreurImport as e:
+            raise CommandError(str(e))
+
+        for erreur in bilan['erreurs']:
+            self.stderr.write(erreur)
+        self.stdout.write(self.style.SUCCESS(
+            f"{bilan['inserees']} insérées, {bilan['mises_a_jour']} mises à jour, "
+            f"{bilan['inchangees']} inchangées, {bilan['rejetees']} rejetées "
+            f"({bilan['lignes_lues']} lignes lues en {bilan['duree_secondes']}s)"
+        ))
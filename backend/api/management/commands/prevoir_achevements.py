@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.previsions import calculer_previsions
+
+
+class Command(BaseCommand):
+    help = ("Recalcule la date d'achèvement prévue et le risque de retard de chaque activité "
+            "à partir de ses suivis (à planifier la nuit)")
+
+    def handle(self, *args, **options):
+        try:
+            bilan = calculer_previsions()
+        except ImportError:
+            raise CommandError("Le calcul des prévisions nécessite le paquet numpy")
+        self.stdout.write(self.style.SUCCESS(
+            f"{bilan['activites']} activité(s) et {bilan['suivis']} suivi(s) traités en {bilan['duree_secondes']} s "
+            f"(calcul {bilan['duree_calcul_secondes']} s) : {bilan['a_risque']} à risque, "
+            f"{bilan['sans_prevision']} sans prévision"
+        ))
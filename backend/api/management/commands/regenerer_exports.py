@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from api.exports import precalculer_exports
+
+
+class Command(BaseCommand):
+    help = "Précalcule les exports du PTA pour la version courante des données et purge les versions périmées (à planifier la nuit)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--forcer', action='store_true',
+                            help="Reconstruire même si l'export de la version courante existe déjà")
+
+    def handle(self, *args, **options):
+        bilan = precalculer_exports(forcer=options['forcer'])
+        etat = "régénéré" if bilan['regenere'] else "déjà à jour"
+        self.stdout.write(self.style.SUCCESS(
+            f"{bilan['pta_complet']} {etat}, {bilan['purges']} export(s) périmé(s) supprimé(s)"
+        ))
@@ -0,0 +1,62 @@
+import multiprocessing
+import signal
+
+import django
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+
+def _processus_worker(arret, intervalle, une_fois):
+    # Le processus parent gère SIGINT et positionne l'évènement d'arrêt
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    django.setup()
+    from api.jobs import boucle_worker
+
+    try:
+        boucle_worker(arret, intervalle=intervalle, une_fois=une_fois)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = "Exécute les tâches d'arrière-plan (exports, imports, contrôles de retard) dans un pool de processus"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processus', type=int, default=1,
+                            help="Nombre de processus workers (un job à la fois par processus)")
+        parser.add_argument('--intervalle', type=float, default=2.0,
+                            help="Délai en secondes entre deux scrutations d'une file vide")
+        parser.add_argument('--une-fois', action='store_true',
+                            help="S'arrêter dès que la file est vide (cron, tests)")
+
+    def handle(self, *args, **options):
+        contexte = multiprocessing.get_context()
+        arret = contexte.Event()
+
+        def arreter(signum, frame):
+            self.stdout.write("Arrêt demandé, fin des jobs en cours...")
+            arret.set()
+
+        signal.signal(signal.SIGINT, arreter)
+        signal.signal(signal.SIGTERM, arreter)
+
+        if options['processus'] <= 1:
+            from api.jobs import boucle_worker
+            boucle_worker(arret, intervalle=options['intervalle'], une_fois=options['une_fois'])
+            return
+
+        # Chaque processus ouvre sa propre connexion : ne pas partager celle du parent
+        connections.close_all()
+        processus = [
+            contexte.Process(
+                target=_processus_worker,
+                args=(arret, options['intervalle'], options['une_fois']),
+                name=f"runworker-{numero}",
+            )
+            for numero in range(options['processus'])
+        ]
+        for p in processus:
+            p.start()
+        self.stdout.write(self.style.SUCCESS(f"{len(processus)} workers démarrés"))
+        for p in processus:
+            p.join()
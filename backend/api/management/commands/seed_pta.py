@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.generation import TAILLE_LOT, VOLUMES_DEFAUT, generer_pta, vider_pta
+
+
+class Command(BaseCommand):
+    help = "Génère un PTA synthétique déterministe (organisation, objectifs, PCOP, activités, suivis)"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--graine', type=int, default=42, help="Graine du générateur aléatoire")
+        parser.add_argument('--annee', type=int, help="Exercice des activités générées (défaut : année courante)")
+        parser.add_argument('--taille-lot', type=int, default=TAILLE_LOT, help="Activités insérées par lot")
+        parser.add_argument('--vider', action='store_true', help="Vide les tables du PTA avant la génération")
+        for nom, defaut in VOLUMES_DEFAUT.items():
+            parser.add_argument(f"--{nom.replace('_', '-')}", type=int, dest=nom, help=f"(défaut : {defaut})")
+
+    def handle(self, *args, **options):
+        if options['vider']:
+            vider_pta()
+            self.stdout.write("Tables du PTA vidées")
+
+        def progression(fait, total):
+            self.stdout.write(f"{fait}/{total} activités")
+
+        volumes = {nom: options[nom] for nom in VOLUMES_DEFAUT}
+        try:
+            bilan = generer_pta(
+                graine=options['graine'], annee=options['annee'], taille_lot=options['taille_lot'],
+                progression=progression, **volumes,
+            )
+        except ValueError as e:
+            raise CommandError(f"{e} (option --vider)")
+
+        self.stdout.write(self.style.SUCCESS(
+            f"{bilan['activites']} activités, {bilan['suivis']} suivis, {bilan['divisions']} divisions, "
+            f"{bilan['resultats_attendus']} résultats attendus, {bilan['pcop']} comptes PCOP "
+            f"générés en {bilan['duree_secondes']}s"
+        ))
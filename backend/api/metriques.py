@@ -0,0 +1,148 @@
+"""
+Métriques au format Prometheus, exposées sur /metrics.
+
+Requêtes par vue (débit, latence, taille des réponses, nombre de requêtes
+SQL), succès du cache des exports, durée de construction des exports et
+exécution des tâches d'arrière-plan. Le paquet prometheus_client est
+optionnel : sans lui, les observations sont ignorées et /metrics répond 501.
+
+Avec plusieurs workers gunicorn, définir PROMETHEUS_MULTIPROC_DIR (répertoire
+vide au démarrage) : chaque processus écrit ses valeurs dans des fichiers mmap
+de ce répertoire, agrégés à la lecture. Le hook gunicorn `child_exit` doit
+appeler `prometheus_client.multiprocess.mark_process_dead(worker.pid)`.
+"""
+import logging
+import os
+import threading
+
+from django.conf import settings
+from django.db.models import Count
+from django.http import HttpResponse
+
+logger = logging.getLogger(__name__)
+
+_verrou = threading.Lock()
+_metriques = None
+_indisponible = False
+
+BUCKETS_TAILLE = (512, 2048, 8192, 32768, 131072, 524288, 2097152, 8388608, 33554432, 134217728)
+BUCKETS_REQUETES_SQL = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+BUCKETS_EXPORT = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+
+def metriques():
+    """Instruments Prometheus, créés au premier usage ; None si prometheus_client est absent."""
+    global _metriques, _indisponible
+    if _metriques is not None or _indisponible:
+        return _metriques
+    with _verrou:
+        if _metriques is None and not _indisponible:
+            try:
+                from prometheus_client import Counter, Histogram
+            except ImportError:
+                _indisponible = True
+                logger.info("prometheus_client non installé : métriques désactivées")
+                return None
+            _metriques = {
+                'requetes': Counter(
+                    'pta_http_requetes', "Requêtes HTTP traitées", ['vue', 'methode', 'statut'],
+                ),
+                'duree': Histogram(
+                    'pta_http_duree_secondes', "Durée de traitement des requêtes HTTP", ['vue', 'methode'],
+                ),
+                'taille': Histogram(
+                    'pta_http_taille_reponse_octets', "Taille des réponses HTTP", ['vue'], buckets=BUCKETS_TAILLE,
+                ),
+                'requetes_sql': Histogram(
+                    'pta_http_requetes_sql', "Nombre de requêtes SQL par requête HTTP", ['vue'],
+                    buckets=BUCKETS_REQUETES_SQL,
+                ),
+                'cache_exports': Counter(
+                    'pta_cache_exports', "Accès aux exports précalculés", ['type', 'resultat'],
+                ),
+                'duree_exports': Histogram(
+                    'pta_export_duree_secondes', "Durée de construction des exports", ['type'],
+                    buckets=BUCKETS_EXPORT,
+                ),
+                'jobs': Counter(
+                    'pta_jobs', "Tâches d'arrière-plan exécutées", ['type', 'statut'],
+                ),
+                'duree_jobs': Histogram(
+                    'pta_job_duree_secondes', "Durée des tâches d'arrière-plan", ['type'],
+                    buckets=BUCKETS_EXPORT,
+                ),
+            }
+    return _metriques
+
+
+def observer_requete(vue, methode, statut, duree, requetes_sql, taille=None):
+    m = metriques()
+    if m is None:
+        return
+    vue = vue or 'inconnue'
+    m['requetes'].labels(vue, methode, str(statut)).inc()
+    m['duree'].labels(vue, methode).observe(duree)
+    m['requetes_sql'].labels(vue).observe(requetes_sql)
+    if taille is not None:
+        m['taille'].labels(vue).observe(taille)
+
+
+def observer_cache_export(type_export, depuis_cache, duree=None):
+    m = metriques()
+    if m is None:
+        return
+    m['cache_exports'].labels(type_export, 'succes' if depuis_cache else 'echec').inc()
+    if duree is not None:
+        m['duree_exports'].labels(type_export).observe(duree)
+
+
+def observer_job(type_job, statut, duree):
+    m = metriques()
+    if m is None:
+        return
+    m['jobs'].labels(type_job, statut).inc()
+    m['duree_jobs'].labels(type_job).observe(duree)
+
+
+class CollecteurFileJobs:
+    """Nombre de jobs par statut, lu en base au moment de la collecte (commun à tous les processus)."""
+
+    def collect(self):
+        from prometheus_client.core import GaugeMetricFamily
+
+        from .models import STATUTS_JOB, Job
+
+        famille = GaugeMetricFamily('pta_jobs_file', "Jobs présents dans la file, par statut", labels=['statut'])
+        comptes = dict(Job.objects.values_list('statut').annotate(nb=Count('id')).order_by())
+        for statut, _ in STATUTS_JOB:
+            famille.add_metric([statut], comptes.get(statut, 0))
+        yield famille
+
+
+def _adresse_autorisee(request):
+    autorisees = getattr(settings, 'METRIQUES_IPS_AUTORISEES', None)
+    return autorisees is None or request.META.get('REMOTE_ADDR') in autorisees
+
+
+def vue_metriques(request):
+    """Vue Django simple (sans authentification JWT) destinée au collecteur Prometheus."""
+    if not _adresse_autorisee(request):
+        return HttpResponse("Accès refusé", status=403, content_type='text/plain; charset=utf-8')
+    if metriques() is None:
+        return HttpResponse(
+            "Les métriques nécessitent le paquet prometheus_client", status=501,
+            content_type='text/plain; charset=utf-8',
+        )
+
+    from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest
+
+    if os.environ.get('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+
+        registre = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registre)
+    else:
+        registre = REGISTRY
+    registre_file = CollectorRegistry()
+    registre_file.register(CollecteurFileJobs())
+    return HttpResponse(generate_latest(registre) + generate_latest(registre_file), content_type=CONTENT_TYPE_LATEST)
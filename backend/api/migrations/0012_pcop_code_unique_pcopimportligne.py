@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:04
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def fusionner_codes_pcop_doublons(apps, schema_editor):
+    """Rattache les activités au premier PCOP de chaque code en doublon puis supprime les autres."""
+    PCOPEntry = apps.get_model('api', 'PCOPEntry')
+    Activite = apps.get_model('api', 'Activite')
+
+    doublons = (
+        PCOPEntry.objects.exclude(code='')
+        .values('code')
+        .annotate(nb=Count('id'), premier=Min('id'))
+        .filter(nb__gt=1)
+    )
+    for doublon in doublons:
+        autres = PCOPEntry.objects.filter(code=doublon['code']).exclude(id=doublon['premier'])
+        Activite.objects.filter(pcop__in=autres).update(pcop_id=doublon['premier'])
+        autres.delete()
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Clés étrangères DEFERRABLE INITIALLY DEFERRED : vérifiées maintenant, sinon l'ALTER TABLE
+        # de la contrainte qui suit échoue (« pending trigger events ») dans la même transaction
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_activite_date_debut_activite_date_fin_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PCOPImportLigne',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot', models.UUIDField(db_index=True)),
+                ('code', models.CharField(max_length=50)),
+                ('libelle', models.CharField(blank=True, max_length=255)),
+                ('cout_unitaire', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+            options={
+                'verbose_name': "Ligne d'import PCOP",
+                'verbose_name_plural': "Lignes d'import PCOP",
+            },
+        ),
+        migrations.RunPython(fusionner_codes_pcop_doublons, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pcopentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('code', ''), _negated=True), fields=('code',), name='pcop_code_unique'),
+        ),
+    ]
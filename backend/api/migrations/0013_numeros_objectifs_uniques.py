@@ -0,0 +1,65 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:06
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def fusionner_numeros_doublons(apps, schema_editor):
+    """
+    Fusionne sur le plus ancien les objectifs spécifiques et résultats attendus
+    de même numéro et de même parent. Des doublons rattachés à des parents
+    différents ne sont pas fusionnables sans perdre la cohérence des activités :
+    la migration s'arrête et les liste, à corriger à la main.
+    """
+    ObjectifSpecifique = apps.get_model('api', 'ObjectifSpecifique')
+    ResultatAttendu = apps.get_model('api', 'ResultatAttendu')
+    Activite = apps.get_model('api', 'Activite')
+
+    rattachements = (
+        (ObjectifSpecifique, 'objectif_general',
+         [(ResultatAttendu, 'objectif_specifique'), (Activite, 'objectif_specifique')]),
+        (ResultatAttendu, 'objectif_specifique', [(Activite, 'resultat_attendu')]),
+    )
+    for modele, parent, dependants in rattachements:
+        # Les résultats attendus sont vérifiés après la fusion des objectifs spécifiques, qui a pu réunir leurs parents
+        conflits = sorted(
+            modele.objects.values('numero').annotate(parents=Count(parent, distinct=True))
+            .filter(parents__gt=1).values_list('numero', flat=True)
+        )
+        if conflits:
+            raise RuntimeError(
+                f"{modele._meta.verbose_name_plural} : numéros en double sous des parents différents, "
+                f"à renuméroter avant de migrer : {', '.join(conflits)}"
+            )
+        doublons = modele.objects.values('numero').annotate(nb=Count('id'), premier=Min('id')).filter(nb__gt=1)
+        for doublon in doublons:
+            autres = modele.objects.filter(numero=doublon['numero']).exclude(id=doublon['premier'])
+            for dependant, champ in dependants:
+                dependant.objects.filter(**{f'{champ}__in': autres}).update(**{f'{champ}_id': doublon['premier']})
+            autres.delete()
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Clés étrangères DEFERRABLE INITIALLY DEFERRED : vérifiées maintenant, sinon les AlterField
+        # qui suivent échouent (« pending trigger events ») dans la même transaction
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_pcop_code_unique_pcopimportligne'),
+    ]
+
+    operations = [
+        migrations.RunPython(fusionner_numeros_doublons, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='objectifspecifique',
+            name='numero',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='resultatattendu',
+            name='numero',
+            field=models.CharField(max_length=10, unique=True),
+        ),
+    ]
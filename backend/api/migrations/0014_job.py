@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:09
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_numeros_objectifs_uniques'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Job',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(max_length=50)),
+                ('statut', models.CharField(choices=[('en_attente', 'En attente'), ('en_cours', 'En cours'), ('termine', 'Terminé'), ('echec', 'Échec')], default='en_attente', max_length=20)),
+                ('parametres', models.JSONField(blank=True, default=dict)),
+                ('fichier_entree', models.FileField(blank=True, upload_to='jobs/entrees/')),
+                ('fichier_resultat', models.FileField(blank=True, upload_to='jobs/resultats/')),
+                ('resultat', models.JSONField(blank=True, null=True)),
+                ('progression', models.PositiveSmallIntegerField(default=0)),
+                ('message', models.CharField(blank=True, max_length=255)),
+                ('erreur', models.TextField(blank=True)),
+                ('worker', models.CharField(blank=True, max_length=100)),
+                ('cree_le', models.DateTimeField(auto_now_add=True)),
+                ('demarre_le', models.DateTimeField(blank=True, null=True)),
+                ('termine_le', models.DateTimeField(blank=True, null=True)),
+                ('cree_par', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='jobs', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': "Tâche d'arrière-plan",
+                'verbose_name_plural': "Tâches d'arrière-plan",
+                'ordering': ['-cree_le'],
+                'indexes': [models.Index(fields=['statut', 'cree_le'], name='job_statut_cree_le_idx')],
+            },
+        ),
+    ]
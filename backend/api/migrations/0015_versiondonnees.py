@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_job'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='VersionDonnees',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('cle', models.CharField(max_length=50, unique=True)),
+                ('version', models.BigIntegerField(default=0)),
+            ],
+            options={
+                'verbose_name': 'Version des données',
+                'verbose_name_plural': 'Versions des données',
+            },
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0015_versiondonnees'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activite',
+            index=models.Index(fields=['etat'], name='activite_etat_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='activite',
+            index=models.Index(condition=models.Q(('etat', 'Terminé'), _negated=True), fields=['date_fin'], name='activite_retard_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='suivi',
+            index=models.Index(fields=['activite', 'date_suivi'], name='suivi_activite_date_idx'),
+        ),
+        migrations.AlterField(
+            model_name='suivi',
+            name='activite',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='suivis', to='api.activite'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0016_index_activite_suivi'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='suivi',
+            index=models.Index(fields=['date_suivi', 'id'], name='suivi_date_idx'),
+        ),
+    ]
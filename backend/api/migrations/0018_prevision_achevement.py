@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-19 11:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0017_index_suivi_date'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activite',
+            name='date_achevement_prevue',
+            field=models.DateField(blank=True, null=True, verbose_name="Date d'achèvement prévue"),
+        ),
+        migrations.AddField(
+            model_name='activite',
+            name='prevision_calculee_le',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='activite',
+            name='risque_retard',
+            field=models.FloatField(blank=True, null=True, verbose_name='Risque de retard'),
+        ),
+        migrations.AddIndex(
+            model_name='activite',
+            index=models.Index(fields=['risque_retard', 'id'], name='activite_risque_idx'),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:00
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0018_prevision_achevement'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AnomalieBudget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('cout_atypique', 'Coût unitaire atypique pour le compte PCOP'), ('montant_incoherent', 'Montant différent du coût unitaire × quantité')], max_length=30)),
+                ('valeur', models.FloatField()),
+                ('reference', models.FloatField()),
+                ('score', models.FloatField()),
+                ('mad', models.FloatField(blank=True, null=True)),
+                ('p10', models.FloatField(blank=True, null=True)),
+                ('p90', models.FloatField(blank=True, null=True)),
+                ('detectee_le', models.DateTimeField()),
+                ('activite', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='api.activite')),
+                ('pcop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='anomalies', to='api.pcopentry')),
+            ],
+            options={
+                'verbose_name': 'Anomalie budgétaire',
+                'verbose_name_plural': 'Anomalies budgétaires',
+                'indexes': [models.Index(fields=['score', 'id'], name='anomalie_score_idx'), models.Index(fields=['type', 'score', 'id'], name='anomalie_type_score_idx')],
+            },
+        ),
+    ]
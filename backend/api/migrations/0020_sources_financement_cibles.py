@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0019_anomalie_budget'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Cible',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=255)),
+                ('cle', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Cible',
+                'verbose_name_plural': 'Cibles',
+                'ordering': ['nom'],
+            },
+        ),
+        migrations.CreateModel(
+            name='SourceFinancement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=255)),
+                ('cle', models.CharField(max_length=255, unique=True)),
+            ],
+            options={
+                'verbose_name': 'Source de financement',
+                'verbose_name_plural': 'Sources de financement',
+                'ordering': ['nom'],
+            },
+        ),
+        migrations.AddField(
+            model_name='activite',
+            name='groupes_cibles',
+            field=models.ManyToManyField(blank=True, related_name='activites', to='api.cible'),
+        ),
+        migrations.AddField(
+            model_name='activite',
+            name='sources',
+            field=models.ManyToManyField(blank=True, related_name='activites', to='api.sourcefinancement'),
+        ),
+    ]
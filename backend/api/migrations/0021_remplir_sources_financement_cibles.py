@@ -0,0 +1,96 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:40
+
+import re
+import unicodedata
+
+from django.db import migrations, transaction
+
+TAILLE_LOT = 2000
+SEPARATEURS = re.compile(r'[,;/+\n]')
+LONGUEUR_NOM = 255
+
+# Copie figée de api/dimensions.py au moment de la migration : les évolutions du
+# découpage ou de la clé canonique ne doivent pas changer ce que fait cette migration
+# champ texte d'Activite -> (champ ManyToMany, modèle, colonne de la table de liens)
+DIMENSIONS = (
+    ('sources_financement', 'sources', 'SourceFinancement', 'sourcefinancement_id'),
+    ('cibles', 'groupes_cibles', 'Cible', 'cible_id'),
+)
+
+
+def cle_dimension(nom):
+    sans_accents = ''.join(
+        c for c in unicodedata.normalize('NFKD', nom) if not unicodedata.combining(c)
+    ).lower()
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', sans_accents.replace('.', '')).split())
+
+
+def decouper(texte):
+    elements = {}
+    for morceau in SEPARATEURS.split(texte or ''):
+        nom = ' '.join(morceau.split())[:LONGUEUR_NOM]
+        cle = cle_dimension(nom)
+        if cle and cle not in elements:
+            elements[cle] = nom
+    return elements
+
+
+def rattacher_lot(apps, lignes):
+    """Crée les entrées manquantes et les liens des activités du lot (tables de liens vides avant 0021)."""
+    Activite = apps.get_model('api', 'Activite')
+    for position, (_, champ_lien, nom_modele, colonne) in enumerate(DIMENSIONS, 1):
+        modele = apps.get_model('api', nom_modele)
+        elements = {ligne[0]: decouper(ligne[position]) for ligne in lignes}
+        noms = {}
+        for decoupage in elements.values():
+            for cle, nom in decoupage.items():
+                noms.setdefault(cle, nom)
+
+        existantes = dict(modele.objects.filter(cle__in=noms).values_list('cle', 'id'))
+        nouvelles = [modele(cle=cle, nom=nom) for cle, nom in noms.items() if cle not in existantes]
+        if nouvelles:
+            modele.objects.bulk_create(nouvelles, ignore_conflicts=True)
+            existantes.update(modele.objects.filter(cle__in=[o.cle for o in nouvelles]).values_list('cle', 'id'))
+
+        lien = getattr(Activite, champ_lien).through
+        lien.objects.bulk_create(
+            [lien(activite_id=pk, **{colonne: existantes[cle]}) for pk, decoupage in elements.items() for cle in decoupage],
+            ignore_conflicts=True,
+        )
+
+
+def remplir_dimensions(apps, schema_editor):
+    """Rattache les activités existantes aux sources et cibles normalisées, par lots d'identifiants croissants."""
+    Activite = apps.get_model('api', 'Activite')
+    dernier = 0
+    while True:
+        lignes = list(
+            Activite.objects.filter(id__gt=dernier).order_by('id')
+            .values_list('id', 'sources_financement', 'cibles')[:TAILLE_LOT]
+        )
+        if not lignes:
+            break
+        # Un lot par transaction : la migration ne tient pas de verrous sur toute la table
+        with transaction.atomic(using=schema_editor.connection.alias):
+            rattacher_lot(apps, lignes)
+        dernier = lignes[-1][0]
+
+
+def vider_dimensions(apps, schema_editor):
+    Activite = apps.get_model('api', 'Activite')
+    Activite.sources.through.objects.all().delete()
+    Activite.groupes_cibles.through.objects.all().delete()
+    apps.get_model('api', 'SourceFinancement').objects.all().delete()
+    apps.get_model('api', 'Cible').objects.all().delete()
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('api', '0020_sources_financement_cibles'),
+    ]
+
+    operations = [
+        migrations.RunPython(remplir_dimensions, vider_dimensions),
+    ]
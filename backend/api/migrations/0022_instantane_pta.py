@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:11
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0021_remplir_sources_financement_cibles'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InstantanePTA',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nom', models.CharField(max_length=100)),
+                ('annee', models.PositiveSmallIntegerField(db_index=True)),
+                ('description', models.TextField(blank=True)),
+                ('cree_le', models.DateTimeField(auto_now_add=True)),
+                ('version_donnees', models.BigIntegerField()),
+                ('nb_activites', models.PositiveIntegerField()),
+                ('montant_total', models.DecimalField(decimal_places=2, max_digits=18)),
+                ('statistiques', models.JSONField()),
+                ('donnees', models.BinaryField()),
+                ('taille', models.PositiveIntegerField()),
+                ('empreinte', models.CharField(max_length=64)),
+                ('cree_par', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='instantanes_pta', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Instantané du PTA',
+                'verbose_name_plural': 'Instantanés du PTA',
+                'ordering': ['-cree_le', '-id'],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-19 12:29
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0022_instantane_pta'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='job',
+            name='battement_le',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
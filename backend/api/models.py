@@ -1,6 +1,6 @@
 from django.db import models
 from django.utils import timezone
-from django.db.models.signals import pre_save
+from django.db.models.signals import pre_save, post_save, post_delete
 from django.dispatch import receiver
 
 ROLE_CHOICES = ( 
@@ -77,10 +77,56 @@ class PCOPEntry(models.Model):
     code = models.CharField(max_length=50, blank=True) 
     libelle = models.CharField(max_length=255, blank=True) 
     cout_unitaire = models.DecimalField(max_digits=14, decimal_places=2, default=0) 
+
+    class Meta:
+        # ✅ Le code sert de clé de fusion pour l'import de la nomenclature
+        constraints = [
+            models.UniqueConstraint(fields=['code'], condition=~models.Q(code=''), name='pcop_code_unique'),
+        ]
      
     def __str__(self): 
         return f"{self.code} - {self.libelle}"
 
+# ✅ TABLE DE TRANSIT POUR L'IMPORT EN MASSE DE LA NOMENCLATURE PCOP
+class PCOPImportLigne(models.Model):
+    lot = models.UUIDField(db_index=True)
+    code = models.CharField(max_length=50)
+    libelle = models.CharField(max_length=255, blank=True)
+    cout_unitaire = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        verbose_name = "Ligne d'import PCOP"
+        verbose_name_plural = "Lignes d'import PCOP"
+
+    def __str__(self):
+        return f"{self.lot} - {self.code}"
+
+# ✅ SOURCES DE FINANCEMENT ET CIBLES NORMALISÉES (voir api/dimensions.py)
+class SourceFinancement(models.Model):
+    nom = models.CharField(max_length=255)
+    # Nom sans accents, en minuscules, ponctuation normalisée : clé de rapprochement des saisies libres
+    cle = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        verbose_name = "Source de financement"
+        verbose_name_plural = "Sources de financement"
+        ordering = ['nom']
+
+    def __str__(self):
+        return self.nom
+
+class Cible(models.Model):
+    nom = models.CharField(max_length=255)
+    cle = models.CharField(max_length=255, unique=True)
+
+    class Meta:
+        verbose_name = "Cible"
+        verbose_name_plural = "Cibles"
+        ordering = ['nom']
+
+    def __str__(self):
+        return self.nom
+
 # STRUCTURE HIÉRARCHIQUE DES OBJECTIFS
 class ObjectifGeneral(models.Model):
     numero = models.CharField(max_length=10, unique=True)
@@ -96,7 +142,7 @@ class ObjectifGeneral(models.Model):
 
 class ObjectifSpecifique(models.Model):
     objectif_general = models.ForeignKey(ObjectifGeneral, on_delete=models.CASCADE, related_name='objectifs_specifiques')
-    numero = models.CharField(max_length=10)  # OS1.1, OS1.2, etc.
+    numero = models.CharField(max_length=10, unique=True)  # OS1.1, OS1.2, etc.
     titre = models.CharField(max_length=255)
     description = models.TextField(blank=True)
     
@@ -109,7 +155,7 @@ class ObjectifSpecifique(models.Model):
 
 class ResultatAttendu(models.Model):
     objectif_specifique = models.ForeignKey(ObjectifSpecifique, on_delete=models.CASCADE, related_name='resultats_attendus')
-    numero = models.CharField(max_length=10)  # RA1.1.1, RA1.1.2, etc.
+    numero = models.CharField(max_length=10, unique=True)  # RA1.1.1, RA1.1.2, etc.
     description = models.TextField()
     
     class Meta:
@@ -140,6 +186,9 @@ class Activite(models.Model):
     produits = models.TextField(blank=True) 
     cibles = models.CharField(max_length=255, blank=True) 
     sources_financement = models.CharField(max_length=255, blank=True) 
+    # ✅ Mêmes informations normalisées, tenues à jour depuis les champs texte ci-dessus
+    sources = models.ManyToManyField(SourceFinancement, blank=True, related_name='activites')
+    groupes_cibles = models.ManyToManyField(Cible, blank=True, related_name='activites')
     
     # RELATION AVEC PCOP
     pcop = models.ForeignKey(PCOPEntry, on_delete=models.SET_NULL, null=True, blank=True, related_name='activites')
@@ -149,6 +198,21 @@ class Activite(models.Model):
     montant = models.DecimalField(max_digits=16, decimal_places=2, null=True, blank=True) 
     observation = models.TextField(blank=True) 
     etat = models.CharField(max_length=50, default='En cours', blank=True) 
+
+    # ✅ PRÉVISION CALCULÉE CHAQUE NUIT À PARTIR DES SUIVIS (api/previsions.py)
+    date_achevement_prevue = models.DateField(null=True, blank=True, verbose_name="Date d'achèvement prévue")
+    risque_retard = models.FloatField(null=True, blank=True, verbose_name="Risque de retard")
+    prevision_calculee_le = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            # ✅ Filtre ?etat= et décompte par état du tableau de bord
+            models.Index(fields=['etat'], name='activite_etat_idx'),
+            # ✅ Candidates au retard (date_fin dépassée et pas encore terminées) : index partiel
+            models.Index(fields=['date_fin'], condition=~models.Q(etat='Terminé'), name='activite_retard_idx'),
+            # ✅ Listes « probablement en retard », triées par risque décroissant
+            models.Index(fields=['risque_retard', 'id'], name='activite_risque_idx'),
+        ]
     
     def __str__(self): 
         return f"{self.activite[:60]}"
@@ -210,7 +274,8 @@ class Activite(models.Model):
         return self.pcop.libelle if self.pcop else ""
 
 class Suivi(models.Model): 
-    activite = models.ForeignKey(Activite, on_delete=models.CASCADE, related_name='suivis') 
+    # Pas d'index simple : l'index (activite, date_suivi) sert aussi les recherches par activité
+    activite = models.ForeignKey(Activite, on_delete=models.CASCADE, related_name='suivis', db_index=False) 
     date_suivi = models.DateField()
     observation = models.TextField(blank=True) 
     avancement = models.IntegerField(null=True, blank=True) 
@@ -218,6 +283,14 @@ class Suivi(models.Model):
     # ✅ AJOUT DU CHAMP DE NOTIFICATION
     notification_retard = models.BooleanField(default=False, verbose_name="Notification de retard")
     message_notification = models.TextField(blank=True, verbose_name="Message de notification")
+
+    class Meta:
+        indexes = [
+            # ✅ Suivis d'une activité, filtrés ou triés par date (SuiviViewSet)
+            models.Index(fields=['activite', 'date_suivi'], name='suivi_activite_date_idx'),
+            # ✅ Pagination par curseur (date_suivi, id) et période du / au sur tous les suivis
+            models.Index(fields=['date_suivi', 'id'], name='suivi_date_idx'),
+        ]
     
     def __str__(self):
         return f"Suivi {self.activite} - {self.date_suivi}"
@@ -239,9 +312,163 @@ class Suivi(models.Model):
         
         super().save(*args, **kwargs)
 
+# ✅ SIGNAL POUR RATTACHER L'ACTIVITÉ À SES SOURCES DE FINANCEMENT ET CIBLES NORMALISÉES
+@receiver(post_save, sender=Activite)
+def synchroniser_dimensions_activite(sender, instance, raw=False, update_fields=None, **kwargs):
+    if raw or (update_fields is not None and not {'sources_financement', 'cibles'} & set(update_fields)):
+        return
+    from .dimensions import synchroniser_dimensions
+    synchroniser_dimensions([(instance.pk, instance.sources_financement, instance.cibles)])
+
 # ✅ SIGNAL POUR METTRE À JOUR AUTOMATIQUEMENT L'ÉTAT SI L'AVANCEMENT EST À 100%
 @receiver(pre_save, sender=Suivi)
 def mettre_a_jour_etat_activite(sender, instance, **kwargs):
     if instance.avancement == 100 and instance.activite.etat != 'Terminé':
         instance.activite.etat = 'Terminé'
-        instance.activite.save()
\ No newline at end of file
+        instance.activite.save()
+
+# ✅ FILE DE TÂCHES D'ARRIÈRE-PLAN (EXPORTS, IMPORTS, CONTRÔLES DE RETARD)
+STATUTS_JOB = (
+    ('en_attente', 'En attente'),
+    ('en_cours', 'En cours'),
+    ('termine', 'Terminé'),
+    ('echec', 'Échec'),
+)
+
+class Job(models.Model):
+    type = models.CharField(max_length=50)
+    statut = models.CharField(max_length=20, choices=STATUTS_JOB, default='en_attente')
+    parametres = models.JSONField(default=dict, blank=True)
+    fichier_entree = models.FileField(upload_to='jobs/entrees/', blank=True)
+    fichier_resultat = models.FileField(upload_to='jobs/resultats/', blank=True)
+    resultat = models.JSONField(null=True, blank=True)
+    progression = models.PositiveSmallIntegerField(default=0)
+    message = models.CharField(max_length=255, blank=True)
+    erreur = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    cree_par = models.ForeignKey('auth.User', null=True, blank=True, on_delete=models.SET_NULL, related_name='jobs')
+    cree_le = models.DateTimeField(auto_now_add=True)
+    demarre_le = models.DateTimeField(null=True, blank=True)
+    # Dernier signe de vie du worker : un job en cours qui n'en donne plus est considéré comme abandonné
+    battement_le = models.DateTimeField(null=True, blank=True)
+    termine_le = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Tâche d'arrière-plan"
+        verbose_name_plural = "Tâches d'arrière-plan"
+        ordering = ['-cree_le']
+        indexes = [
+            models.Index(fields=['statut', 'cree_le'], name='job_statut_cree_le_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.type} #{self.pk} ({self.statut})"
+
+    def signaler_progression(self, progression, message=''):
+        """Met à jour l'avancement sans toucher aux autres colonnes (le job tourne hors requête HTTP)."""
+        self.progression = max(0, min(int(progression), 100))
+        self.message = message[:255]
+        Job.objects.filter(pk=self.pk).update(
+            progression=self.progression, message=self.message, battement_le=timezone.now(),
+        )
+
+
+# ✅ ANOMALIES BUDGÉTAIRES DÉTECTÉES PAR L'ANALYSE DU PTA (api/anomalies.py)
+TYPES_ANOMALIE = (
+    ('cout_atypique', 'Coût unitaire atypique pour le compte PCOP'),
+    ('montant_incoherent', 'Montant différent du coût unitaire × quantité'),
+)
+
+class AnomalieBudget(models.Model):
+    activite = models.ForeignKey(Activite, on_delete=models.CASCADE, related_name='anomalies')
+    pcop = models.ForeignKey(PCOPEntry, on_delete=models.CASCADE, null=True, blank=True, related_name='anomalies')
+    type = models.CharField(max_length=30, choices=TYPES_ANOMALIE)
+    # Valeur contrôlée (coût unitaire ou montant) et valeur attendue (médiane du compte ou coût × quantité)
+    valeur = models.FloatField()
+    reference = models.FloatField()
+    # Score robuste du coût, ou écart relatif du montant : plus il est élevé, plus l'anomalie est forte
+    score = models.FloatField()
+    mad = models.FloatField(null=True, blank=True)
+    p10 = models.FloatField(null=True, blank=True)
+    p90 = models.FloatField(null=True, blank=True)
+    detectee_le = models.DateTimeField()
+
+    class Meta:
+        verbose_name = "Anomalie budgétaire"
+        verbose_name_plural = "Anomalies budgétaires"
+        indexes = [
+            # ✅ Liste paginée par score décroissant, filtrable par type
+            models.Index(fields=['score', 'id'], name='anomalie_score_idx'),
+            models.Index(fields=['type', 'score', 'id'], name='anomalie_type_score_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.get_type_display()} : activité {self.activite_id}"
+
+
+# ✅ INSTANTANÉS FIGÉS DU PTA (api/instantanes.py) : état exact du plan à une date, non modifiable
+class InstantanePTA(models.Model):
+    nom = models.CharField(max_length=100)
+    annee = models.PositiveSmallIntegerField(db_index=True)
+    description = models.TextField(blank=True)
+    cree_par = models.ForeignKey('auth.User', null=True, blank=True, on_delete=models.SET_NULL, related_name='instantanes_pta')
+    cree_le = models.DateTimeField(auto_now_add=True)
+    version_donnees = models.BigIntegerField()
+    nb_activites = models.PositiveIntegerField()
+    montant_total = models.DecimalField(max_digits=18, decimal_places=2)
+    # Statistiques du tableau de bord calculées au moment du figement
+    statistiques = models.JSONField()
+    # Colonnes compressées (voir api/instantanes.py) et leur empreinte SHA-256, vérifiée à la lecture
+    donnees = models.BinaryField()
+    taille = models.PositiveIntegerField()
+    empreinte = models.CharField(max_length=64)
+
+    class Meta:
+        verbose_name = "Instantané du PTA"
+        verbose_name_plural = "Instantanés du PTA"
+        ordering = ['-cree_le', '-id']
+
+    def __str__(self):
+        return f"{self.nom} ({self.annee})"
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding:
+            raise ValueError("Un instantané du PTA ne peut pas être modifié")
+        super().save(*args, **kwargs)
+
+
+# ✅ VERSION DES DONNÉES : INCRÉMENTÉE À CHAQUE MODIFICATION, ELLE INVALIDE LES EXPORTS PRÉCALCULÉS
+class VersionDonnees(models.Model):
+    cle = models.CharField(max_length=50, unique=True)
+    version = models.BigIntegerField(default=0)
+
+    class Meta:
+        verbose_name = "Version des données"
+        verbose_name_plural = "Versions des données"
+
+    def __str__(self):
+        return f"{self.cle} v{self.version}"
+
+
+def version_donnees(cle='pta'):
+    return VersionDonnees.objects.filter(cle=cle).values_list('version', flat=True).first() or 0
+
+
+def incrementer_version_donnees(cle='pta'):
+    if not VersionDonnees.objects.filter(cle=cle).update(version=models.F('version') + 1):
+        VersionDonnees.objects.get_or_create(cle=cle, defaults={'version': 1})
+
+
+MODELES_EXPORTES = (
+    Structure, Direction, Service, Division, PCOPEntry,
+    ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Activite,
+)
+
+@receiver(post_save)
+@receiver(post_delete)
+def invalider_exports(sender, **kwargs):
+    if sender in MODELES_EXPORTES and not kwargs.get('raw'):
+        incrementer_version_donnees()
+    # ✅ Version propre aux suivis : courbes d'avancement (les exports n'en dépendent pas)
+    elif sender is Suivi and not kwargs.get('raw'):
+        incrementer_version_donnees('suivis')
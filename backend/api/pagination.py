@@ -0,0 +1,39 @@
+"""
+Pagination par curseur, activée à la demande.
+
+Les listes restent renvoyées en entier tant que le client ne demande pas de
+page (le frontend actuel attend un tableau) ; avec ?page_size= ou ?cursor=,
+la réponse devient {next, previous, results}. Le curseur encode la position
+dans l'ordre de tri : le coût d'une page ne dépend pas de sa profondeur,
+contrairement à OFFSET.
+"""
+from rest_framework.pagination import CursorPagination
+
+
+class PaginationCurseurOptionnelle(CursorPagination):
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params and self.page_size_query_param not in request.query_params:
+            return None
+        return super().paginate_queryset(queryset, request, view)
+
+
+class PaginationSuivis(PaginationCurseurOptionnelle):
+    # Du plus récent au plus ancien ; l'id départage les suivis d'une même date
+    ordering = ('-date_suivi', '-id')
+
+
+class PaginationPrevisions(PaginationCurseurOptionnelle):
+    # Du risque le plus élevé au plus faible (index activite_risque_idx)
+    ordering = ('-risque_retard', '-id')
+
+
+class PaginationAnomalies(CursorPagination):
+    # Liste nouvelle, sans client historique : toujours paginée, de l'anomalie la plus forte à la plus faible
+    page_size = 100
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
+    ordering = ('-score', '-id')
@@ -0,0 +1,142 @@
+"""
+Paquets d'export : une archive ZIP contenant un classeur PTA par structure
+(ou par direction).
+
+Chaque classeur est construit dans un processus d'un ProcessPoolExecutor,
+avec sa propre connexion à la base, et écrit dans l'archive dès qu'il est
+terminé. Ce module n'importe les modèles qu'à l'intérieur des fonctions :
+les processus enfants peuvent ainsi le charger avant django.setup(),
+quelle que soit la méthode de démarrage (fork ou spawn).
+"""
+import logging
+import os
+import zipfile
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.db.models import Count
+from django.utils.text import slugify
+
+logger = logging.getLogger(__name__)
+
+DECOUPAGES = ('structure', 'direction')
+NOM_SANS_RATTACHEMENT = {'structure': 'Sans_structure', 'direction': 'Sans_direction'}
+
+
+def _initialiser_processus():
+    # Le parent ferme ses connexions avant de démarrer le pool : chaque
+    # processus ouvre la sienne à la première requête.
+    import django
+
+    django.setup()
+
+
+def _classeur_groupe(decoupage, identifiant, filtres):
+    """Construit le classeur d'un groupe ; retourne (identifiant, contenu, nombre d'activités)."""
+    from .exports import classeur_en_octets, construire_classeur_pta
+
+    filtres_groupe = dict(filtres, **{decoupage: [identifiant]})
+    wb, row_count = construire_classeur_pta(filtres=filtres_groupe)
+    return identifiant, classeur_en_octets(wb), row_count
+
+
+def groupes_a_exporter(decoupage, filtres):
+    """Retourne [(identifiant, nom de fichier, nombre d'activités)], les groupes les plus lourds d'abord."""
+    from .models import Direction, Structure
+    from .sources import activites_filtrees
+
+    comptes = dict(
+        activites_filtrees(filtres)
+        .values_list(f'{decoupage}_id').annotate(nb=Count('id')).order_by()
+    )
+    if decoupage == 'structure':
+        noms = {
+            s['id']: f"{s['numero']}_{s['nom']}"
+            for s in Structure.objects.filter(id__in=comptes).values('id', 'numero', 'nom')
+        }
+    else:
+        noms = {
+            d['id']: f"{d['structure__numero']}_{d['numero']}_{d['nom']}"
+            for d in Direction.objects.filter(id__in=comptes).values('id', 'numero', 'nom', 'structure__numero')
+        }
+
+    slugs = {
+        identifiant: NOM_SANS_RATTACHEMENT[decoupage] if identifiant is None
+        else slugify(noms.get(identifiant, identifiant)).replace('-', '_') or str(identifiant)
+        for identifiant in comptes
+    }
+    # Numéros non uniques (directions) ou distingués seulement par la casse ou les accents :
+    # l'identifiant départage les noms, sinon l'extraction écraserait un classeur par un autre
+    occurrences = Counter(slug.lower() for slug in slugs.values())
+    groupes = []
+    for identifiant, nb in comptes.items():
+        nom = slugs[identifiant]
+        if occurrences[nom.lower()] > 1 and identifiant is not None:
+            nom = f"{nom}_{identifiant}"
+        groupes.append((identifiant, f"PTA_{nom}.xlsx", nb))
+    # Les plus gros groupes partent en premier pour que les autres comblent les processus libres
+    groupes.sort(key=lambda groupe: groupe[2], reverse=True)
+    return groupes
+
+
+def _nombre_processus(nb_groupes):
+    from django.db import connection
+
+    if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+        return 1
+    processus = getattr(settings, 'EXPORTS_PROCESSUS', None) or os.cpu_count() or 1
+    return max(1, min(processus, nb_groupes))
+
+
+def construire_paquet(fichier, decoupage='structure', filtres=None, processus=None):
+    """
+    Écrit dans `fichier` une archive ZIP d'un classeur par groupe. Retourne
+    la liste des classeurs ({'fichier', 'activites'}) dans l'ordre d'écriture.
+    """
+    from django.db import connections
+
+    filtres = filtres or {}
+    groupes = groupes_a_exporter(decoupage, filtres)
+    noms = {identifiant: nom for identifiant, nom, nb in groupes}
+    processus = processus or _nombre_processus(len(groupes))
+    contenu = []
+
+    # Les classeurs xlsx sont déjà compressés : on les stocke tels quels
+    with zipfile.ZipFile(fichier, 'w', compression=zipfile.ZIP_STORED) as archive:
+        def ajouter(identifiant, octets, row_count):
+            archive.writestr(noms[identifiant], octets)
+            contenu.append({'fichier': noms[identifiant], 'activites': row_count})
+
+        if processus <= 1:
+            for identifiant, nom, nb in groupes:
+                ajouter(*_classeur_groupe(decoupage, identifiant, filtres))
+        else:
+            connections.close_all()
+            with ProcessPoolExecutor(max_workers=processus, initializer=_initialiser_processus) as executeur:
+                futures = [
+                    executeur.submit(_classeur_groupe, decoupage, identifiant, filtres)
+                    for identifiant, nom, nb in groupes
+                ]
+                for future in as_completed(futures):
+                    ajouter(*future.result())
+
+    logger.info(f"Paquet d'export par {decoupage}: {len(contenu)} classeurs ({processus} processus)")
+    return contenu
+
+
+def nom_fichier_paquet(decoupage, timestamp=None):
+    from .exports import nom_fichier_export
+
+    return nom_fichier_export(f"PTA_Par_{decoupage.capitalize()}", 'zip', timestamp=timestamp)
+
+
+def artefact_paquet(decoupage, filtres=None, forcer=False):
+    """Chemin de l'archive pour la version courante des données, ce découpage et ces filtres."""
+    from .artefacts import obtenir_artefact
+
+    return obtenir_artefact(
+        f'pta_par_{decoupage}', {'filtres': filtres or {}},
+        lambda fichier: construire_paquet(fichier, decoupage, filtres),
+        'zip', forcer=forcer,
+    )
@@ -0,0 +1,233 @@
+"""
+Prévision de la date d'achèvement et du risque de retard de chaque activité,
+à partir de l'historique de ses suivis.
+
+Tout le portefeuille est traité en une passe NumPy : les suivis sont chargés
+en trois tableaux (activité, jour, avancement) et une droite avancement =
+a + b × jour est ajustée par activité à partir de sommes groupées
+(np.bincount), sans boucle Python par activité. La date de début prévue
+compte comme un point à 0 % quand elle précède le premier suivi. Un second
+ajustement pondéré (poids de Huber) limite l'effet des suivis aberrants.
+
+- date d'achèvement prévue : jour où la droite atteint 100 % ;
+- risque de retard : probabilité que l'avancement soit encore sous 100 % à
+  date_fin, en supposant les écarts à la droite normaux.
+
+Les résultats sont enregistrés sur Activite (tâche 'prevoir_achevements',
+manage.py prevoir_achevements à planifier la nuit) : les listes d'activités
+probablement en retard se lisent ensuite sur un index.
+
+NumPy est importé à l'exécution : sans lui, le calcul lève ImportError.
+"""
+import logging
+import time
+from datetime import date
+
+from django.db import transaction
+from django.utils import timezone
+
+from .models import Activite, Suivi
+
+logger = logging.getLogger(__name__)
+
+# Risque à partir duquel une activité est considérée comme probablement en retard
+RISQUE_ELEVE = 0.5
+# Écart-type (en points d'avancement) supposé quand les suivis ne permettent pas de l'estimer
+ECART_TYPE_DEFAUT = 15.0
+ECART_TYPE_MIN = 2.0
+# Seuil de Huber, en écarts-types
+SEUIL_HUBER = 1.345
+# bulk_update écrit un CASE par colonne : son coût croît avec la taille du paquet
+TAILLE_PAQUET = 500
+
+CHAMPS_PREVISION = ['date_achevement_prevue', 'risque_retard', 'prevision_calculee_le']
+
+
+def _repartition_normale(z):
+    """Fonction de répartition de la loi normale centrée réduite (Abramowitz et Stegun 7.1.26, erreur < 2e-7)."""
+    import numpy as np
+
+    x = np.abs(z) / np.sqrt(2)
+    t = 1 / (1 + 0.3275911 * x)
+    polynome = t * (0.254829592 + t * (-0.284496736 + t * (1.421413741 + t * (-1.453152027 + t * 1.061405429))))
+    erf = 1 - polynome * np.exp(-x * x)
+    return 0.5 * (1 + np.sign(z) * erf)
+
+
+def ajuster_droites(groupes, x, y, nb_groupes, poids=None):
+    """
+    Droite des moindres carrés (pondérés) y = a + b·x de chaque groupe.
+    Retourne (a, b, écart-type des résidus, nombre de points) par groupe ;
+    a et b valent NaN pour les groupes de moins de deux abscisses distinctes.
+    """
+    import numpy as np
+
+    w = np.ones_like(x) if poids is None else poids
+    n = np.bincount(groupes, minlength=nb_groupes)
+    sw = np.bincount(groupes, w, nb_groupes)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mx = np.bincount(groupes, w * x, nb_groupes) / sw
+        my = np.bincount(groupes, w * y, nb_groupes) / sw
+        dx = x - mx[groupes]
+        dy = y - my[groupes]
+        variance = np.bincount(groupes, w * dx * dx, nb_groupes)
+        b = np.bincount(groupes, w * dx * dy, nb_groupes) / variance
+        b[variance <= 1e-9] = np.nan
+        a = my - b * mx
+        residus = y - (a[groupes] + b[groupes] * x)
+        sse = np.bincount(groupes, w * residus * residus, nb_groupes) / sw * n
+        ecart_type = np.sqrt(sse / (n - 2))
+    ecart_type[n <= 2] = np.nan
+    return a, b, ecart_type, n
+
+
+def prevoir(activite_ids, debuts, fins, etats, suivi_activites, suivi_jours, suivi_avancements, aujourd_hui):
+    """
+    Calcul vectoriel des prévisions. Les jours sont des ordinaux
+    (date.toordinal()), NaN quand la date est inconnue ; les suivis sont triés
+    par activité puis par date, ceux d'une activité absente de activite_ids
+    sont ignorés. Retourne (jour d'achèvement prévu, risque),
+    deux tableaux alignés sur activite_ids, NaN quand il n'y a pas de prévision.
+    """
+    import numpy as np
+
+    nb = len(activite_ids)
+    # Suivis d'activités absentes de activite_ids (créées ou supprimées entre les deux lectures) : ignorés
+    groupes = np.searchsorted(activite_ids, suivi_activites)
+    connus = groupes < nb
+    connus[connus] = activite_ids[groupes[connus]] == suivi_activites[connus]
+    if not connus.all():
+        groupes, suivi_activites = groupes[connus], suivi_activites[connus]
+        suivi_jours, suivi_avancements = suivi_jours[connus], suivi_avancements[connus]
+
+    # Abscisses centrées sur aujourd'hui : évite les pertes de précision sur les ordinaux (~740 000)
+    debuts = debuts - aujourd_hui
+    fins = fins - aujourd_hui
+    x = suivi_jours - aujourd_hui
+    y = suivi_avancements.astype(float)
+
+    nb_suivis = np.bincount(groupes, minlength=nb)
+    a_des_suivis = nb_suivis > 0
+    # Suivis triés par activité : le dernier de chaque activité clôt son bloc
+    derniers = np.cumsum(nb_suivis) - 1
+    avancement_actuel = np.zeros(nb)
+    avancement_actuel[a_des_suivis] = y[derniers[a_des_suivis]]
+    dernier_jour = np.full(nb, np.nan)
+    dernier_jour[a_des_suivis] = x[derniers[a_des_suivis]]
+    premier_jour = np.full(nb, np.nan)
+    premier_jour[a_des_suivis] = x[(derniers - nb_suivis + 1)[a_des_suivis]]
+
+    # Point à 0 % à la date de début prévue, si elle précède le premier suivi
+    avec_origine = ~np.isnan(debuts) & ~(premier_jour < debuts)
+    groupes = np.concatenate([np.flatnonzero(avec_origine), groupes])
+    x = np.concatenate([debuts[avec_origine], x])
+    y = np.concatenate([np.zeros(avec_origine.sum()), y])
+
+    a, b, ecart_type, n = ajuster_droites(groupes, x, y, nb)
+    # Repondération de Huber : les points éloignés de la droite pèsent moins
+    echelle = np.where(np.isnan(ecart_type), ECART_TYPE_DEFAUT, np.maximum(ecart_type, ECART_TYPE_MIN))
+    with np.errstate(invalid='ignore', divide='ignore'):
+        residus = np.abs(y - (a[groupes] + b[groupes] * x)) / echelle[groupes]
+        poids = np.where(residus > SEUIL_HUBER, SEUIL_HUBER / residus, 1.0)
+    poids[np.isnan(poids)] = 1.0
+    a, b, ecart_type, n = ajuster_droites(groupes, x, y, nb, poids)
+    ecart_type = np.where(np.isnan(ecart_type), ECART_TYPE_DEFAUT, np.maximum(ecart_type, ECART_TYPE_MIN))
+
+    progresse = b > 0
+    with np.errstate(invalid='ignore', divide='ignore'):
+        achevement = np.where(progresse, (100 - a) / b, np.nan)
+        # Pas encore à 100 % : l'achèvement ne peut pas être antérieur à aujourd'hui
+        achevement = np.maximum(achevement, np.fmax(dernier_jour, 0))
+        z = (100 - (a + b * fins)) / ecart_type
+    risque = np.where(progresse, _repartition_normale(z), np.nan)
+    # Avancement figé ou en recul : l'activité n'atteindra pas 100 % à ce rythme
+    risque[(n >= 2) & ~progresse & ~np.isnan(b)] = 1.0
+    risque[fins < 0] = 1.0
+    risque[np.isnan(fins)] = np.nan
+
+    # Activités achevées : date du premier suivi à 100 % (ou du dernier suivi), aucun risque
+    termine = (etats == 'Terminé') | (avancement_actuel >= 100)
+    a_100 = suivi_avancements >= 100
+    atteint = np.full(nb, np.nan)
+    groupes_100, premiers_100 = np.unique(np.searchsorted(activite_ids, suivi_activites[a_100]), return_index=True)
+    atteint[groupes_100] = suivi_jours[a_100][premiers_100] - aujourd_hui
+    achevement[termine] = np.fmin(atteint, dernier_jour)[termine]
+    achevement[termine & np.isnan(atteint)] = dernier_jour[termine & np.isnan(atteint)]
+    risque[termine] = 0.0
+
+    annule = etats == 'Annulé'
+    achevement[annule] = np.nan
+    risque[annule] = np.nan
+    return achevement + aujourd_hui, risque
+
+
+def _en_ordinaux(dates):
+    import numpy as np
+
+    # Plus rapide que la conversion de NumPy des objets date en datetime64
+    return np.fromiter((jour.toordinal() if jour else np.nan for jour in dates), float, len(dates))
+
+
+def calculer_previsions(aujourd_hui=None, progression=None):
+    """
+    Recalcule et enregistre les prévisions de toutes les activités.
+    `progression(fait, total)` est appelé après chaque paquet de
+    prévisions modifiées écrit.
+    """
+    import numpy as np
+
+    debut = time.perf_counter()
+    aujourd_hui = aujourd_hui or timezone.now().date()
+    activites = list(Activite.objects.order_by('id').values_list(
+        'id', 'date_debut', 'date_fin', 'etat', 'date_achevement_prevue', 'risque_retard',
+    ))
+    ids, debuts, fins, etats, anciennes_dates, anciens_risques = zip(*activites) if activites else ((),) * 6
+    # Les deux lectures ne voient pas forcément le même état de la base : les suivis
+    # d'activités créées entre-temps sont bornés ici et écartés par prevoir()
+    suivis = list(
+        Suivi.objects.filter(avancement__isnull=False, activite_id__lte=ids[-1] if ids else 0)
+        .order_by('activite_id', 'date_suivi', 'id')
+        .values_list('activite_id', 'date_suivi', 'avancement')
+    )
+    suivi_activites, suivi_dates, suivi_avancements = zip(*suivis) if suivis else ((), (), ())
+
+    achevements, risques = prevoir(
+        np.array(ids, dtype='int64'), _en_ordinaux(debuts), _en_ordinaux(fins), np.array(etats, dtype=object),
+        np.array(suivi_activites, dtype='int64'), _en_ordinaux(suivi_dates),
+        np.array(suivi_avancements, dtype=float), aujourd_hui.toordinal(),
+    )
+    calcul = time.perf_counter() - debut
+
+    # Seules les prévisions qui changent sont réécrites : d'une nuit à l'autre, la plupart sont stables.
+    # prevision_calculee_le date donc la prévision en vigueur, pas le dernier passage du calcul
+    maintenant = timezone.now()
+    modifiees = []
+    for pk, jour, risque, ancienne_date, ancien_risque in zip(
+        ids, achevements.tolist(), risques.tolist(), anciennes_dates, anciens_risques,
+    ):
+        nouvelle_date = None if np.isnan(jour) else date.fromordinal(int(round(jour)))
+        nouveau_risque = None if np.isnan(risque) else round(risque, 3)
+        if nouvelle_date != ancienne_date or nouveau_risque != ancien_risque:
+            modifiees.append(Activite(
+                pk=pk, date_achevement_prevue=nouvelle_date, risque_retard=nouveau_risque,
+                prevision_calculee_le=maintenant,
+            ))
+
+    with transaction.atomic():
+        for depart in range(0, len(modifiees), TAILLE_PAQUET):
+            # bulk_update n'émet pas de signal : les exports, qui n'incluent pas ces champs, restent valides
+            Activite.objects.bulk_update(modifiees[depart:depart + TAILLE_PAQUET], CHAMPS_PREVISION)
+            if progression:
+                progression(min(depart + TAILLE_PAQUET, len(modifiees)), len(modifiees))
+
+    bilan = {
+        'activites': len(activites),
+        'modifiees': len(modifiees),
+        'suivis': len(suivis),
+        'a_risque': int(np.sum(risques >= RISQUE_ELEVE)),
+        'sans_prevision': int(np.sum(np.isnan(risques))),
+        'duree_calcul_secondes': round(calcul, 3),
+        'duree_secondes': round(time.perf_counter() - debut, 3),
+    }
+    logger.info(f"Prévisions d'achèvement recalculées : {bilan}")
+    return bilan
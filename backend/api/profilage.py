@@ -0,0 +1,266 @@
+"""
+Profilage à la demande des requêtes en production.
+
+Un administrateur arme le profilage des N prochaines requêtes dont le chemin
+commence par une route donnée (POST /api/profilage/). Chaque requête retenue
+est profilée soit par cProfile (fichier .pstats), soit par un échantillonneur
+statistique (pile collectée toutes les PROFILAGE_INTERVALLE_MS, fichier
+.collapsed lisible par flamegraph.pl ou speedscope). Les fichiers sont écrits
+dans MEDIA_ROOT/profils.
+
+L'état armé est partagé entre les workers par un fichier JSON, dont
+l'existence n'est vérifiée qu'une fois par seconde et par processus :
+désarmé, le surcoût par requête se limite à une comparaison d'horloge.
+"""
+import cProfile
+import fcntl
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from datetime import datetime
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+REPERTOIRE_PROFILS = 'profils'
+MODES_PROFILAGE = ('cprofile', 'echantillonnage')
+
+
+def parametre(nom, defaut):
+    return getattr(settings, f'PROFILAGE_{nom}', defaut)
+
+
+def repertoire_profils():
+    chemin = os.path.join(settings.MEDIA_ROOT, REPERTOIRE_PROFILS)
+    os.makedirs(chemin, exist_ok=True)
+    return chemin
+
+
+def _fichier_etat():
+    return os.path.join(repertoire_profils(), 'etat.json')
+
+
+@contextmanager
+def _verrou_etat():
+    """Verrou inter-processus autour de la lecture/écriture de l'état."""
+    with open(os.path.join(repertoire_profils(), 'etat.lock'), 'w') as verrou:
+        fcntl.flock(verrou, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(verrou, fcntl.LOCK_UN)
+
+
+def _lire_etat():
+    try:
+        with open(_fichier_etat(), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _ecrire_etat(etat):
+    temporaire = f"{_fichier_etat()}.{os.getpid()}.tmp"
+    with open(temporaire, 'w', encoding='utf-8') as f:
+        json.dump(etat, f)
+    os.replace(temporaire, _fichier_etat())
+
+
+def _supprimer_etat():
+    try:
+        os.unlink(_fichier_etat())
+    except FileNotFoundError:
+        pass
+
+
+def etat_profilage():
+    etat = _lire_etat()
+    if etat and etat['expire_le'] < time.time():
+        return None
+    return etat
+
+
+def armer_profilage(route, requetes, mode, utilisateur):
+    """
+    Arme le profilage des `requetes` prochaines requêtes vers `route`.
+    Lève ValueError si les paramètres sont invalides ou si le délai entre deux
+    armements (PROFILAGE_DELAI_ARMEMENT) n'est pas écoulé.
+    """
+    if mode not in MODES_PROFILAGE:
+        raise ValueError(f"Mode inconnu (valeurs possibles : {', '.join(MODES_PROFILAGE)})")
+    if not route or not route.startswith('/'):
+        raise ValueError("La route doit commencer par /")
+    maximum = parametre('MAX_REQUETES', 20)
+    if not 1 <= requetes <= maximum:
+        raise ValueError(f"Le nombre de requêtes doit être compris entre 1 et {maximum}")
+
+    with _verrou_etat():
+        dernier_armement = os.path.join(repertoire_profils(), 'dernier_armement')
+        delai = parametre('DELAI_ARMEMENT', 60)
+        if os.path.exists(dernier_armement) and time.time() - os.path.getmtime(dernier_armement) < delai:
+            raise ValueError(f"Un profilage a été armé il y a moins de {delai} secondes")
+        maintenant = time.time()
+        open(dernier_armement, 'w').close()
+        etat = {
+            'route': route, 'restant': requetes, 'mode': mode, 'arme_par': utilisateur,
+            'arme_le': maintenant, 'expire_le': maintenant + parametre('DUREE_MAX', 600),
+        }
+        _ecrire_etat(etat)
+    logger.info(f"Profilage armé par {utilisateur}: {requetes} requêtes vers {route} ({mode})")
+    return etat
+
+
+def desarmer_profilage():
+    with _verrou_etat():
+        _supprimer_etat()
+
+
+def _reserver(chemin):
+    """Réserve une requête à profiler pour ce chemin ; retourne le mode, ou None."""
+    with _verrou_etat():
+        etat = _lire_etat()
+        if not etat or not chemin.startswith(etat['route']):
+            return None
+        if etat['expire_le'] < time.time():
+            _supprimer_etat()
+            return None
+        etat['restant'] -= 1
+        if etat['restant']:
+            _ecrire_etat(etat)
+        else:
+            _supprimer_etat()
+        return etat['mode']
+
+
+def lister_profils():
+    profils = []
+    for nom in sorted(os.listdir(repertoire_profils()), reverse=True):
+        if nom.endswith(('.pstats', '.collapsed')):
+            infos = os.stat(os.path.join(repertoire_profils(), nom))
+            profils.append({'nom': nom, 'taille': infos.st_size, 'cree_le': datetime.fromtimestamp(infos.st_mtime)})
+    return profils
+
+
+def chemin_profil(nom):
+    """Chemin d'un profil existant, ou None (le nom ne peut pas sortir du répertoire)."""
+    if os.path.basename(nom) != nom or not nom.endswith(('.pstats', '.collapsed')):
+        return None
+    chemin = os.path.join(repertoire_profils(), nom)
+    return chemin if os.path.exists(chemin) else None
+
+
+def _nom_profil(request, extension):
+    horodatage = datetime.now().strftime('%Y%m%d_%H%M%S_%f')
+    route = request.path.strip('/').replace('/', '_') or 'racine'
+    return os.path.join(repertoire_profils(), f"{horodatage}_{request.method}_{route}.{extension}")
+
+
+# ---------- ÉCHANTILLONNEUR ----------
+class Echantillonneur:
+    """Relève périodiquement la pile d'un thread et compte les piles identiques (format collapsed)."""
+
+    def __init__(self, thread_id, intervalle):
+        self.thread_id = thread_id
+        self.intervalle = intervalle
+        self.piles = Counter()
+        self._arret = threading.Event()
+        self._thread = threading.Thread(target=self._echantillonner, daemon=True)
+
+    def _echantillonner(self):
+        while not self._arret.wait(self.intervalle):
+            frame = sys._current_frames().get(self.thread_id)
+            pile = []
+            while frame is not None:
+                code = frame.f_code
+                pile.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            if pile:
+                self.piles[';'.join(reversed(pile))] += 1
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._arret.set()
+        self._thread.join()
+
+    def ecrire(self, chemin):
+        with open(chemin, 'w', encoding='utf-8') as f:
+            for pile, nombre in self.piles.most_common():
+                f.write(f"{pile} {nombre}\n")
+
+
+class ProfilageMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self._prochaine_verification = 0.0
+        self._arme = False
+
+    def _est_arme(self):
+        maintenant = time.monotonic()
+        if maintenant >= self._prochaine_verification:
+            self._prochaine_verification = maintenant + 1.0
+            self._arme = os.path.exists(_fichier_etat())
+        return self._arme
+
+    def __call__(self, request):
+        if not self._est_arme():
+            return self.get_response(request)
+        mode = _reserver(request.path)
+        if mode is None:
+            return self.get_response(request)
+
+        if mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Un autre profilage est déjà actif dans ce processus (requête concurrente)
+                return self.get_response(request)
+            chemin = _nom_profil(request, 'pstats')
+
+            def terminer():
+                profiler.disable()
+                profiler.dump_stats(chemin)
+        else:
+            echantillonneur = Echantillonneur(threading.get_ident(), parametre('INTERVALLE_MS', 5) / 1000)
+            echantillonneur.__enter__()
+            chemin = _nom_profil(request, 'collapsed')
+
+            def terminer():
+                echantillonneur.__exit__()
+                echantillonneur.ecrire(chemin)
+
+        try:
+            response = self.get_response(request)
+        except BaseException:
+            terminer()
+            raise
+        return self._terminer_apres_envoi(response, terminer, chemin)
+
+    def _terminer_apres_envoi(self, response, terminer, chemin):
+        """Pour une réponse en flux (export CSV...), le profil couvre aussi la production du contenu."""
+        def fin():
+            terminer()
+            logger.info(f"Profil enregistré: {chemin}")
+
+        if not response.streaming:
+            fin()
+            return response
+        contenu = response.streaming_content
+
+        def flux():
+            try:
+                yield from contenu
+            finally:
+                fin()
+
+        response.streaming_content = flux()
+        return response
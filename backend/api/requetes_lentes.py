@@ -0,0 +1,142 @@
+"""
+Journal des requêtes SQL lentes (activé par REQUETES_LENTES_ACTIF).
+
+Un execute_wrapper posé sur chaque connexion chronomètre les requêtes ; celles
+qui dépassent REQUETES_LENTES_SEUIL_MS sont écrites, une par ligne JSON, dans
+REQUETES_LENTES_FICHIER (rotation par taille) avec leurs paramètres, la vue ou
+la tâche d'origine et, sur PostgreSQL, le plan EXPLAIN (ANALYZE, BUFFERS).
+EXPLAIN ANALYZE réexécute la requête : il n'est lancé que pour les SELECT.
+"""
+import json
+import logging
+import os
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from logging.handlers import RotatingFileHandler
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .instrumentation import mesure_courante
+
+logger = logging.getLogger(__name__)
+
+_origine = ContextVar('origine_sql', default=None)
+_journal = None
+
+
+def parametre(nom, defaut):
+    return getattr(settings, f'REQUETES_LENTES_{nom}', defaut)
+
+
+def fichier_journal():
+    return str(parametre('FICHIER', os.path.join(settings.BASE_DIR, 'logs', 'requetes_lentes.jsonl')))
+
+
+def journal():
+    """Logger dédié, écrivant les entrées JSON brutes dans un fichier à rotation."""
+    global _journal
+    if _journal is None:
+        chemin = fichier_journal()
+        os.makedirs(os.path.dirname(chemin), exist_ok=True)
+        handler = RotatingFileHandler(
+            chemin, maxBytes=parametre('TAILLE_MAX', 10 * 1024 * 1024),
+            backupCount=parametre('ROTATIONS', 5), encoding='utf-8',
+        )
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        _journal = logging.getLogger('api.requetes_lentes.journal')
+        _journal.addHandler(handler)
+        _journal.setLevel(logging.INFO)
+        _journal.propagate = False
+    return _journal
+
+
+@contextmanager
+def origine_sql(nom):
+    """Attribue les requêtes exécutées dans le bloc à `nom` (ex. 'job:export_pta')."""
+    jeton = _origine.set(nom)
+    try:
+        yield
+    finally:
+        _origine.reset(jeton)
+
+
+def origine_courante():
+    origine = _origine.get()
+    if origine:
+        return origine
+    mesure = mesure_courante()
+    return mesure.vue if mesure is not None else None
+
+
+def plan_explain(connexion, sql, params):
+    """Plan EXPLAIN (ANALYZE, BUFFERS), sur un curseur brut pour ne pas repasser par les execute_wrapper."""
+    try:
+        with connexion.connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN (ANALYZE, BUFFERS) {sql}", params)
+            return [ligne[0] for ligne in cursor.fetchall()]
+    except Exception as e:
+        return [f"EXPLAIN impossible : {e}"]
+
+
+def journaliser_requete_lente(execute, sql, params, many, context):
+    debut = time.perf_counter()
+    resultat = execute(sql, params, many, context)
+    duree_ms = (time.perf_counter() - debut) * 1000
+    if duree_ms < parametre('SEUIL_MS', 200):
+        return resultat
+
+    connexion = context['connection']
+    plan = None
+    if (
+        parametre('EXPLAIN', True) and not many and connexion.vendor == 'postgresql'
+        and sql.lstrip()[:6].upper() == 'SELECT'
+    ):
+        plan = plan_explain(connexion, sql, params)
+    entree = {
+        'horodatage': datetime.now().isoformat(timespec='milliseconds'),
+        'duree_ms': round(duree_ms, 1),
+        'origine': origine_courante(),
+        'base': connexion.alias,
+        'sql': sql,
+        'params': None if many else params,
+        'plan': plan,
+    }
+    try:
+        journal().info(json.dumps(entree, default=str, ensure_ascii=False))
+    except Exception as e:
+        logger.error(f"Impossible d'écrire le journal des requêtes lentes: {str(e)}")
+    return resultat
+
+
+@receiver(connection_created)
+def installer_journal(sender, connection, **kwargs):
+    # En tête de liste : les execute_wrapper() temporaires (ex. ServerTimingMiddleware)
+    # retirent le dernier élément en sortie
+    if parametre('ACTIF', False) and journaliser_requete_lente not in connection.execute_wrappers:
+        connection.execute_wrappers.insert(0, journaliser_requete_lente)
+
+
+def lire_entrees(limite=100, origine=None):
+    """Dernières entrées du journal (fichier courant puis fichiers tournés), les plus récentes d'abord."""
+    chemin = fichier_journal()
+    fichiers = [chemin] + [f"{chemin}.{i}" for i in range(1, parametre('ROTATIONS', 5) + 1)]
+    entrees = []
+    for fichier in fichiers:
+        if len(entrees) >= limite or not os.path.exists(fichier):
+            break
+        with open(fichier, encoding='utf-8') as f:
+            lignes = deque(
+                (ligne for ligne in f if origine is None or f'"origine": "{origine}"' in ligne),
+                maxlen=limite - len(entrees),
+            )
+        for ligne in reversed(lignes):
+            try:
+                entrees.append(json.loads(ligne))
+            except ValueError:
+                continue
+    return entrees
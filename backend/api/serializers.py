@@ -1,7 +1,9 @@
 from rest_framework import serializers 
-from .models import UserProfile, Service, Activite, PCOPEntry, Suivi, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Direction, Division, Structure
+from .models import UserProfile, Service, Activite, PCOPEntry, Suivi, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Direction, Division, Structure, Job, AnomalieBudget, SourceFinancement, Cible, InstantanePTA
+from .jobs import TACHES
+from .instrumentation import SerialisationMesuree
 
-class UserProfileSerializer(serializers.ModelSerializer): 
+class UserProfileSerializer(SerialisationMesuree, serializers.ModelSerializer): 
     username = serializers.CharField(source='auth_user.username', read_only=True)
     email = serializers.EmailField(source='auth_user.email', read_only=True)
 
@@ -10,12 +12,12 @@ class UserProfileSerializer(serializers.ModelSerializer):
         fields = '__all__'
 
 # ✅ NOUVEAUX SERIALIZERS POUR LA STRUCTURE ORGANISATIONNELLE
-class DivisionSerializer(serializers.ModelSerializer):
+class DivisionSerializer(SerialisationMesuree, serializers.ModelSerializer):
     class Meta:
         model = Division
         fields = '__all__'
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(SerialisationMesuree, serializers.ModelSerializer):
     divisions = DivisionSerializer(many=True, read_only=True)
     nb_divisions = serializers.IntegerField(source='divisions.count', read_only=True)
     
@@ -23,7 +25,7 @@ class ServiceSerializer(serializers.ModelSerializer):
         model = Service
         fields = '__all__'
 
-class DirectionSerializer(serializers.ModelSerializer):
+class DirectionSerializer(SerialisationMesuree, serializers.ModelSerializer):
     services = ServiceSerializer(many=True, read_only=True)
     nb_services = serializers.IntegerField(source='services.count', read_only=True)
     
@@ -31,7 +33,7 @@ class DirectionSerializer(serializers.ModelSerializer):
         model = Direction
         fields = '__all__'
 
-class StructureSerializer(serializers.ModelSerializer):
+class StructureSerializer(SerialisationMesuree, serializers.ModelSerializer):
     directions = DirectionSerializer(many=True, read_only=True)
     nb_directions = serializers.IntegerField(source='directions.count', read_only=True)  # Correction: 'direction' -> 'directions'
 
@@ -39,18 +41,18 @@ class StructureSerializer(serializers.ModelSerializer):
         model = Structure
         fields = '__all__'
         
-class PCOPEntrySerializer(serializers.ModelSerializer): 
+class PCOPEntrySerializer(SerialisationMesuree, serializers.ModelSerializer): 
     class Meta: 
         model = PCOPEntry 
         fields = '__all__'
 
 # ✅ SERIALIZERS POUR LA STRUCTURE HIÉRARCHIQUE DES OBJECTIFS
-class ResultatAttenduSerializer(serializers.ModelSerializer):
+class ResultatAttenduSerializer(SerialisationMesuree, serializers.ModelSerializer):
     class Meta:
         model = ResultatAttendu
         fields = '__all__'
 
-class ObjectifSpecifiqueSerializer(serializers.ModelSerializer):
+class ObjectifSpecifiqueSerializer(SerialisationMesuree, serializers.ModelSerializer):
     resultats_attendus = ResultatAttenduSerializer(many=True, read_only=True)
     nb_resultats = serializers.IntegerField(source='resultats_attendus.count', read_only=True)
     
@@ -58,7 +60,7 @@ class ObjectifSpecifiqueSerializer(serializers.ModelSerializer):
         model = ObjectifSpecifique
         fields = '__all__'
 
-class ObjectifGeneralSerializer(serializers.ModelSerializer):
+class ObjectifGeneralSerializer(SerialisationMesuree, serializers.ModelSerializer):
     objectifs_specifiques = ObjectifSpecifiqueSerializer(many=True, read_only=True)
     nb_objectifs_specifiques = serializers.IntegerField(source='objectifs_specifiques.count', read_only=True)
     
@@ -66,7 +68,7 @@ class ObjectifGeneralSerializer(serializers.ModelSerializer):
         model = ObjectifGeneral
         fields = '__all__'
         
-class ActiviteSerializer(serializers.ModelSerializer): 
+class ActiviteSerializer(SerialisationMesuree, serializers.ModelSerializer): 
     # ✅ INFORMATIONS ORGANISATIONNELLES EN LECTURE
     structure_nom = serializers.CharField(source='structure.nom', read_only=True)
     structure_numero = serializers.CharField(source='structure.numero', read_only=True)
@@ -171,7 +173,7 @@ class ActiviteSerializer(serializers.ModelSerializer):
             'etat'
         ]
         
-class SuiviSerializer(serializers.ModelSerializer): 
+class SuiviSerializer(SerialisationMesuree, serializers.ModelSerializer): 
     activite_nom = serializers.CharField(source='activite.activite', read_only=True)
     activite_objectif = serializers.CharField(source='activite.objectif_general.titre', read_only=True)
     
@@ -185,4 +187,103 @@ class SuiviSerializer(serializers.ModelSerializer):
             'date_suivi',
             'observation',
             'avancement'
-        ]
\ No newline at end of file
+        ]
+
+# ✅ SOURCES DE FINANCEMENT ET CIBLES NORMALISÉES
+class SourceFinancementSerializer(SerialisationMesuree, serializers.ModelSerializer):
+    class Meta:
+        model = SourceFinancement
+        fields = ['id', 'nom']
+
+class CibleSerializer(SerialisationMesuree, serializers.ModelSerializer):
+    class Meta:
+        model = Cible
+        fields = ['id', 'nom']
+
+# ✅ PRÉVISIONS D'ACHÈVEMENT (LISTE DES ACTIVITÉS À RISQUE)
+class PrevisionActiviteSerializer(SerialisationMesuree, serializers.ModelSerializer):
+    structure_nom = serializers.CharField(source='structure.nom', read_only=True)
+    retard_prevu_jours = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Activite
+        fields = [
+            'id', 'activite', 'structure', 'structure_nom', 'etat', 'date_debut', 'date_fin',
+            'date_achevement_prevue', 'retard_prevu_jours', 'risque_retard', 'prevision_calculee_le',
+        ]
+        read_only_fields = fields
+
+    def get_retard_prevu_jours(self, obj):
+        if obj.date_achevement_prevue and obj.date_fin:
+            return (obj.date_achevement_prevue - obj.date_fin).days
+        return None
+
+# ✅ ANOMALIES BUDGÉTAIRES
+class AnomalieBudgetSerializer(SerialisationMesuree, serializers.ModelSerializer):
+    activite_nom = serializers.CharField(source='activite.activite', read_only=True)
+    structure = serializers.IntegerField(source='activite.structure_id', read_only=True)
+    pcop_code = serializers.CharField(source='pcop.code', read_only=True)
+    pcop_libelle = serializers.CharField(source='pcop.libelle', read_only=True)
+
+    class Meta:
+        model = AnomalieBudget
+        fields = [
+            'id', 'type', 'activite', 'activite_nom', 'structure', 'pcop', 'pcop_code', 'pcop_libelle',
+            'valeur', 'reference', 'score', 'mad', 'p10', 'p90', 'detectee_le',
+        ]
+        read_only_fields = fields
+
+# ✅ INSTANTANÉS FIGÉS DU PTA (les colonnes et statistiques ont leurs propres routes)
+class InstantanePTASerializer(SerialisationMesuree, serializers.ModelSerializer):
+    cree_par = serializers.CharField(source='cree_par.username', read_only=True, default=None)
+
+    class Meta:
+        model = InstantanePTA
+        fields = [
+            'id', 'nom', 'annee', 'description', 'cree_par', 'cree_le', 'version_donnees',
+            'nb_activites', 'montant_total', 'taille', 'empreinte',
+        ]
+        read_only_fields = ['cree_le', 'version_donnees', 'nb_activites', 'montant_total', 'taille', 'empreinte']
+        extra_kwargs = {'annee': {'required': False}}
+
+# ✅ TÂCHES D'ARRIÈRE-PLAN
+class JobSerializer(SerialisationMesuree, serializers.ModelSerializer):
+    fichier = serializers.FileField(source='fichier_entree', write_only=True, required=False)
+    url_telechargement = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'type', 'statut', 'parametres', 'fichier',
+            'progression', 'message', 'erreur', 'resultat', 'url_telechargement',
+            'cree_le', 'demarre_le', 'termine_le',
+        ]
+        read_only_fields = [
+            'statut', 'progression', 'message', 'erreur', 'resultat',
+            'cree_le', 'demarre_le', 'termine_le',
+        ]
+
+    def validate_type(self, value):
+        if value not in TACHES:
+            raise serializers.ValidationError(f"Type de tâche inconnu. Types disponibles : {', '.join(sorted(TACHES))}")
+        return value
+
+    def validate(self, attrs):
+        # Paramètres vérifiés et normalisés à la soumission : un job mal formé est refusé (400)
+        # au lieu d'échouer plus tard dans le worker
+        parametres = attrs.get('parametres') or {}
+        if not isinstance(parametres, dict):
+            raise serializers.ValidationError({'parametres': "Les paramètres doivent être un objet"})
+        valider = TACHES[attrs['type']].get('parametres')
+        try:
+            attrs['parametres'] = valider(parametres) if valider else {}
+        except ValueError as e:
+            raise serializers.ValidationError({'parametres': str(e)})
+        return attrs
+
+    def get_url_telechargement(self, obj):
+        if obj.statut != 'termine' or not obj.fichier_resultat:
+            return None
+        url = f"/api/jobs/{obj.pk}/telecharger/"
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
@@ -0,0 +1,189 @@
+"""
+Courbes d'avancement par semaine ou par mois, par nœud de l'organisation ou
+du cadre logique.
+
+Pour chaque période, l'avancement d'une activité est celui de son dernier
+suivi à la fin de la période (reporté tant qu'aucun nouveau suivi n'arrive) ;
+la courbe d'un groupe est la moyenne sur ses activités, celles sans suivi
+comptant pour 0.
+
+Tout est calculé en SQL, sans lire les suivis un à un :
+1. ROW_NUMBER() garde le dernier suivi de chaque activité par période ;
+2. LAG() en déduit la variation d'avancement de l'activité d'une période à l'autre ;
+3. SUM() OVER (ORDER BY période) cumule ces variations par groupe, ce qui
+   donne la somme des derniers avancements connus à chaque période.
+
+Le résultat d'une période ne dépend pas des autres périodes demandées : il
+est mis en cache période par période (cache Django), sous une clé qui
+inclut les versions des activités ('pta') et des suivis ('suivis').
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import Count, DateField, F, IntegerField, Value
+from django.db.models.functions import Greatest, TruncMonth, TruncWeek
+
+from .artefacts import cle_artefact
+from .filtres import filtrer_activites
+from .models import (
+    Activite, Direction, Division, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Service, Structure,
+    Suivi, version_donnees,
+)
+
+PAS = {'semaine': TruncWeek, 'mois': TruncMonth}
+
+NIVEAUX_SERIE = {
+    'structure': Structure,
+    'direction': Direction,
+    'service': Service,
+    'division': Division,
+    'objectif_general': ObjectifGeneral,
+    'objectif_specifique': ObjectifSpecifique,
+    'resultat_attendu': ResultatAttendu,
+}
+
+LIBELLE_NON_RATTACHE = "Non rattaché"
+
+
+def debut_periode(jour, pas):
+    if pas == 'semaine':
+        return jour - timedelta(days=jour.weekday())
+    return jour.replace(day=1)
+
+
+def periode_suivante(debut, pas):
+    if pas == 'semaine':
+        return debut + timedelta(days=7)
+    return date(debut.year + debut.month // 12, debut.month % 12 + 1, 1)
+
+
+def periodes(du, au, pas):
+    """Débuts des périodes (lundis ou premiers du mois) couvrant [du, au]."""
+    courant = debut_periode(du, pas)
+    resultat = []
+    while courant <= au:
+        resultat.append(courant)
+        courant = periode_suivante(courant, pas)
+    return resultat
+
+
+def _requete_cumuls(filtres, niveau, pas, du, au):
+    """
+    SQL (et paramètres) des cumuls par (groupe, période) pour les périodes de
+    [du, au]. Les suivis antérieurs à `du` sont ramenés à la première période :
+    ils fournissent l'avancement de départ.
+    """
+    debut = Value(debut_periode(du, pas), output_field=DateField())
+    base = filtrer_activites(
+        Suivi.objects.filter(avancement__isnull=False, date_suivi__lte=au), filtres, prefixe='activite__',
+    ).annotate(
+        s_groupe=F(f'activite__{niveau}') if niveau else Value(None, output_field=IntegerField()),
+        s_activite=F('activite'),
+        s_periode=PAS[pas](Greatest('date_suivi', debut, output_field=DateField())),
+        s_date=F('date_suivi'),
+        s_id=F('id'),
+        s_avancement=F('avancement'),
+    ).values('s_groupe', 's_activite', 's_periode', 's_date', 's_id', 's_avancement').order_by()
+    sous_requete, params = base.query.sql_with_params()
+    sql = (
+        "SELECT s_groupe, s_periode, SUM(variation), "
+        "SUM(SUM(variation)) OVER (PARTITION BY s_groupe ORDER BY s_periode) "
+        "FROM ("
+        "  SELECT s_groupe, s_periode, "
+        "  s_avancement - COALESCE(LAG(s_avancement) OVER (PARTITION BY s_activite ORDER BY s_periode), 0) AS variation "
+        "  FROM ("
+        "    SELECT s_groupe, s_activite, s_periode, s_avancement, "
+        "    ROW_NUMBER() OVER (PARTITION BY s_activite, s_periode ORDER BY s_date DESC, s_id DESC) AS rang "
+        f"    FROM ({sous_requete}) AS suivis"
+        "  ) AS derniers WHERE rang = 1"
+        ") AS variations "
+        "GROUP BY s_groupe, s_periode"
+    )
+    return sql, params
+
+
+def _en_date(valeur):
+    # SQLite renvoie les dates tronquées sous forme de texte
+    return valeur if isinstance(valeur, date) else date.fromisoformat(str(valeur)[:10])
+
+
+def calculer_cumuls(filtres, niveau, pas, du, au):
+    """{période: {groupe: somme des derniers avancements connus}} pour chaque période de [du, au]."""
+    sql, params = _requete_cumuls(filtres, niveau, pas, du, au)
+    lus = defaultdict(dict)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for groupe, periode, _, cumul in cursor.fetchall():
+            lus[_en_date(periode)][groupe] = int(cumul)
+
+    # Périodes sans aucun suivi dans un groupe : le dernier cumul est reporté
+    cumuls, courant = {}, {}
+    for periode in periodes(du, au, pas):
+        courant.update(lus.get(periode, {}))
+        cumuls[periode] = dict(courant)
+    return cumuls
+
+
+def _cle_periode(parametres, versions, periode):
+    return f"progression:{cle_artefact('progression', parametres, versions)}:{periode.isoformat()}"
+
+
+def cumuls_en_cache(filtres, niveau, pas, du, au):
+    """Cumuls par période, lus dans le cache ; seule la plage des périodes manquantes est recalculée."""
+    filtres = filtres or {}
+    parametres = {'filtres': filtres, 'niveau': niveau, 'pas': pas}
+    versions = f"{version_donnees()}.{version_donnees('suivis')}"
+    liste = periodes(du, au, pas)
+    cles = {periode: _cle_periode(parametres, versions, periode) for periode in liste}
+    en_cache = cache.get_many(cles.values())
+    manquantes = [periode for periode in liste if cles[periode] not in en_cache]
+    if manquantes:
+        # Jusqu'à la fin de la dernière période, même au-delà de `au` : la valeur d'une période
+        # (une semaine à cheval sur deux années...) ne dépend pas de la plage demandée
+        fin = periode_suivante(manquantes[-1], pas) - timedelta(days=1)
+        calcules = {
+            cles[periode]: cumul
+            for periode, cumul in calculer_cumuls(filtres, niveau, pas, manquantes[0], fin).items()
+        }
+        cache.set_many(calcules, getattr(settings, 'PROGRESSION_CACHE_DUREE', 24 * 3600))
+        en_cache.update(calcules)
+    return {periode: en_cache[cles[periode]] for periode in liste}
+
+
+def serie_progression(filtres=None, niveau=None, pas='mois', du=None, au=None):
+    """
+    Courbes d'avancement moyen : une série par groupe de `niveau` (ou une
+    seule série sans niveau), une valeur par période de [du, au].
+    """
+    filtres = filtres or {}
+    cumuls = cumuls_en_cache(filtres, niveau, pas, du, au)
+    activites = filtrer_activites(Activite.objects.all(), filtres)
+    if niveau:
+        nombres = dict(activites.values_list(niveau).annotate(nb=Count('id')).order_by())
+        modele = NIVEAUX_SERIE[niveau]
+        libelles = {objet.pk: str(objet) for objet in modele.objects.filter(pk__in=[g for g in nombres if g])}
+    else:
+        nombres = {None: activites.count()}
+        libelles = {}
+
+    series = []
+    for groupe, nombre in sorted(nombres.items(), key=lambda e: (e[0] is None, libelles.get(e[0], ''))):
+        if not nombre:
+            continue
+        series.append({
+            'id': groupe,
+            'libelle': libelles.get(groupe, LIBELLE_NON_RATTACHE if niveau else "Toutes les activités"),
+            'activites': nombre,
+            'avancement_moyen': [round(cumuls[periode].get(groupe, 0) / nombre, 1) for periode in cumuls],
+        })
+    return {
+        'pas': pas,
+        'niveau': niveau,
+        'du': du,
+        'au': au,
+        'periodes': list(cumuls),
+        'series': series,
+    }
@@ -0,0 +1,256 @@
+"""
+Simulation budgétaire « et si » sur le PTA, sans écriture en base.
+
+Un scénario est une liste de règles appliquées dans l'ordre, chacune
+combinant un filtre d'activités (mêmes critères que /api/activites/, hors
+période) et une modification du coût unitaire ou de la quantité :
+
+    {"filtres": {"pcop": [12]}, "champ": "cout_unitaire", "multiplicateur": 1.12}
+    {"filtres": {"direction": [3]}, "champ": "quantite", "multiplicateur": 0.8}
+    {"filtres": {"etat": ["En attente"]}, "champ": "quantite", "valeur": 1}
+
+Les règles s'appliquent à un instantané en colonnes des activités (tableaux
+NumPy : identifiants de rattachement, état, coût unitaire, quantité,
+montant). Le montant des activités touchées par une règle est recalculé
+(coût × quantité) avant et après application des règles : les écarts ne
+reflètent que le scénario, même si le montant enregistré était périmé ou
+absent. Ces corrections de montant enregistré sont comptées à part
+(montants_recalcules). Les totaux par structure, objectif, compte PCOP...
+sont obtenus par np.bincount et comparés aux totaux initiaux.
+
+L'instantané est gardé en mémoire du processus et réutilisé tant que la
+version des données ('pta') ne change pas : un scénario rejoué ne relit pas
+la base. Chaque worker garde sa propre copie (environ 50 octets par
+activité).
+"""
+import logging
+import math
+import threading
+
+from django.db import connection
+from django.db.models import FloatField
+from django.db.models.functions import Cast
+
+from .filtres import CHAMPS_FILTRE_ACTIVITE, lire_filtres_json
+from .models import Activite, PCOPEntry, version_donnees
+from .series import LIBELLE_NON_RATTACHE, NIVEAUX_SERIE
+
+logger = logging.getLogger(__name__)
+
+CHAMPS_SIMULES = ('cout_unitaire', 'quantite')
+NIVEAUX_SIMULATION = {**NIVEAUX_SERIE, 'pcop': PCOPEntry}
+NIVEAUX_DEFAUT = ('structure', 'objectif_general', 'pcop')
+MAX_REGLES = 50
+# Au-delà, un multiplicateur relève de l'erreur de saisie plus que du scénario
+MAX_MULTIPLICATEUR = 1000
+TAILLE_PAQUET = 50000
+# Écart de montant en deçà duquel un groupe est considéré comme inchangé (arrondis)
+ECART_NEGLIGEABLE = 0.005
+
+_verrou = threading.Lock()
+_instantane = None
+
+
+class Instantane:
+    """Colonnes des activités à une version donnée des données."""
+
+    def __init__(self, version, lignes, etats):
+        import numpy as np
+
+        self.version = version
+        self.ids = lignes[:, 0].astype(np.int64)
+        # Identifiants de rattachement en int32, -1 quand l'activité n'est pas rattachée
+        self.rattachements = {
+            champ: np.nan_to_num(lignes[:, 1 + i], nan=-1).astype(np.int32)
+            for i, champ in enumerate(CHAMPS_FILTRE_ACTIVITE)
+        }
+        n = 1 + len(CHAMPS_FILTRE_ACTIVITE)
+        self.cout_unitaire, self.quantite, self.montant = lignes[:, n], lignes[:, n + 1], lignes[:, n + 2]
+        self.libelles_etats, self.etats = np.unique(np.asarray(etats, dtype=str), return_inverse=True)
+        self._groupes = {}
+
+    def __len__(self):
+        return len(self.ids)
+
+    def masque(self, filtres):
+        """Activités retenues par des filtres normalisés (voir lire_filtres_activites)."""
+        import numpy as np
+
+        masque = np.ones(len(self), dtype=bool)
+        for champ in CHAMPS_FILTRE_ACTIVITE:
+            if champ in filtres:
+                masque &= np.isin(self.rattachements[champ], filtres[champ])
+        if 'etat' in filtres:
+            masque &= np.isin(self.etats, np.flatnonzero(np.isin(self.libelles_etats, filtres['etat'])))
+        return masque
+
+    def groupes(self, niveau):
+        """(identifiants distincts, indice du groupe de chaque activité) pour un niveau de regroupement."""
+        import numpy as np
+
+        if niveau not in self._groupes:
+            self._groupes[niveau] = np.unique(self.rattachements[niveau], return_inverse=True)
+        return self._groupes[niveau]
+
+
+def charger_instantane(version):
+    import numpy as np
+
+    queryset = Activite.objects.order_by().values_list(
+        'id', *(f'{champ}_id' for champ in CHAMPS_FILTRE_ACTIVITE),
+        *(Cast(champ, FloatField()) for champ in ('cout_unitaire', 'quantite', 'montant')),
+        'etat',
+    )
+    sql, params = queryset.query.sql_with_params()
+    paquets, etats = [], []
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        while lignes := cursor.fetchmany(TAILLE_PAQUET):
+            colonnes = np.array(lignes, dtype=object)
+            paquets.append(colonnes[:, :-1].astype(float))
+            etats.append(colonnes[:, -1])
+    lignes = np.concatenate(paquets) if paquets else np.empty((0, len(CHAMPS_FILTRE_ACTIVITE) + 4))
+    etats = np.concatenate(etats) if etats else np.empty(0, dtype=object)
+    logger.info(f"Instantané de simulation chargé : {len(lignes)} activités (version {version})")
+    return Instantane(version, lignes, etats)
+
+
+def instantane():
+    """Instantané de la version courante des données, rechargé seulement si elle a changé."""
+    global _instantane
+    version = version_donnees()
+    courant = _instantane
+    if courant is not None and courant.version == version:
+        return courant
+    with _verrou:
+        if _instantane is None or _instantane.version != version:
+            _instantane = charger_instantane(version)
+        return _instantane
+
+
+def lire_regles(regles):
+    """Valide les règles d'un scénario ; lève ValueError avec un message destiné à l'utilisateur."""
+    if not isinstance(regles, list) or not regles:
+        raise ValueError("Le champ regles doit être une liste non vide")
+    if len(regles) > MAX_REGLES:
+        raise ValueError(f"Un scénario compte au plus {MAX_REGLES} règles")
+    lues = []
+    for numero, regle in enumerate(regles, 1):
+        if not isinstance(regle, dict):
+            raise ValueError(f"Règle {numero} : objet attendu")
+        champ = regle.get('champ')
+        if champ not in CHAMPS_SIMULES:
+            raise ValueError(f"Règle {numero} : champ invalide (valeurs possibles : {', '.join(CHAMPS_SIMULES)})")
+        if ('multiplicateur' in regle) == ('valeur' in regle):
+            raise ValueError(f"Règle {numero} : indiquez soit multiplicateur, soit valeur")
+        operation = 'multiplicateur' if 'multiplicateur' in regle else 'valeur'
+        try:
+            nombre = float(regle[operation])
+        except (TypeError, ValueError):
+            raise ValueError(f"Règle {numero} : {operation} doit être un nombre")
+        if not math.isfinite(nombre):
+            raise ValueError(f"Règle {numero} : {operation} doit être un nombre fini")
+        if nombre < 0:
+            raise ValueError(f"Règle {numero} : {operation} ne peut pas être négatif")
+        if operation == 'multiplicateur' and nombre > MAX_MULTIPLICATEUR:
+            raise ValueError(f"Règle {numero} : le multiplicateur ne peut pas dépasser {MAX_MULTIPLICATEUR}")
+        if operation == 'valeur' and nombre >= _borne(champ):
+            raise ValueError(f"Règle {numero} : valeur hors limites pour {champ} (moins de {_borne(champ):.0f})")
+
+        filtres = regle.get('filtres') or {}
+        if not isinstance(filtres, dict):
+            raise ValueError(f"Règle {numero} : filtres doit être un objet")
+        if {'du', 'au'} & set(filtres):
+            raise ValueError(f"Règle {numero} : les règles ne filtrent pas par période")
+        # Mêmes critères que les paramètres de /api/activites/, listes JSON acceptées
+        filtres = lire_filtres_json(filtres)
+        lues.append({'filtres': filtres, 'champ': champ, operation: nombre})
+    return lues
+
+
+def _borne(champ):
+    """Première valeur absolue que le DecimalField `champ` d'Activite ne peut plus enregistrer."""
+    champ = Activite._meta.get_field(champ)
+    return 10.0 ** (champ.max_digits - champ.decimal_places)
+
+
+def _totaux(donnees, niveau, initial, simule):
+    import numpy as np
+
+    ids, groupes = donnees.groupes(niveau)
+    avant = np.bincount(groupes, initial, len(ids))
+    apres = np.bincount(groupes, simule, len(ids))
+    ecarts = apres - avant
+    modifies = np.flatnonzero(np.abs(ecarts) >= ECART_NEGLIGEABLE)
+    modifies = modifies[np.argsort(-np.abs(ecarts[modifies]), kind='stable')]
+
+    modele = NIVEAUX_SIMULATION[niveau]
+    identifiants = [int(ids[i]) for i in modifies if ids[i] >= 0]
+    libelles = {objet.pk: str(objet) for objet in modele.objects.filter(pk__in=identifiants)}
+    return [
+        {
+            'id': int(ids[i]) if ids[i] >= 0 else None,
+            'libelle': libelles.get(int(ids[i]), LIBELLE_NON_RATTACHE),
+            **_bilan(avant[i], apres[i]),
+        }
+        for i in modifies
+    ]
+
+
+def _bilan(avant, apres):
+    return {
+        'montant_initial': round(float(avant), 2),
+        'montant_simule': round(float(apres), 2),
+        'ecart': round(float(apres - avant), 2),
+        'ecart_pct': round(float((apres - avant) / avant * 100), 2) if avant else None,
+    }
+
+
+def simuler(regles, niveaux=NIVEAUX_DEFAUT):
+    """
+    Applique les règles (déjà validées par lire_regles) à l'instantané et
+    retourne les écarts de montant : total, par règle et par niveau. Lève
+    ValueError si un montant simulé ne tiendrait pas dans Activite.montant.
+    """
+    import numpy as np
+
+    donnees = instantane()
+    cout_unitaire = donnees.cout_unitaire.copy()
+    quantite = donnees.quantite.copy()
+    modifiees = np.zeros(len(donnees), dtype=bool)
+    activites_par_regle = []
+    for regle in regles:
+        masque = donnees.masque(regle['filtres'])
+        colonne = cout_unitaire if regle['champ'] == 'cout_unitaire' else quantite
+        if 'multiplicateur' in regle:
+            colonne[masque] *= regle['multiplicateur']
+        else:
+            colonne[masque] = regle['valeur']
+        modifiees |= masque
+        activites_par_regle.append(int(masque.sum()))
+
+    # Montant recalculé pour les activités touchées dont le coût et la quantité sont connus,
+    # avant comme après les règles : un montant enregistré incohérent ne compte pas comme un écart simulé
+    recalcul = modifiees & ~np.isnan(cout_unitaire) & ~np.isnan(quantite)
+    enregistre = np.nan_to_num(donnees.montant)
+    initial = enregistre.copy()
+    initial[recalcul] = np.round(donnees.cout_unitaire[recalcul] * donnees.quantite[recalcul], 2)
+    simule = initial.copy()
+    simule[recalcul] = np.round(cout_unitaire[recalcul] * quantite[recalcul], 2)
+    corrections = initial[recalcul] - enregistre[recalcul]
+    if recalcul.any() and np.abs(simule[recalcul]).max() >= _borne('montant'):
+        raise ValueError("Le scénario produit des montants hors limites (coût unitaire × quantité trop grand)")
+
+    return {
+        'version': donnees.version,
+        'activites': len(donnees),
+        'activites_modifiees': int(np.count_nonzero(simule != initial)),
+        'total': _bilan(initial.sum(), simule.sum()),
+        # Montants enregistrés différents de coût × quantité parmi les activités touchées
+        'montants_recalcules': {
+            'activites': int(np.count_nonzero(np.abs(corrections) >= ECART_NEGLIGEABLE)),
+            'ecart': round(float(corrections.sum()), 2),
+        },
+        'regles': [{'activites': nombre} for nombre in activites_par_regle],
+        'niveaux': {niveau: _totaux(donnees, niveau, initial, simule) for niveau in niveaux},
+    }
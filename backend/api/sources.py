@@ -0,0 +1,193 @@
+"""
+Source de lignes commune aux exports du PTA (classeur Excel, CSV, Parquet).
+
+Les activités sont lues par paquets (`.iterator(chunk_size=...)`) en ne
+projetant que les colonnes utiles (`.values_list`) : pas d'instances de
+modèle ni de cache de queryset, la mémoire reste bornée quelle que soit la
+taille du PTA. Les totaux sont calculés par la base, en Decimal exacts.
+"""
+from decimal import Decimal
+
+from django.db import connection
+from django.db.models import Count, F, Sum
+
+from .filtres import filtrer_activites
+from .models import Activite
+
+# Nombre d'activités lues par aller-retour avec la base
+TAILLE_PAQUET = 2000
+
+CENTIMES = Decimal('0.01')
+
+# Colonnes lues en base pour construire une ligne de PTA_PRINCIPAL
+CHAMPS_LIGNE_PTA = (
+    'objectif_general', 'objectif_general__titre',
+    'objectif_specifique', 'objectif_specifique__titre',
+    'resultat_attendu', 'resultat_attendu__description',
+    'structure', 'structure__numero', 'structure__nom',
+    'direction', 'direction__numero', 'direction__nom',
+    'service', 'service__numero', 'service__nom_service',
+    'division', 'division__numero', 'division__nom',
+    'activite', 'sous_activite', 'produits', 'cibles', 'sources_financement',
+    'pcop', 'pcop__code', 'pcop__libelle',
+    'cout_unitaire', 'quantite', 'montant', 'observation', 'etat',
+)
+
+
+def activites_filtrees(filtres=None):
+    return filtrer_activites(Activite.objects.all(), filtres or {})
+
+
+def ligne_pta(valeurs):
+    """Met en forme une ligne lue en base comme une ligne de PTA_PRINCIPAL (montants en Decimal)."""
+    (og, og_titre, os_, os_titre, ra, ra_description,
+     structure, structure_numero, structure_nom,
+     direction, direction_numero, direction_nom,
+     service, service_numero, service_nom,
+     division, division_numero, division_nom,
+     activite, sous_activite, produits, cibles, sources_financement,
+     pcop, pcop_code, pcop_libelle,
+     cout_unitaire, quantite, montant, observation, etat) = valeurs
+    zero = Decimal('0.00')
+    return [
+        og_titre if og else "Non spécifié",
+        os_titre if os_ else "Non spécifié",
+        ra_description if ra else "Non spécifié",
+        f"{structure_numero} - {structure_nom}" if structure else "Non spécifié",
+        f"{direction_numero} - {direction_nom}" if direction else "Non spécifié",
+        f"{service_numero} - {service_nom}" if service else "Non assigné",
+        f"{division_numero} - {division_nom}" if division else "Non spécifié",
+        activite or "Non spécifié",
+        sous_activite or "Non spécifié",
+        produits or "Non spécifié",
+        cibles or "Non spécifié",
+        sources_financement or "Non spécifié",
+        pcop_code if pcop else "Non spécifié",
+        pcop_libelle if pcop else "Non spécifié",
+        cout_unitaire or zero,
+        quantite or zero,
+        montant or zero,
+        observation or "Aucune",
+        etat or "En cours",
+    ]
+
+
+def lignes_pta(filtres=None, chunk_size=TAILLE_PAQUET):
+    """Itère sur les lignes de PTA_PRINCIPAL, dans l'ordre des activités."""
+    valeurs = activites_filtrees(filtres).order_by('id').values_list(*CHAMPS_LIGNE_PTA)
+    for ligne in valeurs.iterator(chunk_size=chunk_size):
+        yield ligne_pta(ligne)
+
+
+def totaux_pta(filtres=None):
+    """Nombre d'activités et montant total, calculés par la base."""
+    totaux = activites_filtrees(filtres).aggregate(nb=Count('id'), montant=Sum('montant'))
+    totaux['montant'] = (totaux['montant'] or Decimal('0')).quantize(CENTIMES)
+    return totaux
+
+
+def comptes_par(filtres, champ):
+    """Nombre d'activités par valeur de `champ` (clé étrangère), en une requête groupée."""
+    return dict(
+        activites_filtrees(filtres).filter(**{f'{champ}__isnull': False})
+        .values_list(champ).annotate(nb=Count('id')).order_by()
+    )
+
+
+# ---------- SOUS-TOTAUX STRUCTURE → DIRECTION → SERVICE ----------
+NIVEAUX_SOUS_TOTAUX = ('structure', 'direction', 'service')
+
+# Valeur de GROUPING(structure, direction, service) pour chaque niveau de sous-total
+GROUPING_NIVEAUX = {0: 'service', 1: 'direction', 3: 'structure', 7: 'total'}
+
+
+def _requete_sous_totaux(filtres):
+    """SQL (et paramètres) des sous-totaux de tous les niveaux en une seule requête."""
+    base = activites_filtrees(filtres).annotate(
+        g_structure=F('structure'), g_direction=F('direction'), g_service=F('service'), g_montant=F('montant'),
+    ).values('g_structure', 'g_direction', 'g_service', 'g_montant').order_by()
+    sous_requete, params = base.query.sql_with_params()
+
+    if connection.vendor == 'postgresql':
+        sql = (
+            "SELECT g_structure, g_direction, g_service, "
+            "GROUPING(g_structure, g_direction, g_service), COUNT(*), SUM(g_montant) "
+            f"FROM ({sous_requete}) AS lignes GROUP BY ROLLUP (g_structure, g_direction, g_service)"
+        )
+        return sql, params
+
+    # Sans ROLLUP (SQLite) : union des quatre regroupements, mêmes codes que GROUPING()
+    regroupements = (
+        ('g_structure, g_direction, g_service', 'g_structure, g_direction, g_service', 0),
+        ('g_structure, g_direction, NULL', 'g_structure, g_direction', 1),
+        ('g_structure, NULL, NULL', 'g_structure', 3),
+        ('NULL, NULL, NULL', None, 7),
+    )
+    parties = []
+    for colonnes, group_by, grouping in regroupements:
+        partie = f"SELECT {colonnes}, {grouping}, COUNT(*), SUM(g_montant) FROM ({sous_requete}) AS lignes"
+        if group_by:
+            partie += f" GROUP BY {group_by}"
+        parties.append(partie)
+    return " UNION ALL ".join(parties), params * len(parties)
+
+
+def sous_totaux_pta(filtres=None):
+    """
+    Sous-totaux par service, direction et structure, plus le total général :
+    {(niveau, (structure, direction, service)): (nb, montant)}. Les identifiants
+    des niveaux regroupés valent None, ceux des activités non rattachées aussi.
+    """
+    sql, params = _requete_sous_totaux(filtres)
+    sous_totaux = {}
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        for structure, direction, service, grouping, nb, montant in cursor.fetchall():
+            niveau = GROUPING_NIVEAUX[grouping]
+            montant = Decimal(str(montant or 0)).quantize(CENTIMES)
+            sous_totaux[(niveau, (structure, direction, service))] = (nb, montant)
+    return sous_totaux
+
+
+def lignes_pta_groupees(filtres=None, chunk_size=TAILLE_PAQUET, sous_totaux=None):
+    """
+    Lignes de PTA_PRINCIPAL triées par structure, direction puis service, avec
+    une ligne de sous-total à la fin de chaque groupe et le total général à la
+    fin. Produit ('activite', ligne) ou (niveau, libellé, nb, montant), en un
+    seul passage sur le flux ordonné.
+    """
+    if sous_totaux is None:
+        sous_totaux = sous_totaux_pta(filtres)
+    ordre = []
+    for niveau in NIVEAUX_SOUS_TOTAUX:
+        ordre += [F(f'{niveau}__numero').asc(nulls_last=True), F(niveau).asc(nulls_last=True)]
+    valeurs = activites_filtrees(filtres).order_by(*ordre, 'id').values_list(*CHAMPS_LIGNE_PTA)
+
+    # Position, dans CHAMPS_LIGNE_PTA, de la clé et dans la ligne formatée, du libellé de chaque niveau
+    index_cles = [CHAMPS_LIGNE_PTA.index(niveau) for niveau in NIVEAUX_SOUS_TOTAUX]
+    index_libelles = (3, 4, 5)
+
+    def cloture(profondeur, cle, libelles):
+        """Sous-totaux des niveaux fermés, du plus fin au plus large."""
+        for rang in range(len(NIVEAUX_SOUS_TOTAUX) - 1, profondeur - 1, -1):
+            niveau = NIVEAUX_SOUS_TOTAUX[rang]
+            cle_niveau = cle[:rang + 1] + (None,) * (len(NIVEAUX_SOUS_TOTAUX) - rang - 1)
+            nb, montant = sous_totaux[(niveau, cle_niveau)]
+            yield niveau, libelles[rang], nb, montant
+
+    cle_courante = libelles_courants = None
+    for valeurs_ligne in valeurs.iterator(chunk_size=chunk_size):
+        ligne = ligne_pta(valeurs_ligne)
+        cle = tuple(valeurs_ligne[i] for i in index_cles)
+        if cle != cle_courante:
+            if cle_courante is not None:
+                profondeur = next(rang for rang in range(len(cle)) if cle[rang] != cle_courante[rang])
+                yield from cloture(profondeur, cle_courante, libelles_courants)
+            cle_courante = cle
+            libelles_courants = [ligne[i] for i in index_libelles]
+        yield 'activite', ligne
+
+    if cle_courante is not None:
+        yield from cloture(0, cle_courante, libelles_courants)
+    nb, montant = sous_totaux.get(('total', (None, None, None)), (0, Decimal('0.00')))
+    yield 'total', "TOTAL GÉNÉRAL", nb, montant
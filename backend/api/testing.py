@@ -0,0 +1,119 @@
+"""
+Outils de test : détection des requêtes SQL dont le nombre dépend du volume
+de données (N+1) et des plans d'exécution qui parcourent une table entière.
+"""
+import re
+from contextlib import contextmanager
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+# Parcours complet d'une table dans la sortie d'EXPLAIN (SQLite : « SCAN t » sans index)
+MOTIFS_PARCOURS_SEQUENTIEL = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)(?: AS \w+)?\s*$', re.MULTILINE),
+}
+
+
+class RequetesConstantesMixin:
+    """
+    Mixin de TestCase. `assertRequetesIndependantesDuVolume(appel, creer_lignes)`
+    exécute `appel()` après avoir créé successivement plusieurs volumes de
+    lignes avec `creer_lignes(n)`, et échoue si le nombre de requêtes SQL varie.
+    """
+
+    volumes_requetes = (1, 5)
+
+    def assertRequetesIndependantesDuVolume(self, appel, creer_lignes, volumes=None):
+        volumes = volumes or self.volumes_requetes
+        deja_crees = 0
+        mesures = []
+        for volume in volumes:
+            creer_lignes(volume - deja_crees)
+            deja_crees = volume
+            if not mesures:
+                # Appel d'amorçage non mesuré : caches par utilisateur ou par processus (profil, etc.)
+                appel()
+            with CaptureQueriesContext(connection) as contexte:
+                appel()
+            mesures.append((volume, contexte.captured_queries))
+
+        comptes = {volume: len(requetes) for volume, requetes in mesures}
+        if len(set(comptes.values())) > 1:
+            volume, requetes = mesures[-1]
+            detail = "\n".join(f"  {i}. {requete['sql']}" for i, requete in enumerate(requetes, 1))
+            self.fail(
+                f"Le nombre de requêtes SQL dépend du volume de données "
+                f"(lignes -> requêtes : {comptes}).\nRequêtes pour {volume} lignes :\n{detail}"
+            )
+        return comptes[volumes[0]]
+
+
+class PlansRequetesMixin:
+    """
+    Mixin de TestCase. `assertSansParcoursSequentiel(requete, autorisees)`
+    échoue si le plan d'exécution de `requete` (queryset, ou couple SQL /
+    paramètres) parcourt entièrement une table absente de `autorisees`.
+
+    Sur PostgreSQL, les parcours séquentiels sont désactivés le temps de
+    l'EXPLAIN : sur une base de test, le planificateur les préfère souvent à
+    un index même quand celui-ci existe ; il n'en reste donc que là où aucun
+    index ne peut servir la requête.
+    """
+
+    @contextmanager
+    def _sans_parcours_sequentiel(self):
+        if connection.vendor != 'postgresql':
+            yield
+            return
+        with connection.cursor() as cursor:
+            cursor.execute("SET enable_seqscan = off")
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute("RESET enable_seqscan")
+
+    def plan_requete(self, requete):
+        """Plan EXPLAIN d'un queryset ou d'une requête SQL complète (telle que capturée)."""
+        with self._sans_parcours_sequentiel():
+            if isinstance(requete, str):
+                prefixe = 'EXPLAIN QUERY PLAN' if connection.vendor == 'sqlite' else 'EXPLAIN'
+                with connection.cursor() as cursor:
+                    cursor.execute(f"{prefixe} {requete}")
+                    return "\n".join(" ".join(str(colonne) for colonne in ligne) for ligne in cursor.fetchall())
+            return requete.explain()
+
+    def parcours_sequentiels(self, requete):
+        """(SQL, plan, tables parcourues entièrement) d'un queryset ou d'une requête SQL."""
+        motif = MOTIFS_PARCOURS_SEQUENTIEL.get(connection.vendor)
+        if motif is None:
+            self.skipTest(f"Lecture des plans non prise en charge pour {connection.vendor}")
+        plan = self.plan_requete(requete)
+        return (requete if isinstance(requete, str) else str(requete.query)), plan, set(motif.findall(plan))
+
+    def assertSansParcoursSequentiel(self, requete, autorisees=()):
+        sql, plan, tables = self.parcours_sequentiels(requete)
+        self._verifier_parcours(sql, plan, tables - set(autorisees))
+        return plan
+
+    def assertAppelSansParcoursSequentiel(self, appel, autorisees=()):
+        """
+        Vérifie le plan de chaque SELECT exécuté par `appel()` ; retourne pour
+        chacun (SQL, plan, tables parcourues entièrement, autorisées comprises).
+        """
+        with CaptureQueriesContext(connection) as contexte:
+            appel()
+        analyses = []
+        for requete in contexte.captured_queries:
+            if requete['sql'].lstrip().upper().startswith(('SELECT', 'WITH')):
+                sql, plan, tables = self.parcours_sequentiels(requete['sql'])
+                self._verifier_parcours(sql, plan, tables - set(autorisees))
+                analyses.append((sql, plan, tables))
+        return analyses
+
+    def _verifier_parcours(self, sql, plan, tables):
+        if tables:
+            self.fail(
+                f"Parcours séquentiel de {', '.join(sorted(tables))}.\nRequête :\n  {sql}\nPlan :\n{plan}"
+            )
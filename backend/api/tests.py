@@ -1,3 +1,1283 @@
-from django.test import TestCase
+import csv
+import hashlib
+import io
+import os
+import pstats
+import re
+import sys
+import tempfile
+import threading
+import zipfile
+from datetime import date, timedelta
+from decimal import Decimal
+from itertools import count
+from unittest import mock
 
-# Create your tests here.
+import openpyxl
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection
+from django.http import HttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from .anomalies import analyser_budgets, statistiques_par_compte
+from .artefacts import reponse_fichier
+from . import instantanes, jobs, metriques, paquets, profilage, requetes_lentes, simulation
+from .benchmark import comparer
+from .charge import centile, rapport_charge
+from .dimensions import cle_dimension, decouper
+from .exports import HEADERS_PTA, construire_classeur_pta, ecrire_parquet_pta, flux_csv_pta
+from .generation import generer_pta
+from .imports import aplatir_arbre, importer_cadre_logique, importer_pcop
+from .models import (
+    Activite, AnomalieBudget, Cible, Direction, Division, InstantanePTA, Job, ObjectifGeneral, ObjectifSpecifique, PCOPEntry,
+    PCOPImportLigne, ResultatAttendu, Service, SourceFinancement, Structure, Suivi, UserProfile, version_donnees,
+)
+from .previsions import ajuster_droites, calculer_previsions, prevoir
+from .series import serie_progression
+from .sources import lignes_pta
+from .testing import PlansRequetesMixin, RequetesConstantesMixin
+from .views import ActiviteViewSet, SuiviViewSet
+
+_numeros = count(1)
+
+
+def creer_activites(nombre):
+    """Crée `nombre` activités rattachées chacune à une structure et un objectif distincts."""
+    for _ in range(nombre):
+        n = next(_numeros)
+        structure = Structure.objects.create(numero=f"ST{n}", nom=f"Structure {n}")
+        direction = Direction.objects.create(structure=structure, numero="D1", nom=f"Direction {n}")
+        service = Service.objects.create(direction=direction, numero="S1", nom_service=f"Service {n}")
+        division = Division.objects.create(service=service, numero="DV1", nom=f"Division {n}")
+        og = ObjectifGeneral.objects.create(numero=f"OG{n}", titre=f"Objectif {n}")
+        os_ = ObjectifSpecifique.objects.create(objectif_general=og, numero=f"OS{n}", titre=f"Spécifique {n}")
+        ra = ResultatAttendu.objects.create(objectif_specifique=os_, numero=f"RA{n}", description=f"Résultat {n}")
+        pcop = PCOPEntry.objects.create(code=f"60{n}", libelle=f"Compte {n}")
+        Activite.objects.create(
+            activite=f"Activité {n}", structure=structure, direction=direction, service=service,
+            division=division, objectif_general=og, objectif_specifique=os_, resultat_attendu=ra,
+            pcop=pcop, cout_unitaire=Decimal('10.50'), quantite=Decimal('3'), montant=Decimal('31.50'),
+        )
+
+
+def creer_suivis(nombre):
+    """Crée `nombre` activités ayant chacune deux suivis."""
+    for _ in range(nombre):
+        creer_activites(1)
+        activite = Activite.objects.latest('id')
+        for jour in (1, 15):
+            Suivi.objects.create(activite=activite, date_suivi=date(2025, 3, jour), avancement=jour * 2)
+
+
+class RequetesSQLTests(RequetesConstantesMixin, TestCase):
+    """Le nombre de requêtes des listes et exports ne doit pas dépendre du nombre de lignes."""
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        if response.streaming:
+            b''.join(response.streaming_content)
+        return response
+
+    def test_liste_activites(self):
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/activites/'), creer_activites)
+
+    def test_liste_structures(self):
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/structures/'), creer_activites)
+
+    def test_liste_objectifs_generaux(self):
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/objectifs-generaux/'), creer_activites)
+
+    def test_export_csv(self):
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/export-csv/'), creer_activites)
+
+    def test_liste_suivis(self):
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/suivis/'), creer_suivis)
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/suivis/?page_size=3'), creer_suivis)
+
+    def test_tableau_de_bord(self):
+        self.assertRequetesIndependantesDuVolume(lambda: self.get('/api/dashboard-stats/'), creer_activites)
+
+    def test_classeur_pta(self):
+        self.assertRequetesIndependantesDuVolume(construire_classeur_pta, creer_activites)
+        self.assertRequetesIndependantesDuVolume(lambda: construire_classeur_pta(sous_totaux=True), creer_activites)
+
+    def test_detection_n_plus_un(self):
+        # Une boucle qui interroge la base par ligne doit être signalée
+        def n_plus_un():
+            for activite in Activite.objects.all():
+                activite.structure.nom
+
+        with self.assertRaises(AssertionError):
+            self.assertRequetesIndependantesDuVolume(n_plus_un, creer_activites)
+
+
+class ExportsTests(TestCase):
+    """Contenu des exports du PTA (classeur, CSV, Parquet, paquets ZIP)."""
+
+    def setUp(self):
+        # Artefacts d'export écrits dans un répertoire jetable
+        repertoire = tempfile.TemporaryDirectory()
+        self.addCleanup(repertoire.cleanup)
+        reglages = self.settings(MEDIA_ROOT=repertoire.name)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        nord = Structure.objects.create(numero='ST1', nom="Nord")
+        sud = Structure.objects.create(numero='ST2', nom="Sud")
+        budget = Direction.objects.create(structure=nord, numero='D1', nom="Budget")
+        informatique = Direction.objects.create(structure=nord, numero='D2', nom="Informatique")
+        budget_sud = Direction.objects.create(structure=sud, numero='D1', nom="Budget")
+        paie = Service.objects.create(direction=budget, numero='S1', nom_service="Paie")
+        achats = Service.objects.create(direction=budget, numero='S2', nom_service="Achats")
+        self.structures = (nord, sud)
+        for structure, direction, service, montant in (
+            (nord, budget, paie, '10.10'), (nord, budget, paie, '20.20'), (nord, budget, achats, '5.05'),
+            (nord, budget, None, '1.01'), (nord, informatique, None, '2.02'), (nord, None, None, '3.03'),
+            (sud, budget_sud, None, '4.04'), (sud, budget_sud, None, '6.06'), (None, None, None, '7.07'),
+        ):
+            Activite.objects.create(
+                activite=f"Activité {montant}", structure=structure, direction=direction, service=service,
+                date_debut=date(2025, 1, 1), date_fin=date(2025, 12, 31),
+                cout_unitaire=Decimal(montant), quantite=Decimal('1'), montant=Decimal(montant),
+            )
+
+    def lignes_principales(self, **options):
+        classeur, _ = construire_classeur_pta(**options)
+        feuille = classeur['PTA_PRINCIPAL']
+        return [[cellule.value for cellule in ligne] for ligne in feuille.iter_rows(min_row=5)]
+
+    def test_sous_totaux(self):
+        lignes = self.lignes_principales(sous_totaux=True)
+        # Colonne du libellé de chaque niveau dans une ligne d'activité
+        colonnes = {'SERVICE': 5, 'DIRECTION': 4, 'STRUCTURE': 3}
+        niveaux = ('SERVICE', 'DIRECTION', 'STRUCTURE', 'TOTAL')
+        en_cours = {niveau: [] for niveau in niveaux}
+        sequence = []
+        for ligne in lignes:
+            montant = ligne[16]
+            if not str(ligne[0]).startswith(('SOUS-TOTAL', 'TOTAL')):
+                for niveau in niveaux:
+                    en_cours[niveau].append(ligne)
+                sequence.append(('activite', montant))
+                continue
+            if ligne[0].startswith('TOTAL'):
+                niveau, libelle, nb = 'TOTAL', None, int(re.search(r'\((\d+) activités\)', ligne[0]).group(1))
+            else:
+                niveau, libelle, nb = re.fullmatch(r'SOUS-TOTAL (\w+) (.*) \((\d+) activités\)', ligne[0]).groups()
+            sequence.append((niveau.lower(), montant))
+            detail = en_cours[niveau]
+            # Chaque sous-total suit immédiatement ses activités : les niveaux plus fins sont déjà clos
+            self.assertTrue(all(not en_cours[n] for n in niveaux[:niveaux.index(niveau)]), ligne[0])
+            self.assertEqual((int(nb), montant), (len(detail), sum(d[16] for d in detail)), ligne[0])
+            if libelle is not None:
+                self.assertEqual({d[colonnes[niveau]] for d in detail}, {libelle}, ligne[0])
+            detail.clear()
+        self.assertTrue(all(not detail for detail in en_cours.values()))
+
+        d = Decimal
+        self.assertEqual(sequence, [
+            ('activite', d('10.10')), ('activite', d('20.20')), ('service', d('30.30')),
+            ('activite', d('5.05')), ('service', d('5.05')),
+            ('activite', d('1.01')), ('service', d('1.01')), ('direction', d('36.36')),
+            ('activite', d('2.02')), ('service', d('2.02')), ('direction', d('2.02')),
+            ('activite', d('3.03')), ('service', d('3.03')), ('direction', d('3.03')), ('structure', d('41.41')),
+            ('activite', d('4.04')), ('activite', d('6.06')),
+            ('service', d('10.10')), ('direction', d('10.10')), ('structure', d('10.10')),
+            ('activite', d('7.07')), ('service', d('7.07')), ('direction', d('7.07')), ('structure', d('7.07')),
+            ('total', d('58.58')),
+        ])
+
+
+    def test_exports_filtres(self):
+        nord = self.structures[0]
+        # Activité du Nord hors période : écartée par du / au
+        Activite.objects.filter(montant=Decimal('3.03')).update(
+            date_debut=date(2024, 1, 1), date_fin=date(2024, 12, 31),
+        )
+        attendues = ["Activité 1.01", "Activité 10.10", "Activité 2.02", "Activité 20.20", "Activité 5.05"]
+        parametres = f'?structure={nord.pk}&du=2025-01-01&au=2025-12-31'
+
+        reponse = self.client.get(f'/api/export-excel/{parametres}')
+        self.assertEqual(reponse.status_code, 200)
+        self.assertIn('PTA_Export_Filtre', reponse['Content-Disposition'])
+        feuille = openpyxl.load_workbook(io.BytesIO(b''.join(reponse.streaming_content)))['PTA_PRINCIPAL']
+        self.assertIn('FILTRÉ', feuille['A1'].value)
+        lignes = [ligne for ligne in feuille.iter_rows(min_row=5, values_only=True)]
+        self.assertEqual(sorted(ligne[7] for ligne in lignes[:-1]), attendues)
+        self.assertEqual((lignes[-1][0], lignes[-1][16]), ("TOTAL GÉNÉRAL (5 activités)", 38.38))
+
+        # Artefact distinct de l'export complet : clé de cache (ETag) et fichier différents
+        complet = self.client.get('/api/export-excel/')
+        self.assertNotEqual(complet['ETag'], reponse['ETag'])
+        self.assertEqual(len(os.listdir(os.path.join(settings.MEDIA_ROOT, 'exports'))), 2)
+        # Mêmes filtres dans un autre ordre : même artefact
+        meme_filtre = self.client.get(f'/api/export-excel/?au=2025-12-31&du=2025-01-01&structure={nord.pk}')
+        self.assertEqual(meme_filtre['ETag'], reponse['ETag'])
+
+        reponse = self.client.get(f'/api/export-csv/{parametres}')
+        lignes = list(csv.reader(io.StringIO(b''.join(reponse.streaming_content).decode('utf-8-sig'))))
+        self.assertEqual(sorted(ligne[7] for ligne in lignes[1:]), attendues)
+
+
+    def test_paquet_par_structure(self):
+        # Même nom de fichier que « ST1 - Nord » une fois passé par slugify
+        homonyme = Structure.objects.create(numero='st1', nom="NORD")
+        Activite.objects.create(activite="Activité homonyme", structure=homonyme, montant=Decimal('1'))
+
+        tampon = io.BytesIO()
+        contenu = paquets.construire_paquet(tampon, 'structure', processus=1)
+        with zipfile.ZipFile(tampon) as archive:
+            noms = archive.namelist()
+            lignes = {
+                nom: list(openpyxl.load_workbook(io.BytesIO(archive.read(nom)))['PTA_PRINCIPAL'].iter_rows(
+                    min_row=5, values_only=True,
+                ))
+                for nom in noms
+            }
+        nord, sud = self.structures
+        self.assertEqual(sorted(noms), sorted([
+            f'PTA_st1_nord_{nord.pk}.xlsx', f'PTA_st1_nord_{homonyme.pk}.xlsx', 'PTA_st2_sud.xlsx',
+            'PTA_Sans_structure.xlsx',
+        ]))
+        self.assertEqual({c['fichier'] for c in contenu}, set(noms))
+        attendus = {
+            f'PTA_st1_nord_{nord.pk}.xlsx': 6, f'PTA_st1_nord_{homonyme.pk}.xlsx': 1,
+            'PTA_st2_sud.xlsx': 2, 'PTA_Sans_structure.xlsx': 1,
+        }
+        self.assertEqual({c['fichier']: c['activites'] for c in contenu}, attendus)
+        for nom, nb in attendus.items():
+            # Lignes d'activités puis total général
+            self.assertEqual(len(lignes[nom]), nb + 1, nom)
+            self.assertEqual(lignes[nom][-1][0], f"TOTAL GÉNÉRAL ({nb} activités)")
+
+
+    def test_exports_bruts(self):
+        import pyarrow.parquet as pq
+
+        for montant in ('0.10', '0.20'):
+            Activite.objects.create(activite=f"Centimes {montant}", montant=Decimal(montant), quantite=Decimal('0.01'))
+
+        # Paquets de 4 lignes : plusieurs blocs CSV et plusieurs groupes de lignes Parquet
+        blocs = list(flux_csv_pta(chunk_size=4))
+        self.assertGreater(len(blocs), 1)
+        lignes = list(csv.reader(io.StringIO(''.join(blocs))))
+        self.assertEqual(lignes[0], HEADERS_PTA)
+        self.assertEqual(len(lignes), 12)
+        self.assertIn(['Centimes 0.10', '0.10'], [[ligne[7], ligne[16]] for ligne in lignes])
+
+        tampon = io.BytesIO()
+        ecrire_parquet_pta(tampon, chunk_size=4)
+        tampon.seek(0)
+        fichier = pq.ParquetFile(tampon)
+        self.assertEqual(fichier.metadata.num_row_groups, 3)
+        table = fichier.read()
+        self.assertEqual(table.column_names, HEADERS_PTA)
+        self.assertEqual(table.num_rows, 11)
+        self.assertEqual(str(table.schema.field("MONTANT TOTAL (Ar)").type), 'decimal128(16, 2)')
+        montants = dict(zip(table.column("ACTIVITES").to_pylist(), table.column("MONTANT TOTAL (Ar)").to_pylist()))
+        # Decimal exacts de bout en bout : 0,10 + 0,20 vaut 0,30, pas 0,30000000000000004
+        self.assertEqual(montants["Centimes 0.10"] + montants["Centimes 0.20"], Decimal('0.30'))
+        self.assertEqual(table.column("QUANTITE").to_pylist()[-1], Decimal('0.01'))
+        self.assertEqual(sum(montants.values()), Decimal('58.88'))
+
+
+    def test_montants_decimaux_du_classeur(self):
+        # Aucun de ces montants n'est représentable exactement en float (Decimal(float(x)) != x)
+        est = Structure.objects.create(numero='ST3', nom="Est")
+        for cout, quantite, montant in (
+            ('12345678901.23', '100', '1234567890123.00'), ('0.10', '1', '0.10'), ('0.10', '2', '0.20'),
+        ):
+            Activite.objects.create(
+                activite=f"Montant {montant}", structure=est,
+                cout_unitaire=Decimal(cout), quantite=Decimal(quantite), montant=Decimal(montant),
+            )
+
+        for sous_totaux in (False, True):
+            lignes = self.lignes_principales(filtres={'structure': [est.pk]}, sous_totaux=sous_totaux)
+            activites = [ligne for ligne in lignes if str(ligne[7]).startswith("Montant")]
+            self.assertEqual([(ligne[14], ligne[15], ligne[16]) for ligne in activites], [
+                (Decimal('12345678901.23'), Decimal('100'), Decimal('1234567890123.00')),
+                (Decimal('0.10'), Decimal('1'), Decimal('0.10')),
+                (Decimal('0.10'), Decimal('2'), Decimal('0.20')),
+            ])
+            self.assertTrue(all(isinstance(valeur, Decimal) for ligne in activites for valeur in ligne[14:17]))
+            # Total calculé par la base, exact au centime (0,10 + 0,20 = 0,30)
+            self.assertEqual(lignes[-1][0], "TOTAL GÉNÉRAL (3 activités)")
+            self.assertEqual(lignes[-1][16], Decimal('1234567890123.30'))
+            self.assertIsInstance(lignes[-1][16], Decimal)
+
+
+class SuiviTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        creer_suivis(3)
+        self.activite = Activite.objects.earliest('id')
+
+    def test_pagination_par_curseur(self):
+        # Sans paramètre de page, la liste reste un tableau (frontend actuel)
+        self.assertEqual(len(self.client.get('/api/suivis/').json()), 6)
+
+        page = self.client.get('/api/suivis/?page_size=4').json()
+        self.assertEqual(len(page['results']), 4)
+        suite = self.client.get(page['next']).json()
+        self.assertEqual(len(suite['results']), 2)
+        self.assertIsNone(suite['next'])
+        ids = [s['id'] for s in page['results'] + suite['results']]
+        self.assertEqual(len(set(ids)), 6)
+
+    def test_filtres(self):
+        url = f'/api/suivis/?activite_id={self.activite.id}&du=2025-03-10&au=2025-03-31'
+        self.assertEqual([s['date_suivi'] for s in self.client.get(url).json()], ['2025-03-15'])
+        self.assertEqual(self.client.get('/api/suivis/?du=2025-03-20&au=2025-03-01').status_code, 400)
+        self.assertEqual(self.client.get('/api/suivis/?activite_id=abc').status_code, 400)
+
+    def test_progression_activite(self):
+        response = self.client.get(f'/api/activites/{self.activite.id}/progress/')
+        self.assertEqual(response.json(), [['2025-03-01', 2], ['2025-03-15', 30]])
+        self.assertEqual(self.client.get('/api/activites/999999/progress/').status_code, 404)
+
+
+class ProgressionTests(TestCase):
+    def setUp(self):
+        # Les versions des données repartent de zéro à chaque test : pas de cache d'un test à l'autre
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        creer_activites(2)
+        self.a1, self.a2 = Activite.objects.order_by('id')
+        # a1 : 20 % en 2024 (reporté), 50 % puis 80 % en mars, rien ensuite ; a2 : 40 % en mai
+        for activite, jour, avancement in (
+            (self.a1, date(2024, 12, 20), 20), (self.a1, date(2025, 3, 3), 50), (self.a1, date(2025, 3, 20), 80),
+            (self.a2, date(2025, 5, 10), 40),
+        ):
+            Suivi.objects.create(activite=activite, date_suivi=jour, avancement=avancement)
+
+    def test_courbe_mensuelle(self):
+        donnees = self.client.get('/api/progression/?annee=2025').json()
+        self.assertEqual(len(donnees['periodes']), 12)
+        serie = donnees['series'][0]
+        self.assertEqual(serie['activites'], 2)
+        self.assertEqual(serie['avancement_moyen'][:6], [10.0, 10.0, 40.0, 40.0, 60.0, 60.0])
+        self.assertEqual(serie['avancement_moyen'][-1], 60.0)
+
+    def test_courbe_par_structure_et_cache(self):
+        url = f'/api/progression/?annee=2025&pas=semaine&niveau=structure&structure={self.a1.structure_id}'
+        donnees = self.client.get(url).json()
+        self.assertEqual(len(donnees['periodes']), 53)
+        self.assertEqual([serie['id'] for serie in donnees['series']], [self.a1.structure_id])
+        self.assertEqual(donnees['series'][0]['avancement_moyen'][9:11], [50.0, 50.0])
+        self.assertEqual(self.client.get(url).json(), donnees)
+
+        # Un nouveau suivi invalide le cache
+        Suivi.objects.create(activite=self.a1, date_suivi=date(2025, 12, 1), avancement=100)
+        self.assertEqual(self.client.get(url).json()['series'][0]['avancement_moyen'][-1], 100.0)
+
+    def test_semaine_a_cheval_sur_deux_annees(self):
+        Suivi.objects.create(activite=self.a2, date_suivi=date(2025, 12, 30), avancement=10)
+        Suivi.objects.create(activite=self.a2, date_suivi=date(2026, 1, 2), avancement=90)
+        url = f'/api/progression/?pas=semaine&structure={self.a2.structure_id}&annee='
+        # La semaine du 29/12/2025 vaut 90 % quelle que soit l'année demandée en premier
+        for premiere, seconde in ((2025, 2026), (2026, 2025)):
+            cache.clear()
+            valeurs = {}
+            for annee in (premiere, seconde):
+                donnees = self.client.get(f'{url}{annee}').json()
+                valeurs[annee] = donnees['series'][0]['avancement_moyen'][donnees['periodes'].index('2025-12-29')]
+            self.assertEqual(valeurs, {2025: 90.0, 2026: 90.0})
+
+    def test_sans_filtres(self):
+        donnees = serie_progression(du=date(2025, 1, 1), au=date(2025, 3, 31))
+        self.assertEqual(donnees['series'][0]['avancement_moyen'], [10.0, 10.0, 40.0])
+
+    def test_parametres_invalides(self):
+        self.assertEqual(self.client.get('/api/progression/?pas=jour').status_code, 400)
+        self.assertEqual(self.client.get('/api/progression/?niveau=pcop').status_code, 400)
+        self.assertEqual(self.client.get('/api/progression/?annee=deux').status_code, 400)
+        for annee in (0, -1, 9999, 10000):
+            self.assertEqual(self.client.get(f'/api/progression/?annee={annee}').status_code, 400, annee)
+        for annee in (1, 9998):
+            self.assertEqual(self.client.get(f'/api/progression/?annee={annee}&pas=semaine').status_code, 200)
+
+
+class PrevisionsTests(TestCase):
+    AUJOURD_HUI = date(2025, 6, 1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        creer_activites(5)
+        self.a_l_heure, self.lente, self.terminee, self.annulee, self.sans_suivi = Activite.objects.order_by('id')
+        Activite.objects.update(date_debut=date(2025, 1, 1), date_fin=date(2025, 12, 31))
+        Activite.objects.filter(pk=self.lente.pk).update(date_fin=date(2025, 7, 31))
+        Activite.objects.filter(pk=self.annulee.pk).update(etat='Annulé')
+        Activite.objects.filter(pk=self.sans_suivi.pk).update(date_fin=date(2025, 5, 1))
+        for activite, jour, avancement in (
+            (self.a_l_heure, date(2025, 3, 1), 20), (self.a_l_heure, date(2025, 5, 1), 40),
+            (self.lente, date(2025, 3, 1), 10), (self.lente, date(2025, 5, 1), 20),
+            (self.terminee, date(2025, 3, 1), 60), (self.terminee, date(2025, 4, 1), 100),
+            (self.annulee, date(2025, 3, 1), 10),
+        ):
+            Suivi.objects.create(activite=Activite.objects.get(pk=activite.pk), date_suivi=jour, avancement=avancement)
+
+    def test_ajustement_groupe_identique_a_polyfit(self):
+        import numpy as np
+
+        alea = np.random.default_rng(0)
+        groupes = np.repeat(np.arange(50), alea.integers(3, 10, 50))
+        x = alea.uniform(-200, 200, len(groupes))
+        y = alea.uniform(0, 100, len(groupes))
+        a, b, _, n = ajuster_droites(groupes, x, y, 50)
+        for groupe in range(50):
+            pente, ordonnee = np.polyfit(x[groupes == groupe], y[groupes == groupe], 1)
+            self.assertAlmostEqual(b[groupe], pente)
+            self.assertAlmostEqual(a[groupe], ordonnee)
+        self.assertEqual(n.sum(), len(groupes))
+
+    def test_previsions_enregistrees(self):
+        bilan = calculer_previsions(aujourd_hui=self.AUJOURD_HUI)
+        self.assertEqual(bilan['activites'], 5)
+        previsions = {a.pk: a for a in Activite.objects.all()}
+
+        a_l_heure = previsions[self.a_l_heure.pk]
+        # 20 % par tranche de deux mois depuis le 1er janvier : 100 % fin octobre
+        self.assertTrue(date(2025, 10, 1) < a_l_heure.date_achevement_prevue < date(2025, 12, 1))
+        self.assertLess(a_l_heure.risque_retard, 0.2)
+        lente = previsions[self.lente.pk]
+        self.assertGreater(lente.date_achevement_prevue, lente.date_fin)
+        self.assertGreater(lente.risque_retard, 0.9)
+        self.assertEqual(previsions[self.terminee.pk].date_achevement_prevue, date(2025, 4, 1))
+        self.assertEqual(previsions[self.terminee.pk].risque_retard, 0)
+        self.assertIsNone(previsions[self.annulee.pk].risque_retard)
+        # Sans suivi, date de fin dépassée : retard certain, mais pas de date prévisible
+        self.assertEqual(previsions[self.sans_suivi.pk].risque_retard, 1)
+        self.assertIsNone(previsions[self.sans_suivi.pk].date_achevement_prevue)
+        # Horodatage posé sur les seules prévisions écrites (l'activité annulée n'en a pas)
+        horodatages = {a.pk: a.prevision_calculee_le for a in previsions.values()}
+        self.assertEqual([pk for pk, le in horodatages.items() if le is None], [self.annulee.pk])
+
+        # Sans nouveau suivi, rien n'est réécrit, pas même l'horodatage
+        with CaptureQueriesContext(connection) as requetes:
+            self.assertEqual(calculer_previsions(aujourd_hui=self.AUJOURD_HUI)['modifiees'], 0)
+        self.assertFalse([r for r in requetes.captured_queries if r['sql'].startswith('UPDATE')])
+        self.assertEqual(dict(Activite.objects.values_list('pk', 'prevision_calculee_le')), horodatages)
+
+    def test_suivis_d_activites_inconnues_ignores(self):
+        import numpy as np
+
+        # Activités 10 et 20 lues ; 5, 15 et 30 créées ou supprimées entre les deux lectures
+        j = self.AUJOURD_HUI.toordinal()
+        activites = (np.array([10, 20]), np.array([j - 100.0] * 2), np.array([j + 100.0] * 2), np.array(['En cours'] * 2))
+        attendu = prevoir(*activites, np.array([10, 10, 20]), np.array([j - 50.0, j, j]), np.array([20.0, 40.0, 100.0]), j)
+        obtenu = prevoir(
+            *activites, np.array([5, 10, 10, 15, 20, 30]), np.array([j - 60.0, j - 50.0, j, j, j, j]),
+            np.array([100.0, 20.0, 40.0, 100.0, 100.0, 5.0]), j,
+        )
+        np.testing.assert_array_equal(obtenu[0], attendu[0])
+        np.testing.assert_array_equal(obtenu[1], attendu[1])
+
+    def test_liste_des_activites_a_risque(self):
+        calculer_previsions(aujourd_hui=self.AUJOURD_HUI)
+        donnees = self.client.get('/api/activites/previsions/').json()
+        self.assertEqual({d['id'] for d in donnees}, {self.lente.pk, self.sans_suivi.pk})
+        risques = [d['risque_retard'] for d in donnees]
+        self.assertEqual(risques, sorted(risques, reverse=True))
+        self.assertEqual(
+            len(self.client.get('/api/activites/previsions/?risque_min=0').json()), 4,
+        )
+        page = self.client.get('/api/activites/previsions/?page_size=1').json()
+        self.assertEqual(len(page['results']), 1)
+        self.assertEqual(len(self.client.get(page['next']).json()['results']), 1)
+        self.assertEqual(self.client.get('/api/activites/previsions/?risque_min=fort').status_code, 400)
+
+
+class AnomaliesTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        self.pcop = PCOPEntry.objects.create(code="6011", libelle="Fournitures")
+        for cout in ('100', '101', '99', '100', '102', '98', '1000'):
+            Activite.objects.create(
+                activite=f"Achat à {cout}", pcop=self.pcop, cout_unitaire=Decimal(cout), quantite=Decimal('2'),
+                montant=Decimal(cout) * 2,
+            )
+        self.atypique = Activite.objects.get(cout_unitaire=1000)
+        self.incoherente = Activite.objects.create(
+            activite="Montant mal saisi", cout_unitaire=Decimal('10.50'), quantite=Decimal('3'), montant=Decimal('35'),
+        )
+
+    def test_statistiques_identiques_a_numpy(self):
+        import numpy as np
+
+        alea = np.random.default_rng(0)
+        comptes = alea.integers(0, 20, 500).astype(float)
+        couts = alea.lognormal(5, 1, 500)
+        codes, tailles, mediane, mad, p10, p90, *_ = statistiques_par_compte(comptes, couts)
+        for i, code in enumerate(codes):
+            valeurs = couts[comptes == code]
+            self.assertEqual(tailles[i], len(valeurs))
+            self.assertAlmostEqual(mediane[i], np.median(valeurs))
+            self.assertAlmostEqual(mad[i], np.median(np.abs(valeurs - np.median(valeurs))))
+            self.assertAlmostEqual(p10[i], np.percentile(valeurs, 10))
+            self.assertAlmostEqual(p90[i], np.percentile(valeurs, 90))
+
+    def test_detection(self):
+        bilan = analyser_budgets()
+        self.assertEqual((bilan['couts_atypiques'], bilan['montants_incoherents']), (1, 1))
+        cout = AnomalieBudget.objects.get(type='cout_atypique')
+        self.assertEqual((cout.activite_id, cout.pcop_id, cout.reference, cout.mad), (self.atypique.pk, self.pcop.pk, 100, 1))
+        montant = AnomalieBudget.objects.get(type='montant_incoherent')
+        self.assertEqual((montant.activite_id, montant.valeur, montant.reference), (self.incoherente.pk, 35, 31.5))
+
+        # Une nouvelle analyse remplace les anomalies précédentes
+        Activite.objects.filter(pk=self.incoherente.pk).update(montant=Decimal('31.50'))
+        analyser_budgets()
+        self.assertEqual(list(AnomalieBudget.objects.values_list('type', flat=True)), ['cout_atypique'])
+
+    def test_liste_paginee(self):
+        analyser_budgets()
+        page = self.client.get('/api/anomalies/?page_size=1').json()
+        self.assertEqual(len(page['results']), 1)
+        self.assertEqual(page['results'][0]['activite'], self.atypique.pk)
+        self.assertEqual(page['results'][0]['pcop_code'], "6011")
+        self.assertEqual(len(self.client.get(page['next']).json()['results']), 1)
+        donnees = self.client.get('/api/anomalies/?type=montant_incoherent').json()
+        self.assertEqual([a['activite'] for a in donnees['results']], [self.incoherente.pk])
+        self.assertEqual(self.client.get(f'/api/anomalies/?pcop={self.pcop.pk}').json()['results'][0]['type'], 'cout_atypique')
+        self.assertEqual(self.client.get('/api/anomalies/?type=doublon').status_code, 400)
+
+
+class SimulationTests(TestCase):
+    def setUp(self):
+        # Les versions des données repartent de zéro à chaque test : l'instantané d'un test précédent est oublié
+        simulation._instantane = None
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        creer_activites(3)
+        self.a1, self.a2, self.a3 = Activite.objects.order_by('id')
+
+    def simuler(self, regles, **donnees):
+        return self.client.post('/api/simulation/', {'regles': regles, **donnees}, format='json')
+
+    def test_ecarts_par_niveau(self):
+        reponse = self.simuler([
+            {'filtres': {'pcop': [self.a1.pcop_id]}, 'champ': 'cout_unitaire', 'multiplicateur': 2},
+            {'filtres': {'structure': [self.a2.structure_id]}, 'champ': 'quantite', 'valeur': 1},
+        ])
+        self.assertEqual(reponse.status_code, 200)
+        donnees = reponse.json()
+        self.assertEqual(donnees['activites_modifiees'], 2)
+        self.assertEqual(donnees['regles'], [{'activites': 1}, {'activites': 1}])
+        # a1 : 21 × 3 = 63 (+31,50) ; a2 : 10,50 × 1 (-21) ; a3 inchangée
+        self.assertEqual(donnees['total'], {
+            'montant_initial': 94.5, 'montant_simule': 105.0, 'ecart': 10.5, 'ecart_pct': 11.11,
+        })
+        self.assertEqual(
+            [(g['id'], g['ecart']) for g in donnees['niveaux']['structure']],
+            [(self.a1.structure_id, 31.5), (self.a2.structure_id, -21.0)],
+        )
+        self.assertEqual(donnees['niveaux']['pcop'][0]['libelle'], str(self.a1.pcop))
+        # Rien n'est écrit en base
+        self.assertEqual(Activite.objects.get(pk=self.a1.pk).montant, Decimal('31.50'))
+
+    def test_montants_enregistres_incoherents(self):
+        # a1 : montant périmé (50 au lieu de 31,50) ; a2 : montant absent
+        Activite.objects.filter(pk=self.a1.pk).update(montant=Decimal('50'))
+        Activite.objects.filter(pk=self.a2.pk).update(montant=None)
+        neutre = self.simuler([{'filtres': {}, 'champ': 'quantite', 'multiplicateur': 1}]).json()
+        self.assertEqual(neutre['activites_modifiees'], 0)
+        self.assertEqual(neutre['total']['ecart'], 0)
+        self.assertEqual(neutre['niveaux']['structure'], [])
+        self.assertEqual(neutre['montants_recalcules'], {'activites': 2, 'ecart': 13.0})
+
+        # L'écart simulé part de coût × quantité, pas du montant enregistré
+        regle = {'filtres': {'pcop': [self.a1.pcop_id]}, 'champ': 'cout_unitaire', 'multiplicateur': 2}
+        donnees = self.simuler([regle]).json()
+        self.assertEqual(donnees['total']['ecart'], 31.5)
+        self.assertEqual(donnees['montants_recalcules'], {'activites': 1, 'ecart': -18.5})
+
+    def test_instantane_reutilise_puis_recharge(self):
+        regles = [{'filtres': {'etat': ['En cours']}, 'champ': 'quantite', 'multiplicateur': 0.5}]
+        self.assertEqual(self.simuler(regles, niveaux=['direction']).json()['total']['ecart'], -47.25)
+        instantane = simulation._instantane
+        # Scénario rejoué : seule la version des données est relue (aucune ligne modifiée n'a de libellé à charger)
+        with self.assertNumQueries(1):
+            self.simuler([{'filtres': {'etat': ['Terminé']}, 'champ': 'quantite', 'multiplicateur': 0.5}])
+        self.assertIs(simulation._instantane, instantane)
+
+        # Une modification par save() change la version des données : l'instantané est rechargé
+        self.a3.etat = 'Terminé'
+        self.a3.save()
+        self.assertEqual(self.simuler(regles).json()['total']['ecart'], -31.5)
+        self.assertIsNot(simulation._instantane, instantane)
+
+    def test_regles_invalides(self):
+        self.assertEqual(self.simuler([]).status_code, 400)
+        self.assertEqual(self.simuler([{'champ': 'montant', 'multiplicateur': 2}]).status_code, 400)
+        self.assertEqual(self.simuler([{'champ': 'quantite', 'multiplicateur': 2, 'valeur': 1}]).status_code, 400)
+        self.assertEqual(self.simuler([{'champ': 'quantite', 'multiplicateur': 'x'}]).status_code, 400)
+        self.assertEqual(
+            self.simuler([{'champ': 'quantite', 'valeur': 1, 'filtres': {'du': '2025-01-01'}}]).status_code, 400,
+        )
+        self.assertEqual(self.simuler([{'champ': 'quantite', 'valeur': 1, 'filtres': {'pcop': ['a']}}]).status_code, 400)
+        self.assertEqual(self.simuler([{'champ': 'quantite', 'valeur': 1}], niveaux=['pays']).status_code, 400)
+        self.assertEqual(self.simuler([{'champ': 'quantite', 'valeur': 1}], niveaux=[{}]).status_code, 400)
+        for nombre in ('inf', '-inf', 'nan', 1e308, 1001):
+            self.assertEqual(self.simuler([{'champ': 'quantite', 'multiplicateur': nombre}]).status_code, 400, nombre)
+        self.assertEqual(self.simuler([{'champ': 'quantite', 'valeur': 1e10}]).status_code, 400)
+        self.assertEqual(self.simuler([{'champ': 'cout_unitaire', 'valeur': 'nan'}]).status_code, 400)
+        # Chaque valeur tient dans sa colonne, mais pas leur produit dans montant
+        self.assertEqual(self.simuler([
+            {'champ': 'cout_unitaire', 'valeur': 1e11}, {'champ': 'quantite', 'valeur': 1e9},
+        ]).status_code, 400)
+
+
+class DimensionsTests(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        creer_activites(3)
+        self.a1, self.a2, self.a3 = Activite.objects.order_by('id')
+
+    def test_cles_canoniques(self):
+        self.assertEqual(cle_dimension("Banque  Mondiale"), cle_dimension("banque mondiale"))
+        self.assertEqual(cle_dimension("B.A.D."), cle_dimension("BAD"))
+        self.assertEqual(cle_dimension("Ménages-vulnérables"), "menages vulnerables")
+        self.assertEqual(decouper("RPI ; Banque Mondiale / banque mondiale + "), {'rpi': "RPI", 'banque mondiale': "Banque Mondiale"})
+
+    def test_synchronisation_a_l_enregistrement(self):
+        self.a1.sources_financement = "RPI, Banque Mondiale"
+        self.a1.cibles = "Écoles"
+        self.a1.save()
+        self.a2.sources_financement = "banque  mondiale"
+        self.a2.save()
+        self.assertEqual(SourceFinancement.objects.count(), 2)
+        self.assertEqual(set(self.a2.sources.values_list('nom', flat=True)), {"Banque Mondiale"})
+        self.assertEqual(list(self.a1.groupes_cibles.values_list('cle', flat=True)), ['ecoles'])
+
+        # Texte modifié : liens retirés et ajoutés, les entrées restent
+        self.a1.sources_financement = "RPI"
+        self.a1.cibles = ""
+        self.a1.save()
+        self.assertEqual(list(self.a1.sources.values_list('nom', flat=True)), ["RPI"])
+        self.assertFalse(self.a1.groupes_cibles.exists())
+        self.assertEqual(Cible.objects.count(), 1)
+
+    def test_budget_par_source(self):
+        Activite.objects.filter(pk=self.a1.pk).update(montant=Decimal('100'))
+        for activite, sources in ((self.a1, "RPI, AFD"), (self.a2, "AFD")):
+            activite.refresh_from_db()
+            activite.sources_financement = sources
+            activite.save()
+        reponse = self.client.get('/api/sources-financement/budget/')
+        self.assertEqual(reponse.status_code, 200)
+        # a1 cofinancée compte en entier pour RPI et pour l'AFD ; a3 n'a pas de source
+        self.assertEqual(
+            [(ligne['nom'], ligne['activites'], ligne['montant']) for ligne in reponse.json()],
+            [("AFD", 2, 131.5), ("RPI", 1, 100.0), ("Non renseigné", 1, 31.5)],
+        )
+        reponse = self.client.get(f'/api/sources-financement/budget/?structure={self.a2.structure_id}')
+        self.assertEqual(
+            [(ligne['nom'], ligne['activites']) for ligne in reponse.json()], [("AFD", 1)],
+        )
+        self.assertEqual(self.client.get('/api/cibles/budget/?structure=abc').status_code, 400)
+
+
+class InstantanesTests(TestCase):
+    def setUp(self):
+        instantanes._contenus.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        creer_activites(3)
+        self.a1, self.a2, self.a3 = Activite.objects.order_by('id')
+
+    def figer(self, nom="Plan validé", annee=2026):
+        reponse = self.client.post('/api/instantanes/', {'nom': nom, 'annee': annee}, format='json')
+        self.assertEqual(reponse.status_code, 201)
+        return reponse.json()
+
+    def test_figement_independant_des_tables(self):
+        lignes = list(lignes_pta())
+        donnees = self.figer()
+        self.assertEqual((donnees['nb_activites'], donnees['montant_total']), (3, '94.50'))
+        instantane = InstantanePTA.objects.get(pk=donnees['id'])
+        self.assertEqual(list(instantanes.lignes_instantane(instantanes.contenu_instantane(instantane))), lignes)
+        with self.assertRaises(ValueError):
+            instantane.save()
+
+        # Le PTA change ensuite : l'instantané, son tableau de bord et ses exports ne bougent pas
+        Activite.objects.filter(pk=self.a1.pk).update(montant=Decimal('1000'))
+        self.a2.delete()
+        statistiques = self.client.get(f"/api/instantanes/{donnees['id']}/tableau-de-bord/").json()['statistiques']
+        self.assertEqual((statistiques['total_activites'], statistiques['budget_total']), (3, 94.5))
+        with CaptureQueriesContext(connection) as requetes:
+            reponse = self.client.get(f"/api/instantanes/{donnees['id']}/export-csv/?structure={self.a2.structure_id}")
+            contenu = b''.join(reponse.streaming_content).decode()
+        self.assertFalse([r for r in requetes.captured_queries if Activite._meta.db_table in r['sql']])
+        self.assertEqual(len(contenu.splitlines()), 2)
+        self.assertIn("Activité", contenu.splitlines()[1])
+
+    def test_comparaison(self):
+        avant = self.figer()['id']
+        self.a1.cout_unitaire, self.a1.montant = Decimal('20'), Decimal('60')
+        self.a1.save()
+        self.a3.delete()
+        creer_activites(1)
+        apres = self.figer("Révision")['id']
+
+        reponse = self.client.get(f'/api/instantanes/{avant}/comparer/?avec={apres}&niveaux=structure,etat')
+        self.assertEqual(reponse.status_code, 200)
+        donnees = reponse.json()
+        self.assertEqual(donnees['activites'], {'ajoutees': 1, 'supprimees': 1, 'modifiees': 1, 'inchangees': 1})
+        self.assertEqual(donnees['champs_modifies'], {'cout_unitaire': 1, 'montant': 1})
+        self.assertEqual(donnees['total']['ecart'], 28.5)
+        self.assertEqual(donnees['details']['modifiees'], [
+            {'id': self.a1.pk, 'activite': self.a1.activite, 'changements': {'cout_unitaire': [10.5, 20.0], 'montant': [31.5, 60.0]}},
+        ])
+        # Regroupement par libellé, du plus grand écart au plus petit : nouvelle structure, celle de a3, celle de a1
+        self.assertEqual(
+            [(n['ecart'], n['activites_avant'], n['activites_apres']) for n in donnees['niveaux']['structure']],
+            [(31.5, 0, 1), (-31.5, 1, 0), (28.5, 1, 1)],
+        )
+        self.assertEqual([(n['libelle'], n['ecart']) for n in donnees['niveaux']['etat']], [("En cours", 28.5)])
+        # Le PTA courant est identique au second instantané
+        courant = self.client.get(f'/api/instantanes/{avant}/comparer/?avec=courant').json()
+        self.assertEqual(courant['activites'], donnees['activites'])
+        self.assertEqual(self.client.get(f'/api/instantanes/{avant}/comparer/?avec=courant&niveaux=x').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/instantanes/{avant}/comparer/?avec=courant&details=x').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/instantanes/{avant}/comparer/?avec=dernier').status_code, 400)
+        self.assertEqual(self.client.get(f'/api/instantanes/{avant}/comparer/?avec=999999').status_code, 404)
+
+        # ?annee= filtre la liste, pas l'instantané de comparaison : on compare d'une année à l'autre
+        suivant = self.figer("Plan 2027", annee=2027)['id']
+        reponse = self.client.get(f'/api/instantanes/{avant}/comparer/?annee=2026&avec={suivant}')
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.json()['apres'], {'id': suivant, 'nom': "Plan 2027"})
+        self.assertEqual(reponse.json()['activites'], donnees['activites'])
+
+    def test_empreinte_verifiee(self):
+        instantane = InstantanePTA.objects.get(pk=self.figer()['id'])
+        instantanes._contenus.clear()
+        InstantanePTA.objects.filter(pk=instantane.pk).update(empreinte='0' * 64)
+        with self.assertRaises(ValueError):
+            instantanes.contenu_instantane(InstantanePTA.objects.get(pk=instantane.pk))
+
+
+class ImportsTests(TestCase):
+    def test_fusion_pcop(self):
+        PCOPEntry.objects.create(code='6011', libelle="Ancien", cout_unitaire=Decimal('5'))
+        PCOPEntry.objects.create(code='6012', libelle="Inchangé", cout_unitaire=Decimal('7'))
+        contenu = (
+            "code;libelle;cout_unitaire\n"
+            "6011;Fournitures;1 234,50\n"
+            "6012;Inchangé;7\n"
+            "6013;Nouveau;10\n"
+            "6013;Nouveau bis;12\n"
+            ";Sans code;1\n"
+        ).encode()
+        version = version_donnees()
+
+        bilan = importer_pcop(io.BytesIO(contenu), 'pcop.csv')
+        self.assertEqual(
+            {c: bilan[c] for c in ('lignes_lues', 'rejetees', 'doublons', 'inserees', 'mises_a_jour', 'inchangees')},
+            {'lignes_lues': 5, 'rejetees': 1, 'doublons': 1, 'inserees': 1, 'mises_a_jour': 1, 'inchangees': 1},
+        )
+        self.assertEqual(len(bilan['erreurs']), 1)
+        # Le dernier doublon l'emporte ; la table de transit est vidée
+        self.assertEqual(
+            list(PCOPEntry.objects.order_by('code').values_list('code', 'libelle', 'cout_unitaire')),
+            [('6011', "Fournitures", Decimal('1234.50')), ('6012', "Inchangé", Decimal('7')),
+             ('6013', "Nouveau bis", Decimal('12'))],
+        )
+        self.assertFalse(PCOPImportLigne.objects.exists())
+        self.assertEqual(version_donnees(), version + 1)
+
+        # Réimport à l'identique : rien n'est écrit, les exports restent valides
+        bilan = importer_pcop(io.BytesIO(contenu), 'pcop.csv')
+        self.assertEqual((bilan['inserees'], bilan['mises_a_jour'], bilan['inchangees']), (0, 0, 3))
+        self.assertEqual(version_donnees(), version + 1)
+
+    def test_fichiers_windows_et_corrompus(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+        def importer(nom, contenu, url='/api/pcop/import/'):
+            return client.post(url, {'fichier': SimpleUploadedFile(nom, contenu)}, format='multipart')
+
+        # CSV enregistré par Excel en français : Windows-1252
+        reponse = importer('pcop.csv', "code;libelle;cout_unitaire\n6011;Matériel de bureau;12,50\n".encode('cp1252'))
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(PCOPEntry.objects.get(code='6011').libelle, "Matériel de bureau")
+        # 0x81 n'existe ni en UTF-8 ni en Windows-1252
+        self.assertEqual(importer('pcop.csv', b"code;libelle\n6012;\x81\n").status_code, 400)
+        self.assertEqual(importer('pcop.xlsx', b"pas un classeur").status_code, 400)
+        self.assertEqual(
+            importer('cadre.xlsx', b"PK\x03\x04tronque", url='/api/objectifs-generaux/import/').status_code, 400,
+        )
+
+    def test_reimport_cadre_logique(self):
+        arbre = [{
+            'numero': 'OG1', 'titre': "Objectif", 'objectifs_specifiques': [{
+                'numero': 'OS1.1', 'titre': "Spécifique", 'resultats_attendus': [
+                    {'numero': 'RA1.1.1', 'description': "Résultat 1"},
+                    {'numero': 'RA1.1.2', 'description': "Résultat 2"},
+                ],
+            }],
+        }, {'numero': 'OG2', 'titre': "Sans enfant"}]
+        orphelin = {'niveau': 1, 'numero': 'OS9.1', 'titre': "Orphelin"}
+
+        bilan = importer_cadre_logique(aplatir_arbre(arbre) + [orphelin])
+        self.assertEqual(bilan['objectifs_generaux'], {'inseres': 2, 'mis_a_jour': 0, 'inchanges': 0})
+        self.assertEqual(bilan['resultats_attendus'], {'inseres': 2, 'mis_a_jour': 0, 'inchanges': 0})
+        self.assertEqual(bilan['rejetes'], 1)
+        self.assertEqual(ResultatAttendu.objects.get(numero='RA1.1.2').objectif_specifique.numero, 'OS1.1')
+
+        # Second passage identique : uniquement des lectures, bilan « inchangés »
+        version = version_donnees()
+        with CaptureQueriesContext(connection) as requetes:
+            bilan = importer_cadre_logique(aplatir_arbre(arbre))
+        ecritures = [
+            r['sql'] for r in requetes.captured_queries
+            if r['sql'].lstrip().upper().startswith(('INSERT', 'UPDATE', 'DELETE'))
+        ]
+        self.assertEqual(ecritures, [])
+        self.assertEqual(bilan['objectifs_generaux'], {'inseres': 0, 'mis_a_jour': 0, 'inchanges': 2})
+        self.assertEqual(bilan['objectifs_specifiques'], {'inseres': 0, 'mis_a_jour': 0, 'inchanges': 1})
+        self.assertEqual(bilan['resultats_attendus'], {'inseres': 0, 'mis_a_jour': 0, 'inchanges': 2})
+        self.assertEqual(version_donnees(), version)
+
+        # Seul le noeud modifié est réécrit, sans changer d'identifiant
+        pk = ResultatAttendu.objects.get(numero='RA1.1.1').pk
+        arbre[0]['objectifs_specifiques'][0]['resultats_attendus'][0]['description'] = "Résultat révisé"
+        bilan = importer_cadre_logique(aplatir_arbre(arbre))
+        self.assertEqual(bilan['resultats_attendus'], {'inseres': 0, 'mis_a_jour': 1, 'inchanges': 1})
+        self.assertEqual(ResultatAttendu.objects.get(pk=pk).description, "Résultat révisé")
+
+
+class ReponseFichierTests(SimpleTestCase):
+    def setUp(self):
+        repertoire = tempfile.TemporaryDirectory()
+        self.addCleanup(repertoire.cleanup)
+        self.chemin = os.path.join(repertoire.name, 'pta_v3_0123456789ab.xlsx')
+        with open(self.chemin, 'wb') as fichier:
+            fichier.write(b'0123456789')
+        self.factory = APIRequestFactory()
+
+    def servir(self, **entetes):
+        request = self.factory.get('/', headers=entetes)
+        response = reponse_fichier(request, self.chemin, 'pta.xlsx', 'application/octet-stream')
+        contenu = b''.join(response.streaming_content) if response.streaming else response.content
+        return response, contenu
+
+    def test_fichier_complet_et_etag(self):
+        response, contenu = self.servir()
+        self.assertEqual((response.status_code, contenu), (200, b'0123456789'))
+        self.assertEqual(response['ETag'], '"pta_v3_0123456789ab"')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('filename="pta.xlsx"', response['Content-Disposition'])
+
+        response, contenu = self.servir(**{'If-None-Match': '"pta_v3_0123456789ab"'})
+        self.assertEqual((response.status_code, contenu), (304, b''))
+        self.assertEqual(self.servir(**{'If-None-Match': '"pta_v2_0123456789ab"'})[0].status_code, 200)
+
+    def test_plages(self):
+        for plage, attendu, content_range in (
+            ('bytes=2-5', b'2345', 'bytes 2-5/10'),
+            ('bytes=7-', b'789', 'bytes 7-9/10'),
+            ('bytes=-3', b'789', 'bytes 7-9/10'),
+            ('bytes=8-100', b'89', 'bytes 8-9/10'),
+        ):
+            response, contenu = self.servir(Range=plage)
+            self.assertEqual((response.status_code, contenu, response['Content-Range']), (206, attendu, content_range))
+            self.assertEqual(response['Content-Length'], str(len(attendu)))
+
+        for plage in ('bytes=10-', 'bytes=5-2', 'octets=0-1', 'bytes=-'):
+            response, _ = self.servir(Range=plage)
+            self.assertEqual((response.status_code, response['Content-Range']), (416, 'bytes */10'))
+
+        # If-Range périmé : le fichier complet est renvoyé
+        response, contenu = self.servir(Range='bytes=2-5', **{'If-Range': '"pta_v2_0123456789ab"'})
+        self.assertEqual((response.status_code, contenu), (200, b'0123456789'))
+        self.assertEqual(self.servir(Range='bytes=2-5', **{'If-Range': '"pta_v3_0123456789ab"'})[0].status_code, 206)
+
+
+class JobsTests(TestCase):
+    def setUp(self):
+        jobs.TACHES['test_ok'] = {'fonction': lambda job: {'parametres': job.parametres}, 'roles': None}
+        jobs.TACHES['test_echec'] = {'fonction': lambda job: 1 / 0, 'roles': None}
+        self.addCleanup(jobs.TACHES.pop, 'test_ok')
+        self.addCleanup(jobs.TACHES.pop, 'test_echec')
+
+    def test_reservation_dans_l_ordre(self):
+        premier = jobs.soumettre_job('test_ok')
+        second = jobs.soumettre_job('test_ok')
+        reserve = jobs.reserver_job('w1')
+        self.assertEqual((reserve.pk, reserve.statut, reserve.worker), (premier.pk, 'en_cours', 'w1'))
+        self.assertIsNotNone(Job.objects.get(pk=premier.pk).battement_le)
+        self.assertEqual(jobs.reserver_job('w2').pk, second.pk)
+        self.assertIsNone(jobs.reserver_job('w3'))
+
+    def test_transitions(self):
+        ok = jobs.soumettre_job('test_ok', parametres={'a': 1})
+        echec = jobs.soumettre_job('test_echec')
+        inconnu = jobs.soumettre_job('test_inconnu')
+        jobs.boucle_worker(threading.Event(), une_fois=True)
+
+        ok, echec, inconnu = (Job.objects.get(pk=j.pk) for j in (ok, echec, inconnu))
+        self.assertEqual((ok.statut, ok.progression, ok.resultat), ('termine', 100, {'parametres': {'a': 1}}))
+        self.assertEqual((echec.statut, echec.erreur), ('echec', 'division by zero'))
+        self.assertEqual(inconnu.statut, 'echec')
+        self.assertTrue(all(j.termine_le for j in (ok, echec, inconnu)))
+
+    def test_parametres_valides_a_la_soumission(self):
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+
+        def soumettre(type_job, parametres):
+            return client.post('/api/jobs/', {'type': type_job, 'parametres': parametres}, format='json')
+
+        for type_job, parametres in (
+            ('export_pta', ['structure']),
+            ('export_pta', {'filtres': {'structure': 'x'}}),
+            ('export_pta', {'filtres': 'structure=1'}),
+            ('export_pta', {'decoupage': 'pays'}),
+            ('export_pta', {'sous_totaux': 'oui'}),
+            ('regenerer_exports', {'forcer': 1}),
+            ('figer_pta', {'annee': 2026}),
+            ('figer_pta', {'nom': "Plan", 'annee': '2026'}),
+        ):
+            self.assertEqual(soumettre(type_job, parametres).status_code, 400, (type_job, parametres))
+        self.assertFalse(Job.objects.exists())
+
+        # Filtres normalisés : deux demandes équivalentes ont les mêmes paramètres, donc le même artefact
+        premier = soumettre('export_pta', {'filtres': {'structure': [3, '1', 3], 'etat': 'En cours'}})
+        second = soumettre('export_pta', {'filtres': {'etat': ['En cours'], 'structure': '1,3'}, 'decoupage': None})
+        self.assertEqual((premier.status_code, second.status_code), (201, 201))
+        self.assertEqual(premier.json()['parametres'], second.json()['parametres'])
+        self.assertEqual(premier.json()['parametres'], {
+            'filtres': {'structure': [1, 3], 'etat': ['En cours']}, 'decoupage': None, 'sous_totaux': False,
+        })
+
+    def test_jobs_abandonnes(self):
+        maintenant = timezone.now()
+        ancien = maintenant - timedelta(hours=1)
+        muet = Job.objects.create(type='test_ok', statut='en_cours', demarre_le=ancien, battement_le=ancien)
+        sans_battement = Job.objects.create(type='test_ok', statut='en_cours', demarre_le=ancien)
+        vivant = Job.objects.create(type='test_ok', statut='en_cours', demarre_le=ancien, battement_le=maintenant)
+        termine = Job.objects.create(type='test_ok', statut='termine', demarre_le=ancien, battement_le=ancien)
+
+        # La réservation suivante libère les jobs dont le worker a disparu
+        self.assertIsNone(jobs.reserver_job('w1'))
+        statuts = dict(Job.objects.values_list('pk', 'statut'))
+        self.assertEqual(
+            [statuts[j.pk] for j in (muet, sans_battement, vivant, termine)], ['echec', 'echec', 'en_cours', 'termine'],
+        )
+        self.assertIn("Worker arrêté", Job.objects.get(pk=muet.pk).erreur)
+        self.assertEqual(jobs.recuperer_jobs_abandonnes(), 0)
+
+
+class RequetesLentesTests(TestCase):
+    def setUp(self):
+        repertoire = tempfile.TemporaryDirectory()
+        self.addCleanup(repertoire.cleanup)
+        reglages = self.settings(
+            REQUETES_LENTES_ACTIF=True, REQUETES_LENTES_SEUIL_MS=0,
+            REQUETES_LENTES_FICHIER=os.path.join(repertoire.name, 'requetes_lentes.jsonl'),
+        )
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+        self.addCleanup(self.fermer_journal)
+        # La connexion de test existe déjà : on pose le wrapper comme à sa création
+        requetes_lentes.installer_journal(sender=None, connection=connection)
+        self.addCleanup(connection.execute_wrappers.remove, requetes_lentes.journaliser_requete_lente)
+
+    def fermer_journal(self):
+        journal = requetes_lentes._journal
+        if journal is not None:
+            for handler in list(journal.handlers):
+                handler.close()
+                journal.removeHandler(handler)
+        requetes_lentes._journal = None
+
+    def test_requete_journalisee(self):
+        with requetes_lentes.origine_sql('test:requetes_lentes'):
+            list(Structure.objects.filter(numero='ST9'))
+        entrees = requetes_lentes.lire_entrees(origine='test:requetes_lentes')
+        self.assertEqual(len(entrees), 1)
+        self.assertIn('api_structure', entrees[0]['sql'])
+        self.assertEqual((entrees[0]['origine'], entrees[0]['params']), ('test:requetes_lentes', ['ST9']))
+        self.assertGreaterEqual(entrees[0]['duree_ms'], 0)
+        # Hors du bloc, la requête n'a pas d'origine nommée
+        Structure.objects.count()
+        self.assertIsNone(requetes_lentes.lire_entrees(limite=1)[0]['origine'])
+
+    def test_consultation_reservee_aux_admins(self):
+        client = APIClient()
+        self.assertEqual(client.get('/api/requetes-lentes/').status_code, 401)
+        superviseur = User.objects.create_user('superviseur', 'superviseur@example.com', 'mdp')
+        UserProfile.objects.create(nom="Superviseur", email='superviseur@example.com', role='superviseur', auth_user=superviseur)
+        client.force_authenticate(superviseur)
+        self.assertEqual(client.get('/api/requetes-lentes/').status_code, 403)
+
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        with requetes_lentes.origine_sql('test:requetes_lentes'):
+            Structure.objects.count()
+        reponse = client.get('/api/requetes-lentes/?origine=test:requetes_lentes')
+        self.assertEqual(reponse.status_code, 200)
+        self.assertEqual(reponse.json()['count'], 1)
+
+
+class ProfilageTests(SimpleTestCase):
+    def setUp(self):
+        repertoire = tempfile.TemporaryDirectory()
+        self.addCleanup(repertoire.cleanup)
+        reglages = self.settings(MEDIA_ROOT=repertoire.name, PROFILAGE_DELAI_ARMEMENT=60)
+        reglages.enable()
+        self.addCleanup(reglages.disable)
+
+    def test_profilage_d_une_requete(self):
+        middleware = profilage.ProfilageMiddleware(lambda request: HttpResponse('ok'))
+        factory = RequestFactory()
+        profilage.armer_profilage('/api/structures/', 1, 'cprofile', 'admin')
+        self.assertEqual(profilage.etat_profilage()['restant'], 1)
+
+        middleware(factory.get('/api/directions/'))
+        self.assertEqual(profilage.lister_profils(), [])
+        for _ in range(2):
+            self.assertEqual(middleware(factory.get('/api/structures/')).content, b'ok')
+
+        profils = [nom for nom in os.listdir(profilage.repertoire_profils()) if nom.endswith('.pstats')]
+        self.assertEqual(len(profils), 1)
+        self.assertRegex(profils[0], r'_GET_api_structures\.pstats$')
+        pstats.Stats(profilage.chemin_profil(profils[0]))
+        self.assertIsNone(profilage.etat_profilage())
+        self.assertFalse(os.path.exists(profilage._fichier_etat()))
+
+        with self.assertRaisesMessage(ValueError, 'moins de 60 secondes'):
+            profilage.armer_profilage('/api/structures/', 1, 'cprofile', 'admin')
+        self.assertIsNone(profilage.etat_profilage())
+
+
+class GenerationTests(TestCase):
+    VOLUMES = {
+        'structures': 2, 'directions': 2, 'services': 1, 'divisions': 1, 'objectifs': 2,
+        'specifiques': 2, 'resultats': 1, 'pcop': 20, 'activites': 120, 'suivis_max': 3,
+    }
+    MODELES = (
+        Structure, Direction, Service, Division, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu,
+        PCOPEntry, Activite, Suivi, SourceFinancement, Cible,
+        Activite.sources.through, Activite.groupes_cibles.through,
+    )
+
+    def generer(self, graine):
+        """Vide puis régénère le PTA avec seed_pta ; retourne {table: (lignes, empreinte du contenu ordonné)}."""
+        call_command(
+            'seed_pta', graine=graine, annee=2025, vider=True, taille_lot=50, stdout=io.StringIO(), **self.VOLUMES,
+        )
+        empreintes = {}
+        for modele in self.MODELES:
+            contenu = repr(list(modele.objects.order_by('pk').values_list()))
+            empreintes[modele._meta.db_table] = (modele.objects.count(), hashlib.sha256(contenu.encode()).hexdigest())
+        return empreintes
+
+    def test_generation_deterministe(self):
+        premiere = self.generer(7)
+        self.assertEqual(premiere, self.generer(7))
+        self.assertNotEqual(premiere['api_activite'], self.generer(8)['api_activite'])
+
+        nb_activites = premiere['api_activite'][0]
+        self.assertEqual(nb_activites, 120)
+        # Chaque activité générée a une source et une cible : synchroniser_dimensions les a rattachées
+        self.assertEqual(premiere[Activite.sources.through._meta.db_table][0], nb_activites)
+        self.assertEqual(premiere[Activite.groupes_cibles.through._meta.db_table][0], nb_activites)
+        self.assertFalse(Activite.objects.filter(sources__isnull=True).exists())
+        self.assertEqual(
+            set(SourceFinancement.objects.values_list('nom', flat=True)),
+            set(Activite.objects.values_list('sources_financement', flat=True)),
+        )
+
+
+class PlansRequetesTests(PlansRequetesMixin, TestCase):
+    """Les requêtes les plus fréquentes doivent passer par les index sur un PTA de taille réaliste."""
+
+    @classmethod
+    def setUpTestData(cls):
+        generer_pta(graine=1, annee=2025, activites=2000)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        cls.admin = User.objects.create_superuser('admin', 'admin@example.com', 'admin')
+        cls.suivi = Suivi.objects.order_by('id').first()
+        cls.structure = Structure.objects.order_by('id').first()
+
+    def queryset_vue(self, classe_vue, url):
+        """Queryset construit par la vue pour cette URL (mêmes jointures et filtres qu'en production)."""
+        requete = Request(APIRequestFactory().get(url))
+        requete.user = self.admin
+        return classe_vue(request=requete, format_kwarg=None, kwargs={}).get_queryset()
+
+    def test_liste_activites(self):
+        # Liste non paginée : la table des activités est lue en entier, les 8 tables jointes par clé primaire
+        queryset = self.queryset_vue(ActiviteViewSet, '/api/activites/')
+        self.assertSansParcoursSequentiel(queryset, autorisees={'api_activite'})
+        # Requête du prefetch_related('suivis')
+        ids = list(queryset.values_list('id', flat=True)[:100])
+        self.assertSansParcoursSequentiel(Suivi.objects.filter(activite_id__in=ids))
+
+    def test_liste_activites_par_structure(self):
+        self.assertSansParcoursSequentiel(
+            self.queryset_vue(ActiviteViewSet, f'/api/activites/?structure={self.structure.id}')
+        )
+
+    def test_liste_activites_par_etat(self):
+        self.assertSansParcoursSequentiel(self.queryset_vue(ActiviteViewSet, '/api/activites/?etat=Annulé'))
+
+    def test_activites_candidates_au_retard(self):
+        # Index partiel sur date_fin des activités non terminées
+        self.assertSansParcoursSequentiel(
+            Activite.objects.filter(date_fin__lt=date(2025, 3, 1)).exclude(etat='Terminé')
+        )
+
+    def test_activites_a_risque(self):
+        # Liste /api/activites/previsions/ : lue dans l'ordre de l'index sur le risque
+        self.assertSansParcoursSequentiel(
+            Activite.objects.select_related('structure').filter(risque_retard__gte=0.5)
+            .order_by('-risque_retard', '-id')[:101]
+        )
+
+    def test_suivis_par_activite(self):
+        self.assertSansParcoursSequentiel(self.queryset_vue(
+            SuiviViewSet, f'/api/suivis/?activite_id={self.suivi.activite_id}&date_suivi={self.suivi.date_suivi}',
+        ))
+        self.assertSansParcoursSequentiel(
+            self.queryset_vue(SuiviViewSet, f'/api/suivis/?activite_id={self.suivi.activite_id}')
+        )
+
+    def test_page_de_suivis(self):
+        # Page suivante de la pagination par curseur : position (date_suivi, id) lue dans l'index
+        queryset = self.queryset_vue(SuiviViewSet, '/api/suivis/?page_size=50')
+        self.assertSansParcoursSequentiel(
+            queryset.filter(date_suivi__lt=self.suivi.date_suivi).order_by('-date_suivi', '-id')[:51]
+        )
+
+    def test_tableau_de_bord(self):
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        # Les agrégats portent sur des tables entières : ce qui compte est qu'aucune n'est relue
+        analyses = self.assertAppelSansParcoursSequentiel(
+            lambda: client.get('/api/dashboard-stats/'),
+            autorisees={
+                'api_activite', 'api_suivi', 'api_userprofile', 'api_structure', 'api_direction', 'api_service',
+                'api_division', 'api_objectifgeneral', 'api_objectifspecifique', 'api_resultatattendu',
+            },
+        )
+        lectures_activites = [sql for sql, _, tables in analyses if 'api_activite' in tables]
+        self.assertLessEqual(len(lectures_activites), 1, lectures_activites)
+
+    def test_export(self):
+        # Les feuilles de synthèse listent l'organisation et le cadre logique en entier
+        self.assertAppelSansParcoursSequentiel(
+            lambda: construire_classeur_pta(sous_totaux=True),
+            autorisees={
+                'api_activite', 'api_structure', 'api_direction', 'api_service', 'api_division',
+                'api_objectifgeneral', 'api_objectifspecifique', 'api_resultatattendu',
+            },
+        )
+        self.assertAppelSansParcoursSequentiel(
+            lambda: list(lignes_pta({'structure': [self.structure.id]})),
+        )
+
+
+class BenchmarkTests(TestCase):
+    def test_comparaison_reference(self):
+        reference = {'resultats': {'100': {'activites_liste': {
+            'statut': 200, 'duree_ms': 100.0, 'requetes': 2, 'pic_memoire_octets': 1000, 'octets': 500,
+        }}}}
+        identique = {'resultats': {'100': {'activites_liste': dict(reference['resultats']['100']['activites_liste'])}}}
+        self.assertEqual(comparer(identique, reference), [])
+
+        degrade = {'resultats': {'100': {'activites_liste': {
+            'statut': 200, 'duree_ms': 180.0, 'requetes': 3, 'pic_memoire_octets': 1100, 'octets': 500,
+        }}}}
+        regressions = comparer(degrade, reference)
+        self.assertEqual(len(regressions), 2)
+        self.assertIn('requêtes SQL', regressions[0])
+        self.assertIn('duree_ms', regressions[1])
+
+
+class ChargeTests(SimpleTestCase):
+    def test_rapport_charge(self):
+        self.assertEqual(centile(list(range(1, 101)), 95), 95)
+        self.assertEqual(centile([7], 99), 7)
+        mesures = {
+            'requetes': [
+                ('activites', '/api/activites/', 0.1, 200, 100, None),
+                ('activites', '/api/activites/', 0.3, 500, 20, None),
+                ('activites', '/api/pcop/', 0.2, None, 0, 'delai depasse'),
+            ],
+            'pages': [('activites', 0.3)],
+        }
+        rapport = rapport_charge(mesures, 2.0)
+        self.assertEqual(rapport['debit_requetes_s'], 1.5)
+        self.assertEqual(rapport['global']['erreurs'], 2)
+        self.assertEqual(rapport['points_acces']['/api/activites/']['p50_ms'], 100.0)
+        self.assertEqual(rapport['statuts'], {'200': 1, '500': 1, 'delai depasse': 1})
+
+
+class ServerTimingTests(TestCase):
+    def test_entete_server_timing(self):
+        creer_activites(2)
+        client = APIClient()
+        client.force_authenticate(User.objects.create_superuser('admin', 'admin@example.com', 'admin'))
+        response = client.get('/api/activites/')
+        entete = response['Server-Timing']
+        for mesure in ('sql;dur=', 'serialisation;dur=', 'rendu;dur=', 'total;dur='):
+            self.assertIn(mesure, entete)
+        self.assertRegex(entete, r'desc="\d+ requetes"')
+
+
+class MetriquesTests(TestCase):
+    def setUp(self):
+        # Les instruments sont enregistrés une seule fois dans le registre global de prometheus_client
+        self.addCleanup(setattr, metriques, '_metriques', metriques._metriques)
+        self.addCleanup(setattr, metriques, '_indisponible', metriques._indisponible)
+
+    def test_sans_prometheus_client(self):
+        metriques._metriques, metriques._indisponible = None, False
+        with mock.patch.dict(sys.modules, {'prometheus_client': None}):
+            self.assertIsNone(metriques.metriques())
+            metriques.observer_requete('activites', 'GET', 200, 0.01, 3, taille=100)
+            metriques.observer_cache_export('pta_xlsx', True, duree=0.5)
+            metriques.observer_job('export_pta', 'termine', 1.0)
+            response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 501)
+        self.assertIn('prometheus_client', response.content.decode())
+        self.assertTrue(metriques._indisponible)
+
+    def test_exposition(self):
+        try:
+            import prometheus_client  # noqa: F401
+        except ImportError:
+            self.skipTest("prometheus_client non installé")
+        Job.objects.create(type='export_pta', statut='en_attente')
+        self.client.get('/metrics')  # observée par le middleware, visible au passage suivant
+        contenu = self.client.get('/metrics').content.decode()
+        self.assertIn('pta_jobs_file{statut="en_attente"} 1.0', contenu)
+        self.assertIn('pta_http_requetes_total{', contenu)
+
+        with self.settings(METRIQUES_IPS_AUTORISEES=['10.0.0.1']):
+            self.assertEqual(self.client.get('/metrics').status_code, 403)
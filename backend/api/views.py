@@ -1,20 +1,41 @@
-import logging
 import io
-from datetime import datetime
-from django.db.models import Count, Sum, Avg
-from rest_framework import viewsets, status
+import logging
+import os
+from datetime import date
+from django.db.models import Count, Sum, Avg, Q
+from django.http import FileResponse, StreamingHttpResponse
+from rest_framework import mixins, viewsets, status
 from rest_framework.decorators import api_view, permission_classes, action
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.response import Response
+from rest_framework.exceptions import PermissionDenied
+from rest_framework.parsers import JSONParser, MultiPartParser
 from django.http import HttpResponse
-import openpyxl
-from openpyxl.utils import get_column_letter
-from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-from openpyxl.styles import numbers
+from django.utils import timezone
 from django.contrib.auth.models import User
-from .models import UserProfile, Service, Activite, PCOPEntry, Suivi, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Direction, Division, Structure
-from .serializers import UserProfileSerializer, ServiceSerializer, ActiviteSerializer, PCOPEntrySerializer, SuiviSerializer, ObjectifGeneralSerializer, ObjectifSpecifiqueSerializer, ResultatAttenduSerializer, DirectionSerializer, DivisionSerializer, StructureSerializer
+from .models import UserProfile, Service, Activite, PCOPEntry, Suivi, ObjectifGeneral, ObjectifSpecifique, ResultatAttendu, Direction, Division, Structure, Job, AnomalieBudget, SourceFinancement, Cible, InstantanePTA
+from .serializers import UserProfileSerializer, ServiceSerializer, ActiviteSerializer, PCOPEntrySerializer, SuiviSerializer, ObjectifGeneralSerializer, ObjectifSpecifiqueSerializer, ResultatAttenduSerializer, DirectionSerializer, DivisionSerializer, StructureSerializer, JobSerializer, PrevisionActiviteSerializer, AnomalieBudgetSerializer, SourceFinancementSerializer, CibleSerializer, InstantanePTASerializer
 from .permissions import RolePermission, AdminOnlyPermission, SuperviseurAndAdminPermission, ReadOnlyPermission
+from .exports import (
+    CONTENT_TYPE_CSV, CONTENT_TYPE_PARQUET, CONTENT_TYPE_XLSX,
+    artefact_parquet_pta, artefact_pta, ecrire_parquet_pta, flux_csv_pta, nom_fichier_export, nom_fichier_pta,
+)
+from .filtres import filtrer_activites, filtrer_anomalies, filtrer_suivis, lire_filtres_activites
+from .pagination import PaginationAnomalies, PaginationPrevisions, PaginationSuivis
+from .paquets import DECOUPAGES, artefact_paquet, nom_fichier_paquet
+from .artefacts import horodatage_artefact, reponse_fichier
+from .jobs import soumettre_job, peut_soumettre
+from .requetes_lentes import lire_entrees
+from .profilage import armer_profilage, chemin_profil, desarmer_profilage, etat_profilage, lister_profils
+from .series import NIVEAUX_SERIE, PAS, serie_progression
+from .previsions import RISQUE_ELEVE
+from .dimensions import budget_par_dimension
+from .instantanes import (
+    LIMITE_DETAILS, NIVEAUX_COMPARAISON, NIVEAUX_DEFAUT as NIVEAUX_COMPARAISON_DEFAUT,
+    comparer, contenu_courant, contenu_instantane, figer_pta, lignes_instantane,
+)
+from .simulation import NIVEAUX_DEFAUT, NIVEAUX_SIMULATION, lire_regles, simuler
+from .imports import ErreurImport, importer_pcop, importer_cadre_logique, aplatir_arbre, lire_noeuds_fichier
 
 # Configuration du logger
 logger = logging.getLogger(__name__)
@@ -68,6 +89,22 @@ class ObjectifGeneralViewSet(viewsets.ModelViewSet):
     serializer_class = ObjectifGeneralSerializer
     permission_classes = [IsAuthenticated, RolePermission]
 
+    # ✅ IMPORT EN MASSE DE L'ARBRE DES OBJECTIFS (JSON IMBRIQUÉ OU TABLEUR)
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[IsAuthenticated, SuperviseurAndAdminPermission],
+            parser_classes=[JSONParser, MultiPartParser])
+    def importer(self, request):
+        try:
+            fichier = request.FILES.get('fichier')
+            if fichier:
+                noeuds = lire_noeuds_fichier(fichier, fichier.name)
+            else:
+                noeuds = aplatir_arbre(request.data)
+            bilan = importer_cadre_logique(noeuds)
+        except ErreurImport as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(bilan)
+
 class ObjectifSpecifiqueViewSet(viewsets.ModelViewSet):
     queryset = ObjectifSpecifique.objects.select_related('objectif_general').prefetch_related('resultats_attendus').all()
     serializer_class = ObjectifSpecifiqueSerializer
@@ -93,7 +130,7 @@ class ActiviteViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated, RolePermission]
 
     def get_queryset(self):
-        return Activite.objects.select_related(
+        queryset = Activite.objects.select_related(
             'structure',
             'direction',
             'service', 
@@ -103,6 +140,39 @@ class ActiviteViewSet(viewsets.ModelViewSet):
             'resultat_attendu',
             'pcop'
         ).prefetch_related('suivis')
+        # ✅ FILTRES (structure, direction, objectif, période, état...)
+        return filtrer_activites(queryset, lire_filtres_activites(self.request.query_params))
+
+    # ✅ SÉRIE COMPACTE POUR LES GRAPHIQUES : [[date, avancement], ...] sans charger l'activité
+    @action(detail=True, methods=['get'], url_path='progress')
+    def progression(self, request, pk=None):
+        try:
+            pk = int(pk)
+        except ValueError:
+            return Response({'error': 'Activité introuvable'}, status=status.HTTP_404_NOT_FOUND)
+        serie = list(
+            Suivi.objects.filter(activite_id=pk).order_by('date_suivi', 'id').values_list('date_suivi', 'avancement')
+        )
+        if not serie and not Activite.objects.filter(pk=pk).exists():
+            return Response({'error': 'Activité introuvable'}, status=status.HTTP_404_NOT_FOUND)
+        return Response([[date_suivi, avancement] for date_suivi, avancement in serie])
+
+    # ✅ ACTIVITÉS PROBABLEMENT EN RETARD : prévisions enregistrées par la tâche prevoir_achevements
+    @action(detail=False, methods=['get'], url_path='previsions')
+    def previsions(self, request):
+        try:
+            risque_min = float(request.query_params.get('risque_min', RISQUE_ELEVE))
+        except ValueError:
+            return Response({'error': 'risque_min doit être un nombre entre 0 et 1'}, status=status.HTTP_400_BAD_REQUEST)
+        queryset = filtrer_activites(
+            Activite.objects.select_related('structure').filter(risque_retard__gte=risque_min),
+            lire_filtres_activites(request.query_params),
+        ).order_by('-risque_retard', '-id')
+        paginator = PaginationPrevisions()
+        page = paginator.paginate_queryset(queryset, request, view=self)
+        if page is not None:
+            return paginator.get_paginated_response(PrevisionActiviteSerializer(page, many=True).data)
+        return Response(PrevisionActiviteSerializer(queryset, many=True).data)
 
     def perform_create(self, serializer):
         data = serializer.validated_data
@@ -119,32 +189,30 @@ class PCOPEntryViewSet(viewsets.ModelViewSet):
     serializer_class = PCOPEntrySerializer
     permission_classes = [IsAuthenticated, SuperviseurAndAdminPermission]
 
+    # ✅ IMPORT EN MASSE DE LA NOMENCLATURE (CSV / XLSX)
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[IsAuthenticated, AdminOnlyPermission], parser_classes=[MultiPartParser])
+    def importer(self, request):
+        fichier = request.FILES.get('fichier')
+        if not fichier:
+            return Response({'error': 'Le champ fichier est obligatoire'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            bilan = importer_pcop(fichier, fichier.name)
+        except ErreurImport as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(bilan)
+
 class SuiviViewSet(viewsets.ModelViewSet):
-    queryset = Suivi.objects.select_related('activite').all()
+    # ✅ select_related aligné sur SuiviSerializer (activite_nom, activite_objectif)
+    queryset = Suivi.objects.select_related('activite__objectif_general').all()
     serializer_class = SuiviSerializer
     permission_classes = [IsAuthenticated, RolePermission]
+    # ✅ PAGINATION PAR CURSEUR À LA DEMANDE (?page_size=50, puis ?cursor=...)
+    pagination_class = PaginationSuivis
 
     def get_queryset(self):
-        user = self.request.user
-        queryset = Suivi.objects.select_related('activite')
-        
-        activite_id = self.request.query_params.get('activite_id')
-        if activite_id:
-            queryset = queryset.filter(activite_id=activite_id)
-        
-        date_suivi = self.request.query_params.get('date_suivi')
-        if date_suivi:
-            queryset = queryset.filter(date_suivi=date_suivi)
-        
-        if user.is_superuser:
-            return queryset
-        try:
-            user_profile = user.userprofile
-            if user_profile.role in ['admin', 'superviseur']:
-                return queryset
-        except AttributeError:
-            pass
-        return queryset
+        # ✅ FILTRES activite_id, date_suivi et période du / au
+        return filtrer_suivis(self.queryset.all(), self.request.query_params)
 
     def perform_create(self, serializer):
         data = serializer.validated_data
@@ -158,6 +226,148 @@ class SuiviViewSet(viewsets.ModelViewSet):
         
         serializer.save()
 
+# ✅ SOURCES DE FINANCEMENT ET CIBLES : listes et budget par entrée (GROUP BY sur les tables de liens)
+class SourceFinancementViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = SourceFinancement.objects.all()
+    serializer_class = SourceFinancementSerializer
+    permission_classes = [IsAuthenticated, RolePermission]
+
+    @action(detail=False, methods=['get'])
+    def budget(self, request):
+        return Response(budget_par_dimension(SourceFinancement, 'sources', lire_filtres_activites(request.query_params)))
+
+class CibleViewSet(viewsets.ReadOnlyModelViewSet):
+    queryset = Cible.objects.all()
+    serializer_class = CibleSerializer
+    permission_classes = [IsAuthenticated, RolePermission]
+
+    @action(detail=False, methods=['get'])
+    def budget(self, request):
+        return Response(budget_par_dimension(Cible, 'groupes_cibles', lire_filtres_activites(request.query_params)))
+
+# ✅ ANOMALIES BUDGÉTAIRES : résultat de la dernière analyse (tâche detecter_anomalies)
+class AnomalieBudgetViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    queryset = AnomalieBudget.objects.select_related('activite', 'pcop')
+    serializer_class = AnomalieBudgetSerializer
+    permission_classes = [IsAuthenticated, SuperviseurAndAdminPermission]
+    pagination_class = PaginationAnomalies
+
+    def get_queryset(self):
+        # ✅ FILTRES type et filtres des activités (structure, pcop, état...)
+        return filtrer_anomalies(self.queryset.all(), self.request.query_params)
+
+# ✅ INSTANTANÉS FIGÉS DU PTA : création, tableau de bord et exports historiques, comparaison
+class InstantanePTAViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    # Les colonnes compressées ne sont lues que par les routes qui en ont besoin
+    queryset = InstantanePTA.objects.select_related('cree_par').defer('donnees', 'statistiques')
+    serializer_class = InstantanePTASerializer
+    permission_classes = [IsAuthenticated, SuperviseurAndAdminPermission]
+
+    def get_queryset(self):
+        annee = self.request.query_params.get('annee')
+        if annee and annee.isdigit():
+            return self.queryset.filter(annee=int(annee))
+        return self.queryset.all()
+
+    def create(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        # ✅ FIGEMENT EN ARRIÈRE-PLAN avec ?asynchrone=1 (gros PTA)
+        if request.query_params.get('asynchrone') in ('1', 'true'):
+            job = soumettre_job('figer_pta', request.user, parametres=serializer.validated_data)
+            return Response(JobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+        instantane = figer_pta(utilisateur=request.user, **serializer.validated_data)
+        return Response(self.get_serializer(instantane).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=True, methods=['get'], url_path='tableau-de-bord')
+    def tableau_de_bord(self, request, pk=None):
+        instantane = self.get_object()
+        return Response({**InstantanePTASerializer(instantane).data, 'statistiques': instantane.statistiques})
+
+    @action(detail=True, methods=['get'], url_path='export-csv')
+    def export_csv(self, request, pk=None):
+        instantane = self.get_object()
+        lignes = lignes_instantane(contenu_instantane(instantane), lire_filtres_activites(request.query_params))
+        logger.info(f"Export CSV de l'instantané {instantane.pk} par l'utilisateur: {request.user.username}")
+        response = StreamingHttpResponse(flux_csv_pta(lignes=lignes), content_type=CONTENT_TYPE_CSV)
+        response['Content-Disposition'] = f'attachment; filename="{nom_fichier_export(f"PTA_Instantane_{instantane.pk}", "csv")}"'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='export-parquet')
+    def export_parquet(self, request, pk=None):
+        instantane = self.get_object()
+        lignes = lignes_instantane(contenu_instantane(instantane), lire_filtres_activites(request.query_params))
+        fichier = io.BytesIO()
+        try:
+            ecrire_parquet_pta(fichier, lignes=lignes)
+        except ImportError:
+            return Response({'error': "L'export Parquet nécessite le paquet pyarrow"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        response = HttpResponse(fichier.getvalue(), content_type=CONTENT_TYPE_PARQUET)
+        response['Content-Disposition'] = f'attachment; filename="{nom_fichier_export(f"PTA_Instantane_{instantane.pk}", "parquet")}"'
+        return response
+
+    @action(detail=True, methods=['get'])
+    def comparer(self, request, pk=None):
+        # ✅ ?avec=<id d'un autre instantané> ou ?avec=courant (PTA actuel)
+        instantane = self.get_object()
+        avec = request.query_params.get('avec', '')
+        niveaux = [n for n in request.query_params.get('niveaux', '').split(',') if n] or list(NIVEAUX_COMPARAISON_DEFAUT)
+        if set(niveaux) - set(NIVEAUX_COMPARAISON):
+            return Response({'error': f"Niveaux invalides (valeurs possibles : {', '.join(NIVEAUX_COMPARAISON)})"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limite = min(int(request.query_params.get('details', LIMITE_DETAILS)), LIMITE_DETAILS)
+        except ValueError:
+            return Response({'error': "Le paramètre details doit être un entier"}, status=status.HTTP_400_BAD_REQUEST)
+        if avec == 'courant':
+            autre, apres = {'id': None, 'nom': "PTA courant"}, contenu_courant()
+        elif avec.isdigit():
+            # Hors du filtre ?annee= de la liste : on compare volontairement d'une année à l'autre
+            reference = InstantanePTA.objects.filter(pk=int(avec)).first()
+            if reference is None:
+                return Response({'error': "Instantané de comparaison introuvable"}, status=status.HTTP_404_NOT_FOUND)
+            autre, apres = {'id': reference.pk, 'nom': reference.nom}, contenu_instantane(reference)
+        else:
+            return Response({'error': "Indiquez avec=<id d'instantané> ou avec=courant"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            ecarts = comparer(contenu_instantane(instantane), apres, niveaux, max(limite, 0))
+        except ImportError:
+            return Response({'error': "La comparaison nécessite le paquet numpy"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        return Response({'avant': {'id': instantane.pk, 'nom': instantane.nom}, 'apres': autre, **ecarts})
+
+# ✅ TÂCHES D'ARRIÈRE-PLAN : SOUMISSION, SUIVI ET TÉLÉCHARGEMENT DU RÉSULTAT
+class JobViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    serializer_class = JobSerializer
+    permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser]
+
+    def get_queryset(self):
+        user = self.request.user
+        queryset = Job.objects.select_related('cree_par')
+        if user.is_superuser:
+            return queryset
+        try:
+            if user.userprofile.role == 'admin':
+                return queryset
+        except AttributeError:
+            pass
+        return queryset.filter(cree_par=user)
+
+    def perform_create(self, serializer):
+        if not peut_soumettre(self.request.user, serializer.validated_data['type']):
+            raise PermissionDenied("Vous n'avez pas le droit de lancer ce type de tâche")
+        serializer.save(cree_par=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def telecharger(self, request, pk=None):
+        job = self.get_object()
+        if job.statut != 'termine' or not job.fichier_resultat:
+            return Response({'error': "Aucun fichier disponible pour cette tâche"}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(
+            job.fichier_resultat.open('rb'),
+            as_attachment=True,
+            filename=os.path.basename(job.fichier_resultat.name),
+        )
+
 # VUES EXISTANTES (inchangées)
 @api_view(['POST'])
 @permission_classes([IsAuthenticated, AdminOnlyPermission])
@@ -272,35 +482,45 @@ def get_user_profile(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated, SuperviseurAndAdminPermission])
 def get_dashboard_stats(request):
+    # ✅ UNE REQUÊTE AGRÉGÉE PAR TABLE (plus de COUNT par état, par rôle ou par structure)
+    activites = Activite.objects.aggregate(
+        total=Count('id'),
+        montant=Sum('montant'),
+        en_cours=Count('id', filter=Q(etat='En cours')),
+        termine=Count('id', filter=Q(etat='Terminé')),
+        en_attente=Count('id', filter=Q(etat='En attente')),
+    )
+    roles = dict(UserProfile.objects.values_list('role').annotate(nb=Count('id')).order_by())
+    suivis = Suivi.objects.aggregate(total=Count('id'), moyenne=Avg('avancement'))
     stats = {
-        'total_users': UserProfile.objects.count(),
+        'total_users': sum(roles.values()),
         'total_directions': Direction.objects.count(),
         'total_services': Service.objects.count(),
         'total_divisions': Division.objects.count(),
-        'total_activites': Activite.objects.count(),
-        'total_suivis': Suivi.objects.count(),
+        'total_activites': activites['total'],
+        'total_suivis': suivis['total'],
         'total_structures': Structure.objects.count(),  # Correction: Count() -> count()
-        'budget_total': PCOPEntry.objects.aggregate(total=Sum('budget'))['total'] or 0,
-        'montant_total_activites': Activite.objects.aggregate(total=Sum('montant'))['total'] or 0,
-        'moyenne_avancement': Suivi.objects.aggregate(moyenne=Avg('avancement'))['moyenne'] or 0,
+        # Le budget du PTA est la somme des montants des activités (PCOPEntry n'a pas de champ budget)
+        'budget_total': activites['montant'] or 0,
+        'montant_total_activites': activites['montant'] or 0,
+        'moyenne_avancement': suivis['moyenne'] or 0,
         'users_by_role': {
-            'admin': UserProfile.objects.filter(role='admin').count(),
-            'superviseur': UserProfile.objects.filter(role='superviseur').count(),
-            'user': UserProfile.objects.filter(role='user').count(),
+            'admin': roles.get('admin', 0),
+            'superviseur': roles.get('superviseur', 0),
+            'user': roles.get('user', 0),
         },
         'activites_by_etat': {
-            'en_cours': Activite.objects.filter(etat='En cours').count(),
-            'termine': Activite.objects.filter(etat='Terminé').count(),
-            'en_attente': Activite.objects.filter(etat='En attente').count(),
+            'en_cours': activites['en_cours'],
+            'termine': activites['termine'],
+            'en_attente': activites['en_attente'],
         },
         # ✅ NOUVELLES STATISTIQUES
         'objectifs_generaux_count': ObjectifGeneral.objects.count(),
         'objectifs_specifiques_count': ObjectifSpecifique.objects.count(),
         'resultats_attendus_count': ResultatAttendu.objects.count(),
-        'activites_by_structure': {
-            structure.nom: Activite.objects.filter(structure=structure).count()
-            for structure in Structure.objects.all()
-        }
+        'activites_by_structure': dict(
+            Structure.objects.annotate(nb=Count('activites')).values_list('nom', 'nb')
+        ),
     }
     return Response(stats)
 
@@ -342,267 +562,165 @@ def get_initial_data(request):
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def export_pta_excel(request):
+    # ✅ MÊMES FILTRES QUE LA LISTE DES ACTIVITÉS (structure, objectif, période, état...)
+    filtres = lire_filtres_activites(request.query_params)
+    decoupage = request.query_params.get('decoupage')
+    sous_totaux = request.query_params.get('sous_totaux') in ('1', 'true')
+    if decoupage and decoupage not in DECOUPAGES:
+        return Response({'error': f"Découpage invalide (valeurs possibles : {', '.join(DECOUPAGES)})"}, status=400)
     try:
-        logger.info(f"Début de l'export Excel par l'utilisateur: {request.user.username}")
-        
-        wb = openpyxl.Workbook()
-        
-        # Styles réutilisables
-        header_font = Font(bold=True, color="FFFFFF", size=12)
-        header_fill = PatternFill(start_color="2E86AB", end_color="2E86AB", fill_type="solid")
-        border_style = Side(border_style="thin", color="000000")
-        border = Border(left=border_style, right=border_style, top=border_style, bottom=border_style)
-        center_align = Alignment(horizontal="center", vertical="center", wrap_text=True)
-        left_align = Alignment(horizontal="left", vertical="center", wrap_text=True)
-        
-        # ---------- FEUILLE PRINCIPALE PTA ----------
-        ws_pta = wb.active
-        ws_pta.title = "PTA_PRINCIPAL"
-        
-        ws_pta.merge_cells('A1:S1')
-        title_cell = ws_pta.cell(row=1, column=1)
-        title_cell.value = "PLAN DE TRAVAIL ANNUEL (PTA) - EXPORT COMPLET"
-        title_cell.font = Font(bold=True, size=16, color="2E86AB")
-        title_cell.alignment = center_align
-        
-        ws_pta.merge_cells('A2:S2')
-        meta_cell = ws_pta.cell(row=2, column=1)
-        meta_cell.value = f"Export généré le {datetime.now().strftime('%d/%m/%Y à %H:%M')} par {request.user.username}"
-        meta_cell.font = Font(italic=True, size=10, color="666666")
-        meta_cell.alignment = center_align
-        
-        headers = [
-            "OBJECTIFS GENERAUX", "OBJECTIFS SPECIFIQUES", "RESULTATS ATTENDUS",
-            "STRUCTURE", "DIRECTION", "SERVICE", "DIVISION", "ACTIVITES",
-            "SOUS-ACTIVITES", "PRODUITS", "CIBLES", "SOURCES DE FINANCEMENT",
-            "CODE PCOP", "LIBELLE PCOP", "COUT UNITAIRE (Ar)", "QUANTITE", "MONTANT TOTAL (Ar)", "OBSERVATIONS", "ETAT"
-        ]
-        
-        ws_pta.append([])
-        ws_pta.append(headers)
-        
-        for col_num, header in enumerate(headers, 1):
-            cell = ws_pta.cell(row=4, column=col_num)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = center_align
-            cell.border = border
-        
-        # ✅ MODIFICATION: Inclure toutes les relations hiérarchiques
-        activites = Activite.objects.select_related(
-            'structure',
-            'direction', 
-            'service', 
-            'division',
-            'objectif_general', 
-            'objectif_specifique', 
-            'resultat_attendu',
-            'pcop'
-        ).all()
-        
-        total_montant = 0
-        row_count = 0
-        
-        for activite in activites:
-            # ✅ MODIFICATION: Récupérer les informations via la nouvelle structure
-            row_data = [
-                activite.objectif_general_titre if activite.objectif_general else "Non spécifié",
-                activite.objectif_specifique_titre if activite.objectif_specifique else "Non spécifié",
-                activite.resultat_attendu_description if activite.resultat_attendu else "Non spécifié",
-                activite.structure_nom if activite.structure else "Non spécifié",
-                activite.direction_nom if activite.direction else "Non spécifié",
-                activite.service_nom if activite.service else "Non assigné",
-                activite.division_nom if activite.division else "Non spécifié",
-                activite.activite or "Non spécifié",
-                activite.sous_activite or "Non spécifié",
-                activite.produits or "Non spécifié",
-                activite.cibles or "Non spécifié",
-                activite.sources_financement or "Non spécifié",
-                activite.pcop_code if activite.pcop else "Non spécifié",
-                activite.pcop_libelle if activite.pcop else "Non spécifié",
-                float(activite.cout_unitaire) if activite.cout_unitaire else 0.0,
-                float(activite.quantite) if activite.quantite else 0.0,
-                float(activite.montant) if activite.montant else 0.0,
-                activite.observation or "Aucune",
-                activite.etat or "En cours"
-            ]
-            
-            ws_pta.append(row_data)
-            row_count += 1
-            
-            if activite.montant:
-                total_montant += activite.montant
-            
-            for col_num in range(1, len(headers) + 1):
-                cell = ws_pta.cell(row=4 + row_count, column=col_num)
-                cell.border = border
-                cell.alignment = left_align
-                
-                if col_num in [15, 16, 17]:
-                    cell.number_format = '#,##0.00'
-                    cell.alignment = Alignment(horizontal="right", vertical="center")
-        
-        if row_count > 0:
-            total_row = 5 + row_count
-            ws_pta.merge_cells(f'A{total_row}:P{total_row}')
-            total_label = ws_pta.cell(row=total_row, column=1)
-            total_label.value = f"TOTAL GÉNÉRAL ({row_count} activités)"
-            total_label.font = Font(bold=True, size=12, color="2E86AB")
-            total_label.alignment = Alignment(horizontal="right", vertical="center")
-            
-            total_cell = ws_pta.cell(row=total_row, column=17)
-            total_cell.value = float(total_montant)
-            total_cell.font = Font(bold=True, size=12, color="2E86AB")
-            total_cell.number_format = '#,##0.00'
-            total_cell.border = border
-        
-        for column in ws_pta.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            
-            for cell in column:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:
-                    pass
-            
-            adjusted_width = min(max_length + 2, 50)
-            ws_pta.column_dimensions[column_letter].width = adjusted_width
-        
-        # ---------- FEUILLE STRUCTURE LOGIQUE ----------
-        ws_structure = wb.create_sheet("STRUCTURE_LOGIQUE")
-        
-        ws_structure.merge_cells('A1:D1')
-        title_cell = ws_structure.cell(row=1, column=1)
-        title_cell.value = "STRUCTURE LOGIQUE - OBJECTIFS ET RÉSULTATS"
-        title_cell.font = Font(bold=True, size=14, color="2E86AB")
-        title_cell.alignment = center_align
-        
-        structure_headers = ["Objectif Général", "Objectif Spécifique", "Résultat Attendu", "Nombre d'Activités"]
-        ws_structure.append(structure_headers)
-        
-        for col_num, header in enumerate(structure_headers, 1):
-            cell = ws_structure.cell(row=2, column=col_num)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = center_align
-            cell.border = border
-        
-        row_num = 3
-        objectifs_generaux = ObjectifGeneral.objects.prefetch_related(
-            'objectifs_specifiques__resultats_attendus'
-        ).all()
-        
-        for og in objectifs_generaux:
-            for os in og.objectifs_specifiques.all():
-                for ra in os.resultats_attendus.all():
-                    activites_count = Activite.objects.filter(resultat_attendu=ra).count()
-                    ws_structure.append([
-                        f"{og.numero} - {og.titre}",
-                        f"{os.numero} - {os.titre}",
-                        f"{ra.numero} - {ra.description}",
-                        activites_count
-                    ])
-                    
-                    for col_num in range(1, 5):
-                        cell = ws_structure.cell(row=row_num, column=col_num)
-                        cell.border = border
-                        cell.alignment = left_align
-                    
-                    row_num += 1
-        
-        # Ajustement des colonnes
-        for column in ws_structure.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            
-            for cell in column:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:
-                    pass
-            
-            adjusted_width = min(max_length + 2, 50)
-            ws_structure.column_dimensions[column_letter].width = adjusted_width
-        
-        # ---------- FEUILLE STRUCTURE ORGANISATIONNELLE ----------
-        ws_org = wb.create_sheet("STRUCTURE_ORGANISATIONNELLE")
-        
-        ws_org.merge_cells('A1:E1')
-        title_cell = ws_org.cell(row=1, column=1)
-        title_cell.value = "STRUCTURE ORGANISATIONNELLE - STRUCTURES, DIRECTIONS, SERVICES ET DIVISIONS"
-        title_cell.font = Font(bold=True, size=14, color="2E86AB")
-        title_cell.alignment = center_align
-        
-        org_headers = ["Structure", "Direction", "Service", "Division", "Nombre d'Activités"]
-        ws_org.append(org_headers)
-        
-        for col_num, header in enumerate(org_headers, 1):
-            cell = ws_org.cell(row=2, column=col_num)
-            cell.font = header_font
-            cell.fill = header_fill
-            cell.alignment = center_align
-            cell.border = border
-        
-        row_num = 3
-        structures = Structure.objects.prefetch_related('directions__services__divisions').all()
-        
-        for structure in structures:
-            for direction in structure.directions.all():
-                for service in direction.services.all():
-                    for division in service.divisions.all():
-                        activites_count = Activite.objects.filter(division=division).count()
-                        ws_org.append([
-                            f"{structure.numero} - {structure.nom}",
-                            f"{direction.numero} - {direction.nom}",
-                            f"{service.numero} - {service.nom_service}",
-                            f"{division.numero} - {division.nom}",
-                            activites_count
-                        ])
-                    
-                        for col_num in range(1, 6):
-                            cell = ws_org.cell(row=row_num, column=col_num)
-                            cell.border = border
-                            cell.alignment = left_align
-                    
-                        row_num += 1
-        
-        # Ajustement des colonnes
-        for column in ws_org.columns:
-            max_length = 0
-            column_letter = get_column_letter(column[0].column)
-            
-            for cell in column:
-                try:
-                    if cell.value:
-                        max_length = max(max_length, len(str(cell.value)))
-                except:
-                    pass
-            
-            adjusted_width = min(max_length + 2, 50)
-            ws_org.column_dimensions[column_letter].width = adjusted_width
-        
-        # ---------- PRÉPARATION DE LA RÉPONSE ----------
-        file_buffer = io.BytesIO()
-        wb.save(file_buffer)
-        file_buffer.seek(0)
-        
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        filename = f"PTA_Export_Complet_{timestamp}.xlsx"
-        
-        response = HttpResponse(
-            file_buffer.getvalue(),
-            content_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-        )
-        response['Content-Disposition'] = f'attachment; filename="{filename}"'
-        response['Content-Length'] = len(file_buffer.getvalue())
+        logger.info(f"Début de l'export Excel par l'utilisateur: {request.user.username} (filtres: {filtres})")
+
+        # ✅ EXPORT EN ARRIÈRE-PLAN : le classeur est construit par `manage.py runworker`
+        if request.query_params.get('asynchrone') in ('1', 'true'):
+            parametres = {'filtres': filtres}
+            if decoupage:
+                parametres['decoupage'] = decoupage
+            if sous_totaux:
+                parametres['sous_totaux'] = True
+            job = soumettre_job('export_pta', request.user, parametres=parametres)
+            return Response(JobSerializer(job, context={'request': request}).data, status=status.HTTP_202_ACCEPTED)
+
+        # ✅ UN CLASSEUR PAR STRUCTURE / DIRECTION : archive ZIP construite en parallèle
+        if decoupage:
+            chemin, depuis_cache = artefact_paquet(decoupage, filtres)
+            filename = nom_fichier_paquet(decoupage, timestamp=horodatage_artefact(chemin))
+            response = reponse_fichier(request, chemin, filename, 'application/zip')
+            logger.info(f"Export ZIP par {decoupage} réussi: {filename} ({'depuis le cache' if depuis_cache else 'généré'})")
+            return response
+
+        # ✅ CLASSEUR PRÉCALCULÉ : reconstruit uniquement si les données ont changé
+        # ✅ SOUS-TOTAUX PAR STRUCTURE / DIRECTION / SERVICE avec ?sous_totaux=1
+        chemin, depuis_cache = artefact_pta(filtres, sous_totaux=sous_totaux)
+        filename = nom_fichier_pta(filtres, timestamp=horodatage_artefact(chemin), sous_totaux=sous_totaux)
+        response = reponse_fichier(request, chemin, filename, CONTENT_TYPE_XLSX)
         
-        logger.info(f"Export Excel réussi: {filename} - {row_count} activités exportées")
+        logger.info(f"Export Excel réussi: {filename} ({'depuis le cache' if depuis_cache else 'généré'})")
         return response
         
     except Exception as e:
         logger.error(f"Erreur lors de l'export Excel: {str(e)}", exc_info=True)
         error_message = f"Erreur lors de l'export Excel: {str(e)}"
-        return Response({'error': error_message}, status=500)
\ No newline at end of file
+        return Response({'error': error_message}, status=500)
+
+
+# ✅ EXPORTS BRUTS POUR LES OUTILS D'ANALYSE : mêmes colonnes et filtres que PTA_PRINCIPAL, sans mise en forme
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_pta_csv(request):
+    filtres = lire_filtres_activites(request.query_params)
+    logger.info(f"Export CSV par l'utilisateur: {request.user.username} (filtres: {filtres})")
+    # Les lignes sont lues par paquets et envoyées au fil de l'eau
+    response = StreamingHttpResponse(flux_csv_pta(filtres), content_type=CONTENT_TYPE_CSV)
+    response['Content-Disposition'] = f'attachment; filename="{nom_fichier_export("PTA_Export", "csv")}"'
+    return response
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_pta_parquet(request):
+    filtres = lire_filtres_activites(request.query_params)
+    try:
+        chemin, depuis_cache = artefact_parquet_pta(filtres)
+    except ImportError:
+        return Response({'error': "L'export Parquet nécessite le paquet pyarrow"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+    except Exception as e:
+        logger.error(f"Erreur lors de l'export Parquet: {str(e)}", exc_info=True)
+        return Response({'error': f"Erreur lors de l'export Parquet: {str(e)}"}, status=500)
+
+    filename = nom_fichier_export("PTA_Export", "parquet", timestamp=horodatage_artefact(chemin))
+    logger.info(f"Export Parquet réussi: {filename} ({'depuis le cache' if depuis_cache else 'généré'})")
+    return reponse_fichier(request, chemin, filename, CONTENT_TYPE_PARQUET)
+
+
+# ✅ COURBES D'AVANCEMENT PAR SEMAINE / MOIS, PAR STRUCTURE, OBJECTIF... (mêmes filtres que les activités)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def progression_avancement(request):
+    filtres = lire_filtres_activites(request.query_params)
+    pas = request.query_params.get('pas', 'mois')
+    if pas not in PAS:
+        return Response(
+            {'error': f"Pas invalide (valeurs possibles : {', '.join(PAS)})"}, status=status.HTTP_400_BAD_REQUEST,
+        )
+    niveau = request.query_params.get('niveau') or None
+    if niveau and niveau not in NIVEAUX_SERIE:
+        return Response(
+            {'error': f"Niveau invalide (valeurs possibles : {', '.join(NIVEAUX_SERIE)})"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        annee = int(request.query_params.get('annee') or timezone.now().year)
+    except ValueError:
+        return Response({'error': 'Année invalide'}, status=status.HTTP_400_BAD_REQUEST)
+    # La dernière période de l'année est bornée par le début de la suivante : 9999 est exclue
+    if not 1 <= annee <= 9998:
+        return Response({'error': 'Année hors limites (1 à 9998)'}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(serie_progression(filtres, niveau, pas, date(annee, 1, 1), date(annee, 12, 31)))
+
+
+# ✅ SIMULATION « ET SI » : règles sur le coût unitaire ou la quantité, écarts de montant sans écriture en base
+@api_view(['POST'])
+@permission_classes([IsAuthenticated])
+def simulation_budget(request):
+    niveaux = request.data.get('niveaux') or list(NIVEAUX_DEFAUT)
+    if (
+        not isinstance(niveaux, list) or not all(isinstance(niveau, str) for niveau in niveaux)
+        or set(niveaux) - set(NIVEAUX_SIMULATION)
+    ):
+        return Response(
+            {'error': f"Niveaux invalides (valeurs possibles : {', '.join(NIVEAUX_SIMULATION)})"},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    try:
+        regles = lire_regles(request.data.get('regles'))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        return Response(simuler(regles, niveaux))
+    except ValueError as e:
+        return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except ImportError:
+        return Response({'error': "La simulation nécessite le paquet numpy"}, status=status.HTTP_501_NOT_IMPLEMENTED)
+
+
+# ✅ JOURNAL DES REQUÊTES SQL LENTES (avec plan EXPLAIN sur PostgreSQL)
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, AdminOnlyPermission])
+def requetes_lentes(request):
+    try:
+        limite = min(int(request.query_params.get('limite', 100)), 1000)
+    except ValueError:
+        return Response({'error': 'Le paramètre limite doit être un entier'}, status=status.HTTP_400_BAD_REQUEST)
+    entrees = lire_entrees(limite=limite, origine=request.query_params.get('origine') or None)
+    return Response({'count': len(entrees), 'results': entrees})
+
+
+# ✅ PROFILAGE À LA DEMANDE DES PROCHAINES REQUÊTES VERS UNE ROUTE
+@api_view(['GET', 'POST', 'DELETE'])
+@permission_classes([IsAuthenticated, AdminOnlyPermission])
+def profilage(request):
+    if request.method == 'POST':
+        try:
+            requetes = int(request.data.get('requetes', 1))
+        except (TypeError, ValueError):
+            return Response({'error': 'Le champ requetes doit être un entier'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            armer_profilage(
+                request.data.get('route', ''), requetes,
+                request.data.get('mode', 'cprofile'), request.user.username,
+            )
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    elif request.method == 'DELETE':
+        desarmer_profilage()
+    return Response({'etat': etat_profilage(), 'profils': lister_profils()})
+
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, AdminOnlyPermission])
+def telecharger_profil(request, nom):
+    chemin = chemin_profil(nom)
+    if chemin is None:
+        return Response({'error': 'Profil non trouvé'}, status=status.HTTP_404_NOT_FOUND)
+    return FileResponse(open(chemin, 'rb'), as_attachment=True, filename=nom)
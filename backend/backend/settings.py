@@ -45,6 +45,8 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',  # 👈 tout en premier
+    'api.instrumentation.ServerTimingMiddleware',  # requêtes SQL et durées -> en-tête Server-Timing
+    'api.profilage.ProfilageMiddleware',  # profilage à la demande (POST /api/profilage/)
     'django.middleware.security.SecurityMiddleware',
     'django.middleware.common.CommonMiddleware', 
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -109,7 +111,7 @@ CORS_EXPOSE_HEADERS = [
 # Pour les requêtes preflight
 CORS_PREFLIGHT_MAX_AGE = 86400
 
-CORS_EXPOSE_HEADERS = ['Content-Disposition']
+CORS_EXPOSE_HEADERS = ['Content-Disposition', 'Content-Length', 'Content-Range', 'Accept-Ranges', 'ETag', 'Server-Timing']
 
 ROOT_URLCONF = 'backend.urls'
 
@@ -158,6 +160,10 @@ STATICFILES_DIRS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Paquets optionnels, importés à l'usage (la fonction concernée répond 501 sans eux) :
+# numpy (simulation, comparaison d'instantanés, anomalies, prévisions), pyarrow (export Parquet),
+# prometheus_client (/metrics ; sans lui les observations sont ignorées)
+
 # Configuration du serveur de fichiers
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB
@@ -249,6 +255,34 @@ STATIC_URL = 'static/'
 
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Nombre de processus pour les exports ZIP par structure / direction (défaut : nombre de cœurs)
+EXPORTS_PROCESSUS = None
+
+# Worker de jobs (api.jobs) : battement toutes les N secondes ; sans battement depuis JOB_DELAI_ABANDON, le job passe en échec
+JOB_INTERVALLE_BATTEMENT = 30
+JOB_DELAI_ABANDON = 300
+
+# Seuils au-delà desquels une requête HTTP est journalisée (api.instrumentation)
+SEUIL_REQUETES_SQL = 50
+SEUIL_DUREE_REQUETE_MS = 1000
+
+# Journal des requêtes SQL lentes avec plan EXPLAIN (api.requetes_lentes), désactivé par défaut
+REQUETES_LENTES_ACTIF = os.environ.get('REQUETES_LENTES_ACTIF') == '1'
+REQUETES_LENTES_SEUIL_MS = 200
+REQUETES_LENTES_EXPLAIN = True
+REQUETES_LENTES_FICHIER = BASE_DIR / 'logs' / 'requetes_lentes.jsonl'
+REQUETES_LENTES_TAILLE_MAX = 10 * 1024 * 1024
+REQUETES_LENTES_ROTATIONS = 5
+
+# Adresses autorisées à lire /metrics (None = toutes) ; voir api.metriques pour PROMETHEUS_MULTIPROC_DIR
+METRIQUES_IPS_AUTORISEES = ['127.0.0.1', '::1']
+
+# Profilage à la demande (api.profilage)
+PROFILAGE_MAX_REQUETES = 20
+PROFILAGE_DELAI_ARMEMENT = 60
+PROFILAGE_DUREE_MAX = 600
+PROFILAGE_INTERVALLE_MS = 5
+
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
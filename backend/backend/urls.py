@@ -20,11 +20,12 @@ from django.conf import settings
 from django.conf.urls.static import static
 from rest_framework.routers import DefaultRouter
 from api import views
+from api.metriques import vue_metriques
 from api.views import (
     UserProfileViewSet, ServiceViewSet, ResultatAttenduViewSet,
     ObjectifSpecifiqueViewSet, ObjectifGeneralViewSet, ActiviteViewSet,
     PCOPEntryViewSet, SuiviViewSet, DirectionViewSet, DivisionViewSet,
-    export_pta_excel, get_user_profile, create_user_with_profile, update_user_role
+    export_pta_excel, export_pta_csv, export_pta_parquet, progression_avancement, simulation_budget, requetes_lentes, profilage, telecharger_profil, get_dashboard_stats, get_user_profile, create_user_with_profile, update_user_role
 )
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
@@ -40,11 +41,25 @@ router.register(r'divisions', views.DivisionViewSet, basename='division')
 router.register(r'objectifs-generaux', views.ObjectifGeneralViewSet, basename='objectifgeneral')
 router.register(r'objectifs-specifiques', views.ObjectifSpecifiqueViewSet, basename='objectifspecifique')
 router.register(r'resultats-attendus', views.ResultatAttenduViewSet, basename='resultatattendu')
+router.register(r'jobs', views.JobViewSet, basename='job')
+router.register(r'anomalies', views.AnomalieBudgetViewSet, basename='anomalie')
+router.register(r'sources-financement', views.SourceFinancementViewSet, basename='sourcefinancement')
+router.register(r'cibles', views.CibleViewSet, basename='cible')
+router.register(r'instantanes', views.InstantanePTAViewSet, basename='instantane')
 
 urlpatterns = [
     path('admin/', admin.site.urls),
+    path('metrics', vue_metriques, name='metrics'),
     path('api/', include(router.urls)),
     path('api/export-excel/', export_pta_excel, name='export-excel'),
+    path('api/export-csv/', export_pta_csv, name='export-csv'),
+    path('api/export-parquet/', export_pta_parquet, name='export-parquet'),
+    path('api/progression/', progression_avancement, name='progression'),
+    path('api/simulation/', simulation_budget, name='simulation'),
+    path('api/requetes-lentes/', requetes_lentes, name='requetes-lentes'),
+    path('api/profilage/', profilage, name='profilage'),
+    path('api/profilage/<str:nom>/', telecharger_profil, name='telecharger-profil'),
+    path('api/dashboard-stats/', get_dashboard_stats, name='dashboard-stats'),
     path('api/user-profile/', get_user_profile, name='user-profile'),
     path('api/create-user/', create_user_with_profile, name='create-user'),
     path('api/users/<int:user_id>/update-role/', update_user_role, name='update-user-role'),